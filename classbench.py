@@ -0,0 +1,108 @@
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+import cv2
+
+from screenclass import KNOWN_SCREENS, ScreenClassifier
+
+
+def legacy_classify(img, control_dir, screens, threshold):
+    # the old way: one full-resolution matchTemplate per template, template read from disk each time
+    best = None
+    for name, files in screens.items():
+        for fn in files:
+            tpl = cv2.imread(os.path.join(control_dir, fn), cv2.IMREAD_COLOR)
+            if tpl is None:
+                continue
+            r = cv2.matchTemplate(img, tpl, cv2.TM_CCOEFF_NORMED)
+            _min, score, _minl, _maxl = cv2.minMaxLoc(r)
+            if score >= threshold and (best is None or score > best[1]):
+                best = (name, score)
+    return best[0] if best else 'none'
+
+
+def load_labeled(frames_dir):
+    """frames_dir/<screen name or 'none'>/*.png -> [(label, img)]."""
+    out = []
+    for label in sorted(os.listdir(frames_dir)):
+        sub = os.path.join(frames_dir, label)
+        if not os.path.isdir(sub):
+            continue
+        for fn in sorted(os.listdir(sub)):
+            if fn.lower().endswith(('.png', '.jpg', '.bmp')):
+                img = cv2.imdecode(np.fromfile(os.path.join(sub, fn), dtype=np.uint8), cv2.IMREAD_COLOR)
+                if img is not None:
+                    out.append((label, img))
+    return out
+
+
+def synthetic_frames(control_dir, n, size=(1920, 1080), seed=0):
+    """Templates pasted at a fixed spot per screen on a noisy background (static screens)."""
+    rng = np.random.default_rng(seed)
+    w, h = size
+    base = cv2.GaussianBlur(rng.integers(0, 255, (h, w, 3), dtype=np.uint8), (31, 31), 0)
+    spots = {}
+    names = list(KNOWN_SCREENS) + ['none']
+    frames = []
+    for i in range(n):
+        label = names[i % len(names)]
+        img = base.copy()
+        noise = rng.integers(-6, 7, img.shape, dtype=np.int16)
+        if label != 'none':
+            tpl = cv2.imread(os.path.join(control_dir, KNOWN_SCREENS[label][0]), cv2.IMREAD_COLOR)
+            th, tw = tpl.shape[:2]
+            if label not in spots:
+                spots[label] = (int(rng.integers(0, w - tw)), int(rng.integers(0, h - th)))
+            x, y = spots[label]
+            img[y:y + th, x:x + tw] = tpl
+        img = np.clip(img.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+        frames.append((label, img))
+    return frames
+
+
+def _summary(name, times, correct, total):
+    t = sorted(times)
+    print(f"{name:<14} 平均 {1000 * sum(t) / len(t):7.2f} ms  p95 {1000 * t[int(0.95 * (len(t) - 1))]:7.2f} ms  "
+          f"准确率 {100.0 * correct / total:5.1f}% ({correct}/{total})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="界面分类器延迟与准确率测量（对比逐模板全图匹配）")
+    parser.add_argument("frames", nargs='?', help="带标签的截图目录: <目录>/<界面名或none>/*.png")
+    parser.add_argument("--control", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'control'))
+    parser.add_argument("--synthetic", type=int, default=0, help="不提供截图时生成 N 张合成帧")
+    parser.add_argument("--threshold", type=float, default=0.85)
+    args = parser.parse_args()
+
+    frames = load_labeled(args.frames) if args.frames else synthetic_frames(args.control, args.synthetic or 70)
+    if not frames:
+        print("没有可用的截图")
+        return 1
+    print(f"{len(frames)} 帧, 界面: {', '.join(KNOWN_SCREENS)}")
+
+    times, correct = [], 0
+    for label, img in frames:
+        t0 = time.perf_counter()
+        got = legacy_classify(img, args.control, KNOWN_SCREENS, args.threshold)
+        times.append(time.perf_counter() - t0)
+        correct += got == label
+    _summary('逐模板全图', times, correct, len(frames))
+
+    clf = ScreenClassifier(args.control)
+    for phase in ('分类器(冷)', '分类器(热)'):
+        times, correct = [], 0
+        for label, img in frames:
+            t0 = time.perf_counter()
+            found = clf.classify(img, threshold=args.threshold)
+            times.append(time.perf_counter() - t0)
+            correct += (found[0][0] if found else 'none') == label
+        _summary(phase, times, correct, len(frames))
+    print(f"命中途径: {clf.stats}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,217 @@
+import os
+import sys
+import struct
+import argparse
+import threading
+import queue
+
+import numpy as np
+import cv2
+
+
+# ------------------------------
+# Keyframe store (.jfs)
+# ------------------------------
+# Data file: MAGIC | u16 version | u16 reserved | records
+#   record: f8 t | i4 step | u4 length | JPEG bytes
+# Index (<file>.idx.npy): one INDEX_DTYPE row per record, written on close.
+# Record headers make the data file self-describing, so a store whose index
+# was never written (crash while recording) is re-indexed by scanning it.
+MAGIC = b'JJFS'
+FS_VERSION = 1
+FRAME_EXT = '.jfs'
+INDEX_SUFFIX = '.idx.npy'
+
+_REC = struct.Struct('<diI')
+INDEX_DTYPE = np.dtype([
+    ('t', '<f8'),       # seconds from recording start (same clock as the steps' 't')
+    ('step', '<i4'),    # index of the step that triggered the frame, -1 for periodic frames
+    ('offset', '<u8'),  # offset of the JPEG bytes in the data file
+    ('length', '<u4'),
+])
+
+
+def index_path(path):
+    return path + INDEX_SUFFIX
+
+
+class FrameStoreWriter:
+    """Downscale frames on put() and encode/write them on a background thread.
+
+    put() never blocks: when the writer falls behind, frames are dropped and
+    counted in .dropped rather than stalling the capture side.
+    """
+
+    def __init__(self, path, scale=0.25, quality=70, max_queue=32):
+        self.path = path
+        self.scale = scale
+        self.quality = int(quality)
+        self.written = 0
+        self.dropped = 0
+        self._q = queue.Queue(maxsize=max_queue)
+        self._index = []
+        self._f = open(path, 'wb')
+        self._f.write(MAGIC + struct.pack('<HH', FS_VERSION, 0))
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def put(self, t, img, step=-1):
+        if img is None:
+            return False
+        try:
+            if self.scale != 1.0:
+                h, w = img.shape[:2]
+                img = cv2.resize(img, (max(1, int(w * self.scale)), max(1, int(h * self.scale))),
+                                 interpolation=cv2.INTER_AREA)
+            self._q.put_nowait((float(t), int(step), img))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _run(self):
+        params = [int(cv2.IMWRITE_JPEG_QUALITY), self.quality]
+        while True:
+            item = self._q.get()
+            if item is None:
+                return
+            t, step, img = item
+            try:
+                ok, buf = cv2.imencode('.jpg', img, params)
+                if not ok:
+                    continue
+                data = buf.tobytes()
+                self._f.write(_REC.pack(t, step, len(data)))
+                offset = self._f.tell()
+                self._f.write(data)
+                self._index.append((t, step, offset, len(data)))
+                self.written += 1
+            except Exception:
+                self.dropped += 1
+
+    def close(self):
+        """Drain the queue, close the data file and write the index."""
+        self._q.put(None)
+        self._thread.join()
+        self._f.close()
+        idx = np.array(self._index, dtype=INDEX_DTYPE)
+        # np.save appends .npy to names without it; write through a file object to keep ours
+        tmp = index_path(self.path) + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.save(f, idx)
+        os.replace(tmp, index_path(self.path))
+        return idx
+
+
+def scan_index(path):
+    """Rebuild the index from record headers; a truncated last record is ignored."""
+    rows = []
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"不是关键帧文件: {path}")
+        f.read(4)
+        pos = f.tell()
+        while pos + _REC.size <= size:
+            t, step, length = _REC.unpack(f.read(_REC.size))
+            offset = pos + _REC.size
+            if offset + length > size:
+                break
+            rows.append((t, step, offset, length))
+            pos = offset + length
+            f.seek(pos)
+    return np.array(rows, dtype=INDEX_DTYPE)
+
+
+class FrameStore:
+    """Read-only, timestamp-indexed view of a .jfs file (data memory-mapped)."""
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            self.index = np.load(index_path(path))
+        except Exception:
+            self.index = scan_index(path)
+        self._data = np.memmap(path, dtype=np.uint8, mode='r') if len(self.index) else None
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def times(self):
+        return self.index['t']
+
+    def frame(self, i):
+        r = self.index[i]
+        off, n = int(r['offset']), int(r['length'])
+        return cv2.imdecode(np.asarray(self._data[off:off + n]), cv2.IMREAD_COLOR)
+
+    def nearest(self, t):
+        """Index of the frame closest to time t."""
+        times = self.index['t']
+        i = int(np.searchsorted(times, t))
+        if i <= 0:
+            return 0
+        if i >= len(times):
+            return len(times) - 1
+        return i if times[i] - t < t - times[i - 1] else i - 1
+
+    def at(self, t):
+        return self.frame(self.nearest(t))
+
+    def for_step(self, step):
+        """Frame captured for a given step index, or None."""
+        hits = np.nonzero(self.index['step'] == int(step))[0]
+        return self.frame(int(hits[0])) if len(hits) else None
+
+
+def move_store(src, dst):
+    """Move a store and its index (if any) to a new base path."""
+    os.replace(src, dst)
+    if os.path.exists(index_path(src)):
+        os.replace(index_path(src), index_path(dst))
+
+
+def remove_store(path):
+    for p in (path, index_path(path)):
+        try:
+            os.remove(p)
+        except Exception:
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="录制关键帧文件工具")
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    p = sub.add_parser('info', help="显示帧数、时间范围与大小")
+    p.add_argument('path')
+    p = sub.add_parser('export', help="导出为 PNG 图片")
+    p.add_argument('path')
+    p.add_argument('out_dir')
+    p.add_argument('--steps-only', action='store_true', help="只导出步骤触发的帧")
+    args = parser.parse_args()
+
+    store = FrameStore(args.path)
+    if args.cmd == 'info':
+        idx = store.index
+        if not len(idx):
+            print("空文件")
+            return 0
+        size = os.path.getsize(args.path)
+        print(f"{len(idx)} 帧 (步骤帧 {int(np.sum(idx['step'] >= 0))}), "
+              f"{idx['t'][0]:.2f}s ~ {idx['t'][-1]:.2f}s, {size / 1024:.0f} KB, 平均 {size / len(idx) / 1024:.1f} KB/帧")
+        return 0
+    os.makedirs(args.out_dir, exist_ok=True)
+    n = 0
+    for i, r in enumerate(store.index):
+        if args.steps_only and r['step'] < 0:
+            continue
+        tag = f"step{int(r['step']):04d}" if r['step'] >= 0 else 'tick'
+        cv2.imwrite(os.path.join(args.out_dir, f"{r['t']:09.3f}_{tag}.png"), store.frame(i))
+        n += 1
+    print(f"已导出 {n} 帧到 {args.out_dir}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
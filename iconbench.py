@@ -0,0 +1,110 @@
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+import cv2
+
+from iconcatalog import IconCatalog
+
+
+def load_frames(frames_dir):
+    out = []
+    for fn in sorted(os.listdir(frames_dir)):
+        if fn.lower().endswith(('.png', '.jpg', '.bmp')):
+            img = cv2.imdecode(np.fromfile(os.path.join(frames_dir, fn), dtype=np.uint8), cv2.IMREAD_COLOR)
+            if img is not None:
+                out.append(img)
+    return out
+
+
+def synthetic_frames(paths, n, cols=4, rows=3, cell=(180, 170), seed=0):
+    """List-like grids of random catalog icons (one slight rescale per frame, noisy, JPEG-compressed).
+
+    Returns (frames, placed): placed[k] is the set of icon indices drawn into frame k.
+    """
+    rng = np.random.default_rng(seed)
+    icons = [cv2.imdecode(np.fromfile(p, dtype=np.uint8), cv2.IMREAD_COLOR) for p in paths]
+    cw, ch = cell
+    frames, placed = [], []
+    for _ in range(n):
+        drawn = set()
+        s = float(rng.uniform(0.97, 1.03))     # one UI scale per frame
+        img = np.full((rows * ch + 40, cols * cw + 40, 3), 35, np.uint8)
+        img = cv2.add(img, rng.integers(0, 25, img.shape, dtype=np.uint8))
+        for r in range(rows):
+            for c in range(cols):
+                k = int(rng.integers(len(icons)))
+                drawn.add(k)
+                tpl = icons[k]
+                tpl = cv2.resize(tpl, None, fx=s, fy=s, interpolation=cv2.INTER_LINEAR)
+                th, tw = tpl.shape[:2]
+                y, x = 20 + r * ch, 20 + c * cw
+                img[y:y + th, x:x + tw] = tpl[:ch, :cw]
+        ok, buf = cv2.imencode('.jpg', img, [int(cv2.IMWRITE_JPEG_QUALITY), 85])
+        frames.append(cv2.imdecode(buf, cv2.IMREAD_COLOR))
+        placed.append(drawn)
+    return frames, placed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="密函图标直方图预筛选测量：对比逐图标全量匹配的耗时与召回")
+    parser.add_argument("frames", nargs='?', help="保存的列表截图目录（*.png）")
+    parser.add_argument("--catalog", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'control', '武器密函png'))
+    parser.add_argument("--synthetic", type=int, default=0, help="不提供截图时生成 N 张合成列表帧")
+    parser.add_argument("--thresholds", default="0.80,0.85,0.88", help="逗号分隔的预筛选阈值")
+    parser.add_argument("--scales", default="1.05,1.0,0.95", help="模板匹配尺度")
+    parser.add_argument("--match-threshold", type=float, default=0.80)
+    args = parser.parse_args()
+
+    paths = sorted(os.path.join(args.catalog, f) for f in os.listdir(args.catalog) if f.lower().endswith('.png'))
+    placed = None
+    if args.frames:
+        frames = load_frames(args.frames)
+    else:
+        frames, placed = synthetic_frames(paths, args.synthetic or 8)
+    if not paths or not frames:
+        print("没有可用的图标或截图")
+        return 1
+    scales = [float(x) for x in args.scales.split(',') if x.strip()]
+    cat = IconCatalog(paths)
+    print(f"{len(paths)} 个图标, {len(frames)} 帧, 尺度 {scales}")
+
+    # reference: every icon matched on every frame
+    truth = []
+    t0 = time.perf_counter()
+    for img in frames:
+        truth.append({i for i in range(len(paths)) if cat.match(img, i, args.match_threshold, scales)})
+    naive = (time.perf_counter() - t0) / len(frames)
+    print(f"全量匹配      {naive * 1000:8.1f} ms/帧  每帧命中 {sum(map(len, truth)) / len(frames):.1f}")
+
+    for thr in [float(x) for x in args.thresholds.split(',') if x.strip()]:
+        cat.threshold = thr
+        kept = found = total = real = real_total = 0
+        t_filter = t_match = 0.0
+        for k, (img, ref) in enumerate(zip(frames, truth)):
+            t0 = time.perf_counter()
+            cand = cat.candidates(img)
+            t1 = time.perf_counter()
+            hits = {i for i in cand if cat.match(img, i, args.match_threshold, scales)}
+            t_match += time.perf_counter() - t1
+            t_filter += t1 - t0
+            kept += len(cand)
+            found += len(hits & ref)
+            total += len(ref)
+            if placed is not None:
+                # icons actually drawn (the reference also holds look-alikes matching above threshold)
+                real += len(hits & placed[k])
+                real_total += len(placed[k])
+        n = len(frames)
+        recall = 100.0 * found / total if total else 100.0
+        per = (t_filter + t_match) / n
+        real_txt = f"  真实图标召回 {100.0 * real / real_total:5.1f}%" if real_total else ''
+        print(f"预筛选 {thr:.2f}   {per * 1000:8.1f} ms/帧 (筛选 {t_filter / n * 1000:.1f} ms)  "
+              f"保留 {kept / n:.1f}/{len(paths)}  与全量一致 {recall:5.1f}%{real_txt}  加速 x{naive / per:.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
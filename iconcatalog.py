@@ -0,0 +1,186 @@
+import os
+
+import numpy as np
+import cv2
+
+
+# ------------------------------
+# Icon catalog prefilter
+# ------------------------------
+# Color bins: hue (8) x saturation (2) for colored pixels, value (8) for grey ones.
+# Edge bins: gradient orientation (8) for edge pixels, plus one bin for flat pixels
+# so that edge density counts too.
+HUE_BINS = 8
+SAT_SPLIT = 128
+GREY_SAT = 40
+GREY_BINS = 8
+COLOR_BINS = HUE_BINS * 2 + GREY_BINS
+EDGE_BINS = 9
+EDGE_MAG = 40.0
+GRID = 3           # icons and windows are compared block by block on a GRID x GRID layout
+KEEP_BLOCKS = 2    # only the blocks where the catalog's icons differ most are scored
+
+
+def _labels(bgr):
+    """Per-pixel (color bin, edge bin) label images."""
+    hsv = cv2.cvtColor(bgr, cv2.COLOR_BGR2HSV)
+    h = hsv[..., 0].astype(np.int32)
+    s = hsv[..., 1]
+    v = hsv[..., 2].astype(np.int32)
+    color = (h * HUE_BINS // 180) * 2 + (s >= SAT_SPLIT)
+    grey = HUE_BINS * 2 + v * GREY_BINS // 256
+    color = np.where(s < GREY_SAT, grey, color)
+    gray = cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY).astype(np.float32)
+    gx = cv2.Sobel(gray, cv2.CV_32F, 1, 0, ksize=3)
+    gy = cv2.Sobel(gray, cv2.CV_32F, 0, 1, ksize=3)
+    ang = (np.arctan2(gy, gx) % np.pi) * (8.0 / np.pi)
+    edge = np.minimum(ang.astype(np.int32), 7)
+    edge = np.where(cv2.magnitude(gx, gy) >= EDGE_MAG, edge, 8)
+    return color, edge
+
+
+def _block_hists(labels, bins, bh, bw, cell):
+    """(GRID * GRID, bins) sqrt-normalized histograms of an icon's blocks, each bh x bw cells."""
+    h, w = GRID * bh * cell, GRID * bw * cell
+    lab = cv2.resize(labels.astype(np.uint8), (w, h), interpolation=cv2.INTER_NEAREST).astype(np.int32)
+    out = []
+    for by in range(GRID):
+        for bx in range(GRID):
+            blk = lab[by * bh * cell:(by + 1) * bh * cell, bx * bw * cell:(bx + 1) * bw * cell]
+            n = np.bincount(blk.ravel(), minlength=bins).astype(np.float32)
+            out.append(np.sqrt(n / max(1.0, float(n.sum()))))
+    return np.array(out, np.float32)
+
+
+def _cell_hists(labels, bins, cell):
+    """(gh, gw, bins) label counts per cell x cell block (partial blocks at the edges dropped)."""
+    gh, gw = labels.shape[0] // cell, labels.shape[1] // cell
+    lab = labels[:gh * cell, :gw * cell]
+    cy = np.arange(gh * cell) // cell
+    cx = np.arange(gw * cell) // cell
+    idx = ((cy[:, None] * gw + cx[None, :]) * bins + lab).ravel()
+    return np.bincount(idx, minlength=gh * gw * bins).reshape(gh, gw, bins).astype(np.float32)
+
+
+def _integral(cells):
+    ii = np.zeros((cells.shape[0] + 1, cells.shape[1] + 1, cells.shape[2]), np.float32)
+    ii[1:, 1:] = cells.cumsum(0).cumsum(1)
+    return ii
+
+
+def _box_hists(ii, bh, bw):
+    """sqrt-normalized histogram of every bh x bw box of cells: (gh - bh + 1, gw - bw + 1, bins)."""
+    w = ii[bh:, bw:] - ii[:-bh, bw:] - ii[bh:, :-bw] + ii[:-bh, :-bw]
+    return np.sqrt(w / np.maximum(1.0, w.sum(axis=2, keepdims=True)))
+
+
+class IconCatalog:
+    """Color/edge histogram prefilter in front of per-icon template matching.
+
+    Catalog icons share a card frame, so whole-icon histograms hardly differ;
+    each icon is described by GRID x GRID block histograms (color and edge
+    orientation) instead, computed once, and only the KEEP_BLOCKS blocks in
+    which the catalog's icons are least alike are used. For a frame or list
+    strip, cell histograms are summed into every block-sized box with an
+    integral histogram; each icon-sized window is scored by its worst used
+    block (product of the color and edge Bhattacharyya coefficients, one
+    matrix product per block and histogram for all windows and icons). An
+    icon survives if its best window reaches `threshold`; only survivors are
+    template matched.
+    """
+
+    def __init__(self, paths, scale=0.5, cell=4, threshold=0.85):
+        self.paths = list(paths)
+        self.scale = scale
+        self.cell = cell
+        self.threshold = threshold
+        self.icons = []
+        groups = {}
+        for i, p in enumerate(self.paths):
+            img = cv2.imdecode(np.fromfile(p, dtype=np.uint8), cv2.IMREAD_COLOR) if os.path.isfile(p) else None
+            self.icons.append(img)
+            if img is None:
+                continue
+            small = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            bh = max(1, int(round(small.shape[0] / (cell * GRID))))
+            bw = max(1, int(round(small.shape[1] / (cell * GRID))))
+            c, e = _labels(small)
+            groups.setdefault((bh, bw), []).append(
+                (i, _block_hists(c, COLOR_BINS, bh, bw, cell), _block_hists(e, EDGE_BINS, bh, bw, cell)))
+        # (bh, bw) -> (icon indices, color (blocks, bins, K), edge (blocks, bins, K))
+        self._groups = {}
+        for key, items in groups.items():
+            idx = [it[0] for it in items]
+            self._groups[key] = (np.array(idx), np.stack([it[1] for it in items], axis=2),
+                                 np.stack([it[2] for it in items], axis=2))
+        # blocks where catalog icons differ the most (the shared card frame is alike everywhere)
+        if not self._groups:
+            self.blocks = []
+            return
+        allc = np.concatenate([g[1] for g in self._groups.values()], axis=2)
+        alle = np.concatenate([g[2] for g in self._groups.values()], axis=2)
+        sim = [float(np.mean((allc[k].T @ allc[k]) * (alle[k].T @ alle[k]))) for k in range(GRID * GRID)]
+        self.blocks = [int(k) for k in np.argsort(sim)[:KEEP_BLOCKS]]
+
+    def scores(self, img):
+        """Best-window prefilter score per icon (array aligned with .paths; 1.0 = could not be ruled out)."""
+        out = np.zeros(len(self.paths), np.float32)
+        small = cv2.resize(img, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        c, e = _labels(small)
+        iic = _integral(_cell_hists(c, COLOR_BINS, self.cell))
+        iie = _integral(_cell_hists(e, EDGE_BINS, self.cell))
+        gh, gw = iic.shape[0] - 1, iic.shape[1] - 1
+        for (bh, bw), (idx, col, edg) in self._groups.items():
+            ny, nx = gh - GRID * bh + 1, gw - GRID * bw + 1
+            if ny < 1 or nx < 1:
+                # window larger than the image: leave it to the matcher
+                out[idx] = 1.0
+                continue
+            bc = _box_hists(iic, bh, bw)
+            be = _box_hists(iie, bh, bw)
+            worst = None
+            for k in self.blocks:
+                by, bx = divmod(k, GRID)
+                wc = bc[by * bh:by * bh + ny, bx * bw:bx * bw + nx].reshape(-1, COLOR_BINS)
+                we = be[by * bh:by * bh + ny, bx * bw:bx * bw + nx].reshape(-1, EDGE_BINS)
+                sk = (wc @ col[k]) * (we @ edg[k])
+                worst = sk if worst is None else np.minimum(worst, sk)
+            out[idx] = worst.max(axis=0)
+        return out
+
+    def candidates(self, img, limit=None):
+        """Indices of icons that may be in img (among the first `limit`), in catalog order."""
+        sc = self.scores(img)
+        if limit is not None:
+            sc = sc[:limit]
+        return [int(i) for i in np.nonzero(sc >= self.threshold)[0]]
+
+    def match(self, img, i, threshold=0.80, scales=(1.1, 1.05, 1.0, 0.95, 0.9)):
+        """Template match of icon i: match dict or None."""
+        tpl = self.icons[i]
+        if tpl is None:
+            return None
+        ih, iw = img.shape[:2]
+        best = None
+        for s in scales:
+            t = tpl if s == 1.0 else cv2.resize(tpl, None, fx=s, fy=s, interpolation=cv2.INTER_LINEAR)
+            th, tw = t.shape[:2]
+            if th > ih or tw > iw:
+                continue
+            r = cv2.matchTemplate(img, t, cv2.TM_CCOEFF_NORMED)
+            _min, score, _minl, loc = cv2.minMaxLoc(r)
+            if best is None or score > best[0]:
+                best = (score, loc, tw, th)
+        if best is None or best[0] < threshold:
+            return None
+        score, (x, y), w, h = best
+        return {'score': float(score), 'rect': (x, y, w, h), 'center': (x + w // 2, y + h // 2)}
+
+    def visible(self, img, threshold=0.80, scales=(1.1, 1.05, 1.0, 0.95, 0.9)):
+        """[(index, match)] of catalog icons found in img; only prefilter survivors are matched."""
+        out = []
+        for i in self.candidates(img):
+            m = self.match(img, i, threshold, scales)
+            if m:
+                out.append((i, m))
+        return out
@@ -0,0 +1,26 @@
+# ------------------------------
+# Key name -> Windows virtual-key code
+# ------------------------------
+# Shared by playback (main.py) and the script analyzer (scripttool.py), so a
+# script the analyzer accepts is one the player can dispatch. The codes are
+# the win32con VK_* values; no pywin32 import is needed to resolve them.
+NAMED_VK = {
+    'space': 0x20,      # VK_SPACE
+    'shift': 0x10,      # VK_SHIFT
+    'ctrl': 0x11,       # VK_CONTROL
+    'control': 0x11,
+    'alt': 0x12,        # VK_MENU
+    'tab': 0x09,        # VK_TAB
+    'esc': 0x1B,        # VK_ESCAPE
+    'escape': 0x1B,
+}
+
+
+def vk_from_key_name(name: str) -> int:
+    """Virtual-key code for a recorded key name; ValueError if it cannot be dispatched."""
+    name = name.strip().lower()
+    if len(name) == 1:
+        return ord(name.upper())
+    if name in NAMED_VK:
+        return NAMED_VK[name]
+    raise ValueError(f"Unsupported key: {name}")
@@ -0,0 +1,203 @@
+import os
+import time
+import random
+
+from telemetry import format_round
+
+
+class Screen:
+    """One known UI screen of a mode.
+
+    templates: control/ file names; the screen is showing if any of them matches.
+    action(app, sm, m): called with the match handle as soon as the screen is
+        recognized; return 'stop' to end the run.
+    next: names of the screens expected after this one (polled first, and
+        used to key the learned polling intervals).
+    guard(sm): optional; the screen is ignored while it returns False (e.g.
+        the in-map marker after the route has already been played).
+    scales: match over these template scales instead of 1.0 only.
+    repeat_after: seconds before the same screen is acted on again when it
+        is still showing right after its own action (a slow transition).
+    phase: telemetry phase that starts when the screen is recognized
+        (see telemetry.PHASES).
+    """
+
+    def __init__(self, name, templates, action, next=(), guard=None, threshold=None, scales=None,
+                 repeat_after=3.0, phase=None):
+        self.name = name
+        self.templates = list(templates)
+        self.action = action
+        self.next = tuple(next)
+        self.guard = guard
+        self.threshold = threshold
+        self.scales = scales
+        self.repeat_after = repeat_after
+        self.phase = phase
+
+
+class StateMachine:
+    """Polls one frame at a time, classifies it against all screens and acts.
+
+    Unlike a fixed sequence of _wait_and_click calls, a screen that shows up
+    out of order is handled right away instead of stalling until the
+    expected one times out. The run stops on 'stop' from an action, on
+    app.running going False, or when no screen is recognized for
+    app.timeout_seconds.
+    """
+
+    def __init__(self, app, screens, start=(), ctx=None):
+        self.app = app
+        self.screens = list(screens)
+        self.by_name = {s.name: s for s in self.screens}
+        self.start = tuple(start)
+        self.ctx = dict(ctx or {})
+        self.current = None
+        self.prev = None
+        self.acted_at = 0.0
+
+    # Classification
+    def expected(self):
+        if self.current is None:
+            return self.start
+        return self.by_name[self.current].next
+
+    def candidates(self):
+        """Guarded screens, expected ones first, then the rest in declaration order."""
+        exp = [self.by_name[n] for n in self.expected() if n in self.by_name]
+        rest = [s for s in self.screens if s not in exp]
+        now = time.time()
+        out = []
+        for s in exp + rest:
+            if s.guard is not None and not s.guard(self):
+                continue
+            if s.name == self.current and now - self.acted_at < s.repeat_after:
+                continue
+            out.append(s)
+        return out
+
+    def classify(self, img):
+        """(screen, match) for the first candidate screen visible in img, or (None, None)."""
+        if img is None:
+            return None, None
+        app = self.app
+        clf = getattr(app, 'classifier', None)
+        # gray/downscaled copies of the frame are made once and shared by every template
+        fctx = clf.context(img) if clf is not None else None
+        for screen in self.candidates():
+            thr = app.threshold if screen.threshold is None else screen.threshold
+            for fn in screen.templates:
+                path = os.path.join(app.control_dir, fn)
+                if clf is not None:
+                    app.telemetry.count('matches')
+                    m = clf.match(fctx, path, thr, screen.scales)
+                elif screen.scales:
+                    m = app.match_template_scales(img, path, thr, screen.scales)
+                else:
+                    m = app.match_template(img, path, thr)
+                if m:
+                    m['frame_id'] = app.capturer.frame_id
+                    return screen, m
+        return None, None
+
+    # Main loop
+    def run(self):
+        app = self.app
+        timeout = float(app.timeout_seconds)
+        last_progress = time.time()
+        while app.running and not app.stop_event.is_set():
+            screen, m = self.classify(app._grab())
+            if screen is None:
+                if time.time() - last_progress > timeout:
+                    exp = '/'.join(self.expected()) or '任意界面'
+                    app._log(f"⏰ 等待 {exp} 超时，已停止。")
+                    app.running = False
+                    return False
+                exp = self.expected()
+                app._poll_sleep(app._poll_key(exp[0] if exp else 'screen'))
+                continue
+            if self.current is not None and screen.name not in self.expected():
+                app._log(f"🔀 非预期界面 {screen.name}（上一界面 {self.current}），直接处理")
+            app._log(f"🔍 识别到 {screen.name} (score={m['score']:.2f})")
+            app._poll_hit(app._poll_key(screen.name), screen.name)
+            if screen.phase:
+                app.telemetry.enter(screen.phase)
+            elif app.telemetry.phase == 'result':
+                # the first screen after the route is the result: from here on the round restarts
+                app.telemetry.enter('restart')
+            self.prev, self.current = self.current, screen.name
+            try:
+                res = screen.action(app, self, m)
+            except Exception as e:
+                app._log(f"⚠️ 界面 {screen.name} 处理异常: {e}")
+                res = None
+            last_progress = self.acted_at = time.time()
+            if res == 'stop':
+                return True
+        return False
+
+
+# ------------------------------
+# Shared actions
+# ------------------------------
+def click(alias, expect=None):
+    """Action that clicks the recognized button (expect: control file that ends the settle wait)."""
+    def _act(app, sm, m):
+        app.click_match(m, alias, expect=expect)
+    return _act
+
+
+def play_map_route(app, next_alias):
+    """Recognize the map (one retry), pick its script (random fallback if enabled) and play it.
+
+    Returns False when the run has to stop (no script, fallback disabled).
+    """
+    app.telemetry.enter('recognize')
+    map_name = app._recognize_map_name()
+    if not map_name:
+        app._log('🗺️ 地图识别失败，重试一次...')
+        app.wait(0.3)
+        map_name = app._recognize_map_name()
+    if map_name:
+        steps = app._load_actions(map_name)
+        exec_name = map_name
+    else:
+        if not app.fail_fallback_random:
+            app._log('🚫 地图仍未识别，且未开启随机脚本策略，停止。')
+            app.running = False
+            return False
+        try:
+            files = [f for f in os.listdir(app.json_dir) if f.lower().endswith(('.json', '.actb'))]
+        except Exception:
+            files = []
+        if not files:
+            app._log('📂 无可用脚本可供随机选择，停止。')
+            app.running = False
+            return False
+        pick = random.choice(files)
+        exec_name = os.path.splitext(pick)[0]
+        app._log(f"🎲 地图仍未识别，随机选择脚本: {pick}")
+        steps = app._load_actions(exec_name)
+    if not steps:
+        app._log('📋 未加载到动作步骤，停止。')
+        app.running = False
+        return False
+    app.telemetry.set_map(exec_name)
+    app._log(f"🎮 开始执行 {exec_name} 的移动脚本，共 {len(steps)} 步")
+    app.telemetry.enter('playback')
+    app.play_route(steps, exec_name, next_alias)
+    app.telemetry.enter('result')
+    app._log(f"🏃 移动操作结束，等待 {next_alias}")
+    return True
+
+
+def finish_round(app):
+    """Count a finished round; returns 'stop' once max_loops is reached."""
+    done = app.telemetry.end_round()
+    if done:
+        app._log(format_round(done))
+    app.report_settle_round()
+    if app.max_loops and app.loops_done >= app.max_loops:
+        app._log(f"已完成设定的循环次数 {app.max_loops}，停止运行。")
+        app.running = False
+        return 'stop'
+    return None
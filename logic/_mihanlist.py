@@ -0,0 +1,376 @@
+import os
+import json
+
+import cv2
+import numpy as np
+
+from iconcatalog import IconCatalog
+
+
+# ------------------------------
+# Scroll-aware list search
+# ------------------------------
+CATALOG_MIN = 4     # wish lists at least this long go through the icon histogram prefilter
+
+
+def list_column(img, anchor_x, half_width):
+    """(x0, x1) of the list column around anchor_x, clipped to the frame."""
+    w = img.shape[1]
+    return max(0, int(anchor_x - half_width)), min(w, int(anchor_x + half_width))
+
+
+def scroll_shift(prev, cur, scale=0.5):
+    """Vertical displacement (pixels, + = content moved down) between two crops of the list.
+
+    Phase correlation on downscaled grayscale copies. Returns (dy, response);
+    a low response means the estimate is unreliable (e.g. the list repainted).
+    """
+    a = cv2.cvtColor(prev, cv2.COLOR_BGR2GRAY) if prev.ndim == 3 else prev
+    b = cv2.cvtColor(cur, cv2.COLOR_BGR2GRAY) if cur.ndim == 3 else cur
+    if scale != 1.0:
+        a = cv2.resize(a, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        b = cv2.resize(b, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    a = a.astype(np.float32)
+    b = b.astype(np.float32)
+    win = cv2.createHanningWindow((a.shape[1], a.shape[0]), cv2.CV_32F)
+    (_dx, dy), response = cv2.phaseCorrelate(a, b, win)
+    return dy / scale, float(response)
+
+
+def changed_rows(prev, cur, thr=4.0):
+    """(top, bottom) row range that differs between two crops, or None if nothing changed.
+
+    The scrolling list changes after a wheel notch while headers and frames
+    around it do not, so this bounds the part of the crop the list occupies.
+    """
+    d = cv2.absdiff(prev, cur)
+    if d.ndim == 3:
+        d = d.max(axis=2)
+    rows = np.nonzero(d.mean(axis=1) > thr)[0]
+    if not len(rows):
+        return None
+    return int(rows[0]), int(rows[-1]) + 1
+
+
+class ListSearch:
+    """Wheel through a vertical list looking for a template, matching only what scrolled in.
+
+    After each wheel notch the displacement of the list column is measured
+    against the previous frame; only the newly revealed strip at the edge
+    of the part that moved (plus one template height of overlap, so rows cut
+    by the edge are caught) is matched, and rows already matched on the way
+    down are not matched again on the way back up. A notch that moves nothing means the end of the list in that
+    direction: the search turns around once, then gives up.
+
+    column: (x0, x1) image-x range of the list; the strip outside it (headers,
+    side panels) does not move and would bias the displacement estimate.
+
+    pos is the measured content offset (pixels scrolled down since the first
+    frame of the search), so notches clamped at a list end count for what
+    they actually moved. anchored turns False when an unreliable estimate
+    forced a re-anchor; offsets are then no longer relative to that frame.
+    """
+
+    def __init__(self, app, wheel_pos, column, scales=(1.1, 1.05, 1.0, 0.95, 0.9), threshold=0.80,
+                 max_notches=20, settle=0.3, min_shift=2.0, min_response=0.1):
+        self.app = app
+        self.wheel_pos = wheel_pos
+        self.column = column
+        self.scales = list(scales)
+        self.threshold = threshold
+        self.max_notches = int(max_notches)
+        self.settle = settle
+        self.min_shift = min_shift
+        self.min_response = min_response
+        self.notches = 0
+        self.pos = 0.0
+        self.anchored = True
+        self.hit = None         # (pos, rect) where the returned match was seen
+        self.matched_rows = 0
+        self._shifts = []       # |dy| of notches that scrolled a full step
+        self._span = None       # (top, bottom) rows of the list seen moving
+        self._catalog = None
+
+    @property
+    def notch_px(self):
+        """Median content shift of one unclamped wheel notch, or None before one was measured."""
+        if not self._shifts:
+            return None
+        return float(np.median(self._shifts))
+
+    def _crop(self, img):
+        x0, x1 = self.column
+        return img[:, max(0, x0):min(img.shape[1], x1)]
+
+    def _match(self, img, tpl_path, y0=0, y1=None):
+        """Match inside rows [y0, y1) of the list column; match dict in frame coords or None."""
+        x0 = max(0, self.column[0])
+        sub = self._crop(img)[max(0, y0):y1]
+        self.matched_rows += sub.shape[0]
+        m = self.app.match_template_scales(sub, tpl_path, self.threshold, self.scales)
+        if not m:
+            return None
+        x, y, w, h = m['rect']
+        x += x0
+        y += max(0, y0)
+        m['rect'] = (x, y, w, h)
+        m['center'] = (x + w // 2, y + h // 2)
+        m['frame_id'] = self.app.capturer.frame_id
+        return m
+
+    def match_roi(self, img, tpl_path, rect, pad=24):
+        """Single-scale match of the template in a padded window around a known rect."""
+        tpl = cv2.imread(tpl_path, cv2.IMREAD_COLOR)
+        if img is None or tpl is None:
+            return None
+        x, y, w, h = [int(round(v)) for v in rect]
+        pad = int(np.ceil(pad))
+        s = w / float(tpl.shape[1])
+        ih, iw = img.shape[:2]
+        x0, y0 = max(0, x - pad), max(0, y - pad)
+        sub = img[y0:min(ih, y + h + pad), x0:min(iw, x + w + pad)]
+        m = self.app.match_template_scales(sub, tpl_path, self.threshold, [s])
+        if not m:
+            return None
+        mx, my, mw, mh = m['rect']
+        m['rect'] = (x0 + mx, y0 + my, mw, mh)
+        m['center'] = (x0 + mx + mw // 2, y0 + my + mh // 2)
+        m['frame_id'] = self.app.capturer.frame_id
+        return m
+
+    def _step(self, delta):
+        app = self.app
+        if not app.send_mouse_wheel(delta=delta, count=1, client_pos=self.wheel_pos, gap=0.0, quiet=True):
+            return None
+        self.notches += 1
+        app.wait_settle(self.settle, floor=0.0)
+        return app._grab()
+
+    def _match_any(self, img, paths, limit, y0=0, y1=None):
+        """Highest-priority (index, match) among paths[:limit] in rows [y0, y1), or (None, None)."""
+        order = range(limit)
+        if self._catalog is not None:
+            # long wish lists: histogram prefilter first, template match only the survivors
+            order = self._catalog.candidates(self._crop(img)[max(0, y0):y1], limit)
+        for i in order:
+            m = self._match(img, paths[i], y0, y1)
+            if m:
+                return i, m
+        return None, None
+
+    def _scroll_to(self, pos, rect=None):
+        """Scroll to about content offset pos in one wheel message; (frame, residual pixels).
+
+        The residual is how far the content still is from pos (assuming the
+        wheel was not clamped): a rect seen at pos is expected that much lower.
+        Whole notches rarely land on pos exactly; with rect, the notch count
+        that brings it closest to the middle of the list is used.
+        """
+        step = self.notch_px
+        n = 0
+        if step:
+            k = (pos - self.pos) / step
+            n = int(round(k))
+            if rect is not None and self._span is not None:
+                mid = (self._span[0] + self._span[1]) / 2.0 - rect[1] - rect[3] / 2.0
+                n = min((int(np.floor(k)), int(np.ceil(k))),
+                        key=lambda c: abs(pos - (self.pos + c * step) - mid))
+        if n:
+            self.app.send_mouse_wheel(delta=-120 * n, count=1, client_pos=self.wheel_pos, quiet=True)
+            self.notches += abs(n)
+            self.pos += n * step
+            self.app.wait_settle(self.settle, floor=0.0)
+        return self.app._grab(), pos - self.pos
+
+    def find(self, tpl_path):
+        """Match dict of the target, or None once both list ends were reached / max_notches spent."""
+        return self.find_any([tpl_path])[1]
+
+    def find_any(self, tpl_paths):
+        """(index, match) of the highest-priority template found in one pass, or (None, None).
+
+        Every frame is matched against all templates ranked above the best
+        hit so far; the pass ends early on a hit of tpl_paths[0]. The best
+        hit is then looked up in the last frame, and only if it scrolled out
+        of view is the list scrolled back to where it was seen.
+        """
+        app = self.app
+        tpls = [cv2.imread(p, cv2.IMREAD_COLOR) for p in tpl_paths]
+        hs = [t.shape[0] for t in tpls if t is not None]
+        if not hs:
+            return None, None
+        tpl_h = int(np.ceil(max(hs) * max(self.scales)))
+        self._catalog = IconCatalog(tpl_paths) if len(tpl_paths) >= CATALOG_MIN else None
+        img = app._grab()
+        if img is None:
+            return None, None
+        best = None             # (index, match, pos when seen)
+        i, m = self._match_any(img, tpl_paths, len(tpl_paths))
+        if m:
+            best = (i, m, self.pos)
+            if i == 0:
+                return self._found(best, m)
+        # pos: how far the list has scrolled down from the first frame (content pixels);
+        # [lo, hi]: the range of pos values whose viewport has already been matched
+        pos = lo = hi = self.pos
+        budget = self.max_notches
+        for delta in (-120, 120):
+            used = 0
+            while used < budget:
+                if not app.running:
+                    return None, None
+                cur = self._step(delta)
+                if cur is None:
+                    return None, None
+                used += 1
+                dy, resp = scroll_shift(self._crop(img), self._crop(cur))
+                span = changed_rows(self._crop(img), self._crop(cur))
+                img = cur
+                top, bottom = span if span else (0, cur.shape[0])
+                if span:
+                    self._span = span
+                limit = best[0] if best else len(tpl_paths)
+                i = m = None
+                if resp < self.min_response:
+                    # unreliable estimate: look at the whole column once and re-anchor there
+                    i, m = self._match_any(cur, tpl_paths, limit)
+                    pos = lo = hi = 0.0
+                    self.anchored = False
+                elif abs(dy) < self.min_shift or span is None:
+                    # nothing moved: the list end (the notch does not count)
+                    break
+                else:
+                    if not self._shifts or abs(dy) >= 0.8 * self.notch_px:
+                        self._shifts.append(abs(dy))
+                    new = pos - dy
+                    if new > hi:
+                        # rows scrolled in at the bottom that were never matched
+                        i, m = self._match_any(cur, tpl_paths, limit,
+                                               int(bottom - (new - max(hi, pos))) - tpl_h - 4, bottom)
+                        hi = new
+                    elif new < lo:
+                        i, m = self._match_any(cur, tpl_paths, limit, top, top + int(min(lo, pos) - new) + tpl_h + 4)
+                        lo = new
+                    pos = new
+                self.pos = pos
+                if m:
+                    best = (i, m, pos)
+                    if i == 0:
+                        return self._found(best, m)
+            # going back up first crosses everything already seen
+            budget = used + self.max_notches
+        if best is None:
+            return None, None
+        i, m, seen = best
+        if seen == self.pos:
+            return self._found(best, m)
+        # often still in view after the last notches (the list end clamps the scroll)
+        m2 = self._match(img, tpl_paths[i])
+        if m2 is None:
+            cur, resid = self._scroll_to(seen, m['rect'])
+            x, y, w, h = m['rect']
+            m2 = self.match_roi(cur, tpl_paths[i], (x, y + resid, w, h), pad=24 + abs(resid)) \
+                or self._match(cur, tpl_paths[i])
+        return self._found(best, m2) if m2 else (None, None)
+
+    def _found(self, best, m):
+        i, m_seen, seen = best
+        self.hit = (seen, m_seen['rect'])
+        return i, m
+
+
+# ------------------------------
+# Remembered list positions
+# ------------------------------
+class PositionCache:
+    """Where each mihan was found: measured content offset from the list's opening position, the
+    pixels one wheel notch scrolls, and its rect.
+
+    Kept in <base_dir>/mihan_positions.json so later rounds (and runs) can
+    scroll straight there in one wheel message and verify with one ROI match.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.entries = {str(k): v for k, v in json.load(f).items()}
+        except Exception:
+            self.entries = {}
+
+    @classmethod
+    def for_app(cls, app):
+        cache = getattr(app, '_mihan_positions', None)
+        if cache is None:
+            cache = cls(os.path.join(app.base_dir, 'mihan_positions.json'))
+            app._mihan_positions = cache
+        return cache
+
+    def save(self):
+        try:
+            with open(self.path, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f, ensure_ascii=False, indent=2)
+        except Exception:
+            pass
+
+    def get(self, key, frame_shape):
+        ent = self.entries.get(key)
+        if ent is None or list(ent.get('frame', [])) != list(frame_shape[:2]) or 'offset' not in ent:
+            return None
+        return ent
+
+    def put(self, key, offset, notch_px, rect, frame_shape):
+        self.entries[key] = {'offset': round(float(offset), 1), 'notch_px': round(float(notch_px), 2),
+                             'rect': [int(v) for v in rect], 'frame': [int(v) for v in frame_shape[:2]]}
+        self.save()
+
+    def drop(self, key):
+        if self.entries.pop(key, None) is not None:
+            self.save()
+
+
+def find_mihan(app, search, tpl_paths):
+    """Locate the highest-priority available mihan in the open list: (path, match) or (None, None).
+
+    A remembered position of the first wish is replayed as one wheel message
+    (its offset in whole notches) and checked with a single ROI match; on a
+    miss the entry is dropped and ListSearch.find_any takes over from
+    wherever the list now is. Lower wishes never use the cache, so a first
+    wish that is back in stock is not skipped. Only offsets measured from the
+    list's opening position are stored.
+    """
+    if not tpl_paths:
+        return None, None
+    cache = PositionCache.for_app(app)
+    key_of = lambda p: os.path.relpath(p, app.control_dir)
+    img = app._grab()
+    if img is None:
+        return None, None
+    moved = False
+    ent = cache.get(key_of(tpl_paths[0]), img.shape)
+    if ent is not None:
+        step = ent.get('notch_px') or 0.0
+        n = int(round(ent['offset'] / step)) if step else 0
+        if n:
+            app.send_mouse_wheel(delta=-120 * n, count=1, client_pos=search.wheel_pos, quiet=True)
+            app.wait_settle(search.settle, floor=0.0)
+            img = app._grab()
+        # whole notches leave the content short of (or past) the stored offset by the remainder
+        resid = ent['offset'] - n * step
+        x, y, w, h = ent['rect']
+        m = search.match_roi(img, tpl_paths[0], (x, y + resid, w, h), pad=24 + abs(resid))
+        if m:
+            app._log(f"📌 按记忆位置定位密函（滚动 {n} 格）")
+            return tpl_paths[0], m
+        app._log('📌 记忆位置校验失败，改为滚动搜索')
+        cache.drop(key_of(tpl_paths[0]))
+        moved = n != 0
+    i, m = search.find_any(tpl_paths)
+    if m is None:
+        return None, None
+    if not moved and search.anchored and search.hit:
+        seen, rect = search.hit
+        if seen == 0 or search.notch_px:
+            cache.put(key_of(tpl_paths[i]), seen, search.notch_px or 0.0, rect, img.shape)
+    return tpl_paths[i], m
@@ -0,0 +1,139 @@
+import os
+
+import cv2
+import numpy as np
+
+
+# ------------------------------
+# Single-frame reward evaluation
+# ------------------------------
+TIERS = ('first', 'second', 'third')     # slot badges, best first
+AFFIX_SECOND = 'cishi-second'            # item shown on an affixed second slot (avoided)
+
+
+def nms(boxes, scores, iou_thr=0.3):
+    """Indices of boxes kept by greedy non-maximum suppression (boxes: (N, 4) x, y, w, h)."""
+    if not len(boxes):
+        return []
+    b = np.asarray(boxes, np.float32)
+    x0, y0 = b[:, 0], b[:, 1]
+    x1, y1 = x0 + b[:, 2], y0 + b[:, 3]
+    area = b[:, 2] * b[:, 3]
+    ix = np.maximum(0.0, np.minimum(x1[:, None], x1[None, :]) - np.maximum(x0[:, None], x0[None, :]))
+    iy = np.maximum(0.0, np.minimum(y1[:, None], y1[None, :]) - np.maximum(y0[:, None], y0[None, :]))
+    inter = ix * iy
+    iou = inter / (area[:, None] + area[None, :] - inter + 1e-6)
+    order = np.argsort(-np.asarray(scores))
+    alive = np.ones(len(b), bool)
+    keep = []
+    for i in order:
+        if not alive[i]:
+            continue
+        keep.append(int(i))
+        alive &= iou[i] <= iou_thr
+    return keep
+
+
+def find_peaks(img, tpl, threshold, max_peaks=12):
+    """All matches of tpl in img above threshold (one per instance), best first."""
+    th, tw = tpl.shape[:2]
+    if th > img.shape[0] or tw > img.shape[1]:
+        return []
+    r = cv2.matchTemplate(img, tpl, cv2.TM_CCOEFF_NORMED)
+    # local maxima over a template-sized neighbourhood, then NMS on the boxes
+    peak = r >= cv2.dilate(r, np.ones((max(1, th // 2), max(1, tw // 2)), np.uint8))
+    ys, xs = np.nonzero(peak & (r >= threshold))
+    if not len(xs):
+        return []
+    scores = r[ys, xs]
+    top = np.argsort(-scores)[:max_peaks * 4]
+    boxes = [(int(xs[i]), int(ys[i]), tw, th) for i in top]
+    keep = nms(boxes, scores[top])[:max_peaks]
+    out = []
+    for k in keep:
+        x, y, w, h = boxes[k]
+        out.append({'score': float(scores[top][k]), 'rect': (x, y, w, h), 'center': (x + w // 2, y + h // 2)})
+    return out
+
+
+def item_tier(name):
+    """Tier an item icon belongs to, from its '-first'/'-second'/'-third' suffix (None if it has none)."""
+    tier = name.rsplit('-', 1)[-1]
+    return tier if '-' in name and tier in TIERS else None
+
+
+def pair_items(slots, items, max_dist_factor=3.0):
+    """Attach each item icon to the nearest free slot badge of its own tier (greedy by distance).
+
+    slots: [{'tier', 'm', ...}], items: [(name, match)]; sets slot['item'].
+    """
+    pairs = []
+    for j, (name, m) in enumerate(items):
+        ix, iy = m['center']
+        reach = max_dist_factor * max(m['rect'][2], m['rect'][3])
+        tier = item_tier(name)
+        for i, s in enumerate(slots):
+            if tier is not None and s['tier'] != tier:
+                continue
+            sx, sy = s['m']['center']
+            d = float(np.hypot(ix - sx, iy - sy))
+            if d <= reach:
+                pairs.append((d, i, j))
+    used_s, used_i = set(), set()
+    for d, i, j in sorted(pairs):
+        if i in used_s or j in used_i:
+            continue
+        slots[i]['item'] = items[j][0]
+        used_s.add(i)
+        used_i.add(j)
+
+
+def rank_slot(slot, third_pref):
+    """Smaller is better: first > second > preferred thirds > other thirds > affixed second."""
+    tier, item = slot['tier'], slot.get('item')
+    if tier == 'first':
+        return (0, 0)
+    if tier == 'second':
+        return (3, 0) if item == AFFIX_SECOND else (1, 0)
+    if item in third_pref:
+        return (2, third_pref.index(item))
+    return (2, len(third_pref))
+
+
+def evaluate(img, base_dir, third_pref, threshold):
+    """Ranked reward slots found in one frame: [{'tier', 'item', 'm'}], best first."""
+    def _tpl(name):
+        p = os.path.join(base_dir, f'{name}.png')
+        return cv2.imdecode(np.fromfile(p, dtype=np.uint8), cv2.IMREAD_COLOR) if os.path.isfile(p) else None
+
+    slots = []
+    for tier in TIERS:
+        tpl = _tpl(tier)
+        if tpl is not None:
+            slots += [{'tier': tier, 'item': None, 'm': m} for m in find_peaks(img, tpl, threshold)]
+    items = []
+    for name in (AFFIX_SECOND,) + tuple(third_pref):
+        tpl = _tpl(name)
+        if tpl is not None:
+            items += [(name, m) for m in find_peaks(img, tpl, threshold)]
+    pair_items(slots, items)
+    slots.sort(key=lambda s: (rank_slot(s, list(third_pref)), -s['m']['score']))
+    return slots
+
+
+def select_reward(app, third_pref):
+    """Capture once, rank every reward slot and click the best one. True if something was clicked."""
+    img = app._grab()
+    if img is None:
+        return False
+    slots = evaluate(img, os.path.join(app.control_dir, '奖励选择png'), third_pref, app.threshold)
+    app.telemetry.count('matches', len(TIERS) + 1 + len(third_pref))
+    if not slots:
+        app._log('🎁 奖励选择: 未识别到可用选项')
+        return False
+    desc = ', '.join(f"{s['tier']}{'/' + s['item'] if s['item'] else ''}" for s in slots)
+    best = slots[0]
+    best['m']['frame_id'] = app.capturer.frame_id
+    app._log(f"🎁 奖励选择: 识别到 {desc}；点击 {best['tier']}{'（' + best['item'] + '）' if best['item'] else ''}")
+    app.click_match(best['m'], best['tier'])
+    return True
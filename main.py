@@ -19,6 +19,11 @@ from tkinter import messagebox
 import importlib
 import ttkbootstrap as ttk
 
+import scripttool
+from keymap import vk_from_key_name
+from screenclass import ScreenClassifier
+from telemetry import RoundTelemetry, PHASES
+
 
 # ------------------------------
 # Background screenshot (from test.py idea)
@@ -26,6 +31,8 @@ import ttkbootstrap as ttk
 class BackgroundScreenshot:
     def __init__(self, hwnd=None):
         self.hwnd = hwnd
+        # increments on every successful capture; match handles carry it as 'frame_id'
+        self.frame_id = 0
 
     def set_hwnd(self, hwnd):
         self.hwnd = hwnd
@@ -60,6 +67,7 @@ class BackgroundScreenshot:
             mfcDC.DeleteDC()
             win32gui.ReleaseDC(self.hwnd, hwndDC)
 
+            self.frame_id += 1
             return img
         except Exception:
             try:
@@ -75,8 +83,18 @@ class BackgroundScreenshot:
 # ------------------------------
 # SendMessage input helpers (from test2.py idea)
 # ------------------------------
+def _split_names(text):
+    """Names from a comma-separated list (ASCII or full-width commas), order kept, duplicates dropped."""
+    out = []
+    for n in (text or '').replace('，', ',').split(','):
+        n = n.strip()
+        if n and n not in out:
+            out.append(n)
+    return out
+
+
 def _pack_lparam(x, y):
-    return (y << 16) | (x & 0xFFFF)
+    return ((y & 0xFFFF) << 16) | (x & 0xFFFF)
 
 
 def get_client_center(hwnd):
@@ -130,27 +148,6 @@ def send_left_click(hwnd, x, y):
     win32gui.SendMessage(hwnd, win32con.WM_LBUTTONUP, 0, lparam)
 
 
-def _vk_from_key_name(name: str) -> int:
-    name = name.strip().lower()
-    if len(name) == 1:
-        return ord(name.upper())
-    mapping = {
-        'space': win32con.VK_SPACE,
-        'shift': win32con.VK_SHIFT,
-        'ctrl': win32con.VK_CONTROL,
-        'control': win32con.VK_CONTROL,
-        'alt': win32con.VK_MENU,
-        'tab': win32con.VK_TAB,
-        'esc': win32con.VK_ESCAPE,
-        'escape': win32con.VK_ESCAPE,
-    }
-    if name in mapping:
-        return mapping[name]
-    if name.isdigit():
-        return ord(name)
-    raise ValueError(f"Unsupported key: {name}")
-
-
 def _make_key_lparam(vk: int, is_keyup: bool) -> int:
     scan = win32api.MapVirtualKey(vk, 0) & 0xFF
     lparam = (1) | (scan << 16)
@@ -160,13 +157,13 @@ def _make_key_lparam(vk: int, is_keyup: bool) -> int:
 
 
 def send_key_down(hwnd, key_name: str):
-    vk = _vk_from_key_name(key_name)
+    vk = vk_from_key_name(key_name)
     lparam = _make_key_lparam(vk, is_keyup=False)
     win32gui.SendMessage(hwnd, win32con.WM_KEYDOWN, vk, lparam)
 
 
 def send_key_up(hwnd, key_name: str):
-    vk = _vk_from_key_name(key_name)
+    vk = vk_from_key_name(key_name)
     lparam = _make_key_lparam(vk, is_keyup=True)
     win32gui.SendMessage(hwnd, win32con.WM_KEYUP, vk, lparam)
 
@@ -206,6 +203,40 @@ def match_template(bgr_img, template_path, threshold=0.85):
         return None
 
 
+def match_template_scales(bgr_img, template_path, threshold=0.85, scales=None):
+    """Best match of a template over several scales; the match dict or None below threshold."""
+    try:
+        best = _best_scale_match(bgr_img, template_path, scales)
+    except Exception:
+        return None
+    if best is None or best[0] < threshold:
+        return None
+    max_val, (x, y), w, h = best
+    return {'score': float(max_val), 'rect': (x, y, w, h), 'center': (x + w // 2, y + h // 2)}
+
+
+def _best_scale_match(bgr_img, template_path, scales=None):
+    """(score, loc, w, h) of the best scale, or None if nothing could be matched."""
+    if bgr_img is None or not os.path.isfile(template_path):
+        return None
+    tpl = cv2.imread(template_path, cv2.IMREAD_COLOR)
+    if tpl is None:
+        return None
+    ih, iw = bgr_img.shape[:2]
+    best = None
+    for s in (scales or [1.0, 0.95, 0.9, 1.05, 1.1]):
+        th = max(1, int(tpl.shape[0] * s))
+        tw = max(1, int(tpl.shape[1] * s))
+        if th >= ih or tw >= iw:
+            continue
+        rs = cv2.resize(tpl, (tw, th), interpolation=cv2.INTER_LINEAR)
+        r = cv2.matchTemplate(bgr_img, rs, cv2.TM_CCOEFF_NORMED)
+        _min, _max, _minl, _maxl = cv2.minMaxLoc(r)
+        if best is None or _max > best[0]:
+            best = (_max, _maxl, rs.shape[1], rs.shape[0])
+    return best
+
+
 def enumerate_windows():
     wins = []
     def _enum_cb(h, _):
@@ -215,6 +246,19 @@ def enumerate_windows():
     return wins
 
 
+# ------------------------------
+# Screen settle helpers
+# ------------------------------
+def _settle_thumb(bgr_img, size=(96, 54)):
+    """Small blurred grayscale thumbnail used to compare successive frames cheaply."""
+    try:
+        gray = cv2.cvtColor(bgr_img, cv2.COLOR_BGR2GRAY)
+    except Exception:
+        gray = bgr_img
+    thumb = cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+    return cv2.GaussianBlur(thumb, (3, 3), 0).astype(np.int16)
+
+
 # ------------------------------
 # Edge-based map matching helpers
 # ------------------------------
@@ -256,74 +300,446 @@ def _load_template_edge_and_mask(path):
     return e, mask
 
 
+# ------------------------------
+# Cooperative waiting
+# ------------------------------
+def wait_until(deadline, stop_event=None):
+    """Block until the time.perf_counter() deadline.
+
+    Sleeps on stop_event instead of polling, so an idle wait wakes the
+    interpreter once instead of 20 times a second and a stop request ends it
+    immediately. Returns False if stop_event was set, True otherwise.
+    """
+    if stop_event is None:
+        remain = deadline - time.perf_counter()
+        if remain > 0:
+            time.sleep(remain)
+        return True
+    while True:
+        remain = deadline - time.perf_counter()
+        if remain <= 0:
+            return not stop_event.is_set()
+        if stop_event.wait(remain):
+            return False
+
+
+def wait_for(seconds, stop_event=None):
+    return wait_until(time.perf_counter() + max(0.0, float(seconds)), stop_event)
+
+
+# ------------------------------
+# Adaptive polling
+# ------------------------------
+class PollScheduler:
+    """Learns per-transition arrival times and spaces out polling captures.
+
+    A transition is named '<previous event>-><awaited template>[@map]' and its
+    history holds the seconds from the previous event until the template was
+    seen. Polling is sparse before the expected window, dense inside it and
+    falls back to default_interval afterwards. All captures share one
+    captures-per-second budget. The model is persisted as JSON between sessions.
+    """
+
+    def __init__(self, path, default_interval=1.0, min_interval=0.15, max_interval=5.0,
+                 budget_cps=8.0, history=40):
+        self.path = path
+        self.default_interval = default_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.budget_cps = budget_cps
+        self.history = history
+        self.model = {}
+        self._last_capture = 0.0
+        self._lock = threading.Lock()
+
+    def load(self):
+        try:
+            if os.path.isfile(self.path):
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                self.model = {str(k): [float(x) for x in v][-self.history:] for k, v in data.items()}
+        except Exception:
+            self.model = {}
+
+    def save(self):
+        try:
+            with open(self.path, 'w', encoding='utf-8') as f:
+                json.dump(self.model, f, ensure_ascii=False, indent=2)
+        except Exception:
+            pass
+
+    def observe(self, key, latency):
+        hist = self.model.setdefault(key, [])
+        hist.append(round(float(latency), 3))
+        del hist[:-self.history]
+
+    def window(self, key):
+        """(start, end) seconds of the expected arrival window, or None if unknown."""
+        hist = sorted(self.model.get(key, []))
+        if len(hist) < 3:
+            return None
+        lo = hist[int(0.1 * (len(hist) - 1))]
+        hi = hist[int(round(0.9 * (len(hist) - 1)))]
+        margin = max(0.5, 0.15 * (hi - lo))
+        return max(0.0, lo - margin), hi + margin
+
+    def expected(self, key):
+        """Median learned latency for a transition, or None if unknown."""
+        hist = sorted(self.model.get(key, []))
+        if not hist:
+            return None
+        return hist[len(hist) // 2]
+
+    def next_interval(self, key, elapsed, defer=False):
+        """Seconds to sleep before the next poll.
+
+        defer: skip polling entirely until the expected window opens (used after
+        a route, whose end is predictable), instead of approaching it gradually.
+        """
+        win = self.window(key)
+        if win is None:
+            # no model yet: the next screen usually follows an action quickly
+            return self.min_interval * 2 if elapsed < 3.0 else self.default_interval
+        start, end = win
+        if elapsed < start:
+            if defer:
+                return start - elapsed
+            # halve the distance to the window each poll, so we land right at its start
+            return max(self.min_interval, min(self.max_interval, (start - elapsed) / 2.0))
+        if elapsed <= end:
+            return self.min_interval
+        return self.default_interval
+
+    def throttle(self, stop_event=None):
+        """Block until the global capture budget allows another capture."""
+        with self._lock:
+            now = time.perf_counter()
+            at = max(now, self._last_capture + 1.0 / max(0.1, self.budget_cps))
+            self._last_capture = at
+        return wait_until(at, stop_event)
+
+
+# ------------------------------
+# Shared frame source for mid-route vision
+# ------------------------------
+class FrameSource:
+    """Background thread that keeps the most recent window capture available.
+
+    Checkpoints read frames from here instead of capturing inline, so the
+    player never blocks on a PrintWindow call at the moment it reaches one.
+    """
+
+    def __init__(self, grab, interval=0.2):
+        self.grab = grab
+        self.interval = interval
+        self._cond = threading.Condition()
+        self._frame = None          # (seq, perf_counter, img)
+        self._seq = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            self._stop.set()
+            self._thread.join(1.0)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+
+    def _run(self):
+        while not self._stop.is_set():
+            t0 = time.perf_counter()
+            img = self.grab()
+            if img is not None:
+                with self._cond:
+                    self._seq += 1
+                    self._frame = (self._seq, t0, img)
+                    self._cond.notify_all()
+            wait_until(t0 + self.interval, self._stop)
+
+    def latest(self):
+        return self._frame
+
+    def wait_newer(self, after_seq, timeout):
+        """Return a frame newer than after_seq, or None after timeout/stop."""
+        deadline = time.perf_counter() + timeout
+        with self._cond:
+            while not self._stop.is_set():
+                if self._frame is not None and self._frame[0] > after_seq:
+                    return self._frame
+                remain = deadline - time.perf_counter()
+                if remain <= 0:
+                    return None
+                self._cond.wait(remain)
+        return None
+
+
 # ------------------------------
 # Player for JSON actions
 # ------------------------------
-def play_actions(hwnd, steps, logfn, stop_event=None):
-    ensure_restored(hwnd)
-    cx, cy = get_client_center(hwnd)
-    target = child_from_client_point(hwnd, cx, cy)
+def normalize_steps(raw_steps):
+    """Validate and normalize the 'steps' list of an action script.
+
+    Numbers are coerced to float, keys and buttons are checked up front
+    (unknown types, keys or buttons raise ValueError naming the step), so
+    play_actions never meets a bad step halfway through a route.
+    """
+    if not isinstance(raw_steps, list):
+        raise ValueError("steps 必须是列表")
+    out = []
+    last_t = 0.0
+    for i, st in enumerate(raw_steps):
+        if not isinstance(st, dict):
+            raise ValueError(f"第{i+1}步不是对象")
+        t = st.get('type')
+        hold = max(0.0, float(st.get('hold', 0) or 0))
+        delay = max(0.0, float(st.get('delay', 0) or 0))
+        if t == 'key':
+            key = str(st.get('key', '')).strip().lower()
+            vk_from_key_name(key)
+            out.append({'type': 'key', 'key': key, 'hold': hold, 'delay': delay})
+        elif t == 'mouse':
+            btn = str(st.get('button', 'left')).strip().lower()
+            if btn not in ('left', 'right'):
+                raise ValueError(f"第{i+1}步: 不支持的鼠标按键 {btn}")
+            out.append({'type': 'mouse', 'button': btn, 'hold': hold, 'delay': delay})
+        elif t == 'checkpoint':
+            tpl = str(st.get('template', '')).strip()
+            if not tpl:
+                raise ValueError(f"第{i+1}步: checkpoint 缺少 template")
+            on_fail = str(st.get('on_fail', 'continue')).strip().lower()
+            if on_fail not in ('continue', 'abort'):
+                raise ValueError(f"第{i+1}步: checkpoint on_fail 只能为 continue/abort")
+            cp = {'type': 'checkpoint', 'template': tpl, 'delay': delay,
+                  'timeout': max(0.0, float(st.get('timeout', 3.0))),
+                  'on_fail': on_fail}
+            if st.get('threshold') is not None:
+                cp['threshold'] = float(st['threshold'])
+            if st.get('region') is not None:
+                region = [int(v) for v in st['region']]
+                if len(region) != 4 or region[2] <= 0 or region[3] <= 0:
+                    raise ValueError(f"第{i+1}步: checkpoint region 需为 [x, y, w, h]")
+                cp['region'] = region
+            out.append(cp)
+        elif t == 'speed':
+            factor = float(st.get('factor', 1.0))
+            if factor <= 0:
+                raise ValueError(f"第{i+1}步: speed factor 必须大于 0")
+            sp = {'type': 'speed', 'factor': factor, 'delay': delay}
+            if 'holds' in st:
+                sp['holds'] = bool(st['holds'])
+            out.append(sp)
+        elif t in scripttool.EVENT_TYPES:
+            if st.get('t') is None:
+                raise ValueError(f"第{i+1}步: {t} 缺少时间 t")
+            at = float(st['t'])
+            if at < 0 or at < last_t:
+                raise ValueError(f"第{i+1}步: {t} 的时间 t 不能小于前一个事件")
+            last_t = at
+            ev = {'type': t, 't': at}
+            if t == 'mouse_move':
+                ev['dx'] = int(st.get('dx', 0))
+                ev['dy'] = int(st.get('dy', 0))
+            elif t.startswith('key'):
+                key = str(st.get('key', '')).strip().lower()
+                vk_from_key_name(key)
+                ev['key'] = key
+            else:
+                btn = str(st.get('button', 'left')).strip().lower()
+                if btn not in ('left', 'right'):
+                    raise ValueError(f"第{i+1}步: 不支持的鼠标按键 {btn}")
+                ev['button'] = btn
+            if delay:
+                ev['delay'] = delay
+            out.append(ev)
+        else:
+            raise ValueError(f"第{i+1}步: 未知动作类型 {t}")
+    return out
+
+
+class Win32InputBackend:
+    """SendMessage input used by play_actions: keys and clicks at the client center."""
+
+    def __init__(self, hwnd):
+        self.hwnd = hwnd
+        ensure_restored(hwnd)
+        self.cx, self.cy = get_client_center(hwnd)
+        self.target = child_from_client_point(hwnd, self.cx, self.cy)
+        self.tx, self.ty = map_point_parent_to_child(hwnd, self.target, self.cx, self.cy)
+        # virtual cursor for relative mouse_move steps, starting at the click point
+        self.mx, self.my = self.tx, self.ty
+        self.buttons = 0
+
+    def activate(self):
+        send_left_click(self.target, self.tx, self.ty)
+
+    def key_down(self, key):
+        send_key_down(self.target, key)
+
+    def key_up(self, key):
+        send_key_up(self.target, key)
+        # deliver to the top-level window as well for compatibility
+        send_key_press(self.hwnd, key, 0)
+
+    def mouse_down(self, button):
+        if button == 'left':
+            # left is a plain click; its 'hold' only keeps the timeline waiting
+            send_left_click(self.target, self.mx, self.my)
+        elif button == 'right':
+            self.buttons |= win32con.MK_RBUTTON
+            send_mouse_move(self.target, self.mx, self.my)
+            win32gui.SendMessage(self.target, win32con.WM_RBUTTONDOWN, win32con.MK_RBUTTON,
+                                 _pack_lparam(self.mx, self.my))
+
+    def mouse_up(self, button):
+        if button == 'right':
+            self.buttons &= ~win32con.MK_RBUTTON
+            win32gui.SendMessage(self.target, win32con.WM_RBUTTONUP, 0, _pack_lparam(self.mx, self.my))
+
+    def mouse_move(self, dx, dy):
+        """Move the virtual cursor by (dx, dy) and send its new position.
+
+        Mouse model shared with recorder.StepBuilder: a mouse_move step is the
+        difference between two successive cursor positions, so the player
+        adds the deltas up. The position is not clamped to the client rect
+        (WM_MOUSEMOVE carries signed coordinates), so a long turn is not cut
+        short at the window edge; only the 16-bit coordinate range limits it.
+        """
+        self.mx = min(max(self.mx + int(dx), -32768), 32767)
+        self.my = min(max(self.my + int(dy), -32768), 32767)
+        self._send_move(self.mx, self.my)
+
+    def _send_move(self, x, y):
+        send_mouse_move(self.target, x, y, self.buttons)
+
+
+def play_actions(hwnd, steps, logfn, stop_event=None, vision=None, speed=1.0, scale_holds=False,
+                 backend=None):
+    """Play action steps against hwnd. Returns False if stopped or aborted by a checkpoint.
+
+    vision(step, stop_event) handles 'checkpoint' steps: it waits up to
+    step['timeout'] for the template and returns a match or None. On success
+    the rest of the timeline is re-synchronized to that moment.
+
+    speed compresses the timeline: delays are divided by it, holds too when
+    scale_holds is set. A {'type': 'speed', 'factor': f, 'holds': bool} step
+    multiplies the global speed by f from that step on (per-segment scaling).
+
+    key_down/key_up/mouse_down/mouse_up/mouse_move steps carry an absolute recording
+    time 't' and are played against it, so overlapping holds (W held while
+    tapping Space) keep their shape. A run of such events is anchored to the
+    moment its first event is reached; anything still held at the end, or on
+    stop, is released.
+    backend defaults to Win32InputBackend(hwnd); tests pass a recording fake.
+    """
+    if backend is None:
+        backend = Win32InputBackend(hwnd)
     # Activate with a left click first if the first actionable step is a key, to ensure background input
     try:
-        first = next((s for s in steps if s.get('type') in ('key', 'mouse')), None)
-        if first and first.get('type') == 'key':
-            tx, ty = map_point_parent_to_child(hwnd, target, cx, cy)
-            send_left_click(target, tx, ty)
-            if stop_event and stop_event.is_set():
-                return
-            time.sleep(0.05)
+        first = next((s for s in steps if s.get('type') in scripttool.INPUT_TYPES), None)
+        if first and first.get('type') in ('key', 'key_down', 'key_up'):
+            backend.activate()
+            if not wait_for(0.05, stop_event):
+                return False
     except Exception:
         pass
-    for i, st in enumerate(steps):
-        if stop_event and stop_event.is_set():
-            return
-        t = st.get('type')
-        delay = float(st.get('delay', 0))
-        try:
-            if t == 'key':
-                key = st['key']
-                hold = float(st.get('hold', 0))
-                logfn(f"动作{i+1}: key {key} hold={hold}s delay={delay}s")
-                # deliver to both child and top-level for compatibility
-                send_key_press(target, key, hold)
-                send_key_press(hwnd, key, 0)
-            elif t == 'mouse':
-                btn = st.get('button', 'left').lower()
-                hold = float(st.get('hold', 0))
-                logfn(f"动作{i+1}: mouse {btn} hold={hold}s delay={delay}s")
-                if btn == 'left':
-                    tx, ty = map_point_parent_to_child(hwnd, target, cx, cy)
-                    send_left_click(target, tx, ty)
-                    if hold > 0:
-                        # interruptible hold
-                        waited = 0.0
-                        step = 0.05
-                        while waited < hold and not (stop_event and stop_event.is_set()):
-                            time.sleep(step)
-                            waited += step
-                elif btn == 'right':
-                    # emulate hold by down/up
-                    tx, ty = map_point_parent_to_child(hwnd, target, cx, cy)
-                    lparam = _pack_lparam(tx, ty)
-                    send_mouse_move(target, tx, ty)
-                    win32gui.SendMessage(target, win32con.WM_RBUTTONDOWN, win32con.MK_RBUTTON, lparam)
-                    if hold > 0:
-                        waited = 0.0
-                        step = 0.05
-                        while waited < hold and not (stop_event and stop_event.is_set()):
-                            time.sleep(step)
-                            waited += step
-                    win32gui.SendMessage(target, win32con.WM_RBUTTONUP, 0, lparam)
-            else:
-                logfn(f"未知动作类型: {t}")
-        except Exception as e:
-            logfn(f"执行动作错误: {e}")
-        if delay > 0:
-            waited = 0.0
-            step = 0.05
-            while waited < delay and not (stop_event and stop_event.is_set()):
-                time.sleep(step)
-                waited += step
+    # Steps are scheduled against absolute deadlines so time spent in SendMessage
+    # does not accumulate into drift over a long route.
+    cursor = time.perf_counter()
+    factor, holds_too = max(0.05, float(speed)), scale_holds
+    anchor = None
+    held = set()
+    try:
+        for i, st in enumerate(steps):
+            if not wait_until(cursor, stop_event):
+                return False
+            t = st.get('type')
+            if t in scripttool.EVENT_TYPES:
+                due, anchor = scripttool.event_due(anchor, cursor, st, factor)
+                if not wait_until(due, stop_event):
+                    return False
+                try:
+                    arg = scripttool.event_arg(st)
+                    if t == 'mouse_move':
+                        # camera turns come as long runs of small moves; not logged one by one
+                        backend.mouse_move(*arg)
+                    else:
+                        logfn(f"动作{i+1}: {t} {arg} t={float(st.get('t', 0)):.3f}s")
+                        getattr(backend, t)(arg)
+                    if t.endswith('_down'):
+                        held.add((t, arg))
+                    elif t.endswith('_up'):
+                        held.discard((t[:-3] + '_down', arg))
+                except Exception as e:
+                    logfn(f"执行动作错误: {e}")
+                _hold, delay = scripttool.scaled_step(st, factor, holds_too)
+                cursor = due + delay
+                if delay:
+                    anchor = None
+                continue
+            anchor = None
+            if t == 'speed':
+                factor = max(0.05, float(speed) * float(st.get('factor', 1.0)))
+                holds_too = bool(st.get('holds', scale_holds))
+                logfn(f"动作{i+1}: 速度段 x{factor:.2f}{'（含按住时长）' if holds_too else ''}")
+            hold, delay = scripttool.scaled_step(st, factor, holds_too)
+            try:
+                if t == 'key':
+                    key = st['key']
+                    logfn(f"动作{i+1}: key {key} hold={hold:.3f}s delay={delay:.3f}s")
+                    backend.key_down(key)
+                    try:
+                        wait_until(cursor + hold, stop_event)
+                    finally:
+                        backend.key_up(key)
+                elif t == 'mouse':
+                    btn = st.get('button', 'left').lower()
+                    logfn(f"动作{i+1}: mouse {btn} hold={hold:.3f}s delay={delay:.3f}s")
+                    backend.mouse_down(btn)
+                    try:
+                        if hold > 0:
+                            wait_until(cursor + hold, stop_event)
+                    finally:
+                        backend.mouse_up(btn)
+                elif t == 'checkpoint':
+                    hold = 0.0
+                    tpl = st.get('template')
+                    if vision is None:
+                        logfn(f"检查点{i+1}: 无视觉源，跳过 {tpl}")
+                    else:
+                        m = vision(st, stop_event)
+                        if m:
+                            late = time.perf_counter() - cursor
+                            logfn(f"检查点{i+1}: 命中 {tpl} (score={m['score']:.2f})，时间轴重新对齐 {late:+.2f}s")
+                            # re-synchronize the remaining timeline to this moment
+                            cursor = time.perf_counter()
+                        elif stop_event is not None and stop_event.is_set():
+                            return False
+                        elif st.get('on_fail') == 'abort':
+                            logfn(f"检查点{i+1}: {tpl} 超时，中止本条路线")
+                            return False
+                        else:
+                            logfn(f"检查点{i+1}: {tpl} 超时，继续执行")
+                            cursor = time.perf_counter()
+                elif t != 'speed':
+                    hold = 0.0
+                    logfn(f"未知动作类型: {t}")
+            except Exception as e:
+                logfn(f"执行动作错误: {e}")
+            cursor += hold + delay
+    finally:
+        # never leave a key or button down (stop, abort or a truncated script)
+        for ev, arg in sorted(held):
+            try:
+                getattr(backend, ev[:-5] + '_up')(arg)
+            except Exception:
+                pass
+    return not (stop_event is not None and stop_event.is_set())
 
 
 # ------------------------------
@@ -343,6 +759,13 @@ class App:
         self.retry_interval = 1.0
         self.timeout_seconds = 300.0
         self.post_click_wait = 1.5
+        # Visual settle detection (replaces fixed post_click_wait / post_likai_delay sleeps)
+        self.settle_floor = 0.3       # never return earlier than this after an action
+        self.settle_interval = 0.1    # frame sampling interval while settling
+        self.settle_diff_thr = 2.0    # mean abs diff (0..255) on the thumbnail counted as "still"
+        self.settle_stable_frames = 2 # consecutive still frames required
+        self._settle_saved = 0.0
+        self._settle_count = 0
 
         self.base_dir = self._compute_base_dir()
         self.control_dir = os.path.join(self.base_dir, 'control')
@@ -358,18 +781,38 @@ class App:
         self.auto_keyword = tk.StringVar(value='二重螺旋')
         self.selected_hwnd = None
         self.capturer = BackgroundScreenshot()
+        self.poll = PollScheduler(os.path.join(self.base_dir, 'poll_model.json'),
+                                  default_interval=self.retry_interval)
+        self.poll.load()
+        self.current_map = None
+        self._poll_mark = None
+        self.frame_source = FrameSource(self._grab)
+        # one-pass screen recognition for the mode state machines (learned fingerprints + coarse matching)
+        self.classifier = ScreenClassifier(self.control_dir)
+        self.screen_cache_path = os.path.join(self.base_dir, 'screen_cache.json')
+        self.classifier.load(self.screen_cache_path)
+        # per-round phase timings, capture and match counts (loops_done / started_at come from here)
+        self.telemetry = RoundTelemetry()
+        self.round_eta = None           # predicted wall-clock end of the current round
+        self.round_actual_end = None
         self._tpl_edge_cache = {}
+        # action scripts: path -> (mtime_ns, size, normalized steps); (json_dir, name) -> path
+        self._script_cache = {}
+        self._script_path_cache = {}
         self.stop_event = threading.Event()
 
         # Settings (GUI-configurable)
         self.fail_fallback_random = False   # 识图失败时随机脚本（默认关闭）
         self.post_likai_delay = 1.3         # 进入地图后延迟秒
+        self.settle_detect = True           # 画面稳定后提前结束点击/进图后的等待
+        self.playback_speed = 1.0           # 回放速度倍率（仅压缩步骤间延迟）
         self.max_loops = 0                  # 循环次数（0=不限）
         self.auto_stop_seconds = 0          # 定时关闭（秒，0=禁用）
         self.theme_name = 'cosmo'           # 窗口主题：白天cosmo/黑夜darkly
-        self.started_at = None
-        self.loops_done = 0
+        self.wuqi_mihan_wish = []           # 武器密函候补（按优先级，空=只用下拉框所选）
+        self.juese_mihan_wish = []          # 角色密函候补
         self.auto_stop_timer = None
+        self._stop_requested_at = None
 
         # Try load persisted config
         self._load_config()
@@ -388,8 +831,10 @@ class App:
         except Exception:
             pass
 
-        # expose action player to logic modules
+        # expose action player and matchers to logic modules
         self.play_actions = play_actions
+        self.match_template = self._counted(match_template)
+        self.match_template_scales = self._counted(match_template_scales)
 
         # mode display mapping
         self.mode_name_map = {
@@ -566,6 +1011,8 @@ class App:
         self.combo_wuqi_mihan = ttk.Combobox(row_m, state='readonly', width=30, textvariable=self.wuqi_mihan_var)
         self.combo_wuqi_mihan.pack(side='left', padx=6)
         ttk.Button(row_m, text='刷新密函', command=self._refresh_wuqi_mihan).pack(side='left')
+        self.wuqi_wish_var = tk.StringVar(value='，'.join(self.wuqi_mihan_wish))
+        self._build_wish_row(mid, self.wuqi_wish_var, self.wuqi_mihan_var)
 
         row_j = ttk.Frame(mid)
         row_j.pack(fill='x', pady=4)
@@ -574,6 +1021,8 @@ class App:
         self.combo_juese_mihan = ttk.Combobox(row_j, state='readonly', width=30, textvariable=self.juese_mihan_var)
         self.combo_juese_mihan.pack(side='left', padx=6)
         ttk.Button(row_j, text='刷新密函', command=self._refresh_juese_mihan).pack(side='left')
+        self.juese_wish_var = tk.StringVar(value='，'.join(self.juese_mihan_wish))
+        self._build_wish_row(mid, self.juese_wish_var, self.juese_mihan_var)
 
         # 温馨提示（小卡片）
         tip_card, tip_box = self._create_card(mid, '温馨提示', padding=8, radius=10)
@@ -620,6 +1069,21 @@ class App:
         self._refresh_wuqi_mihan()
         self._refresh_juese_mihan()
 
+    def _build_wish_row(self, parent, wish_var, pick_var):
+        # 候补密函：按优先级排列，逗号分隔；"加入"把下拉框当前所选追加到末尾
+        row = ttk.Frame(parent)
+        row.pack(fill='x', pady=(0, 4))
+        ttk.Label(row, text='候补(优先级)').pack(side='left')
+        ttk.Entry(row, textvariable=wish_var, width=24).pack(side='left', padx=6)
+        def _add():
+            names = _split_names(wish_var.get())
+            name = (pick_var.get() or '').strip()
+            if name and name not in names:
+                names.append(name)
+            wish_var.set('，'.join(names))
+        ttk.Button(row, text='加入', command=_add).pack(side='left')
+        ttk.Button(row, text='清空', command=lambda: wish_var.set('')).pack(side='left', padx=(4, 0))
+
     def _bind_hotkeys(self):
         # Local Tk bindings (also support global with keyboard if installed)
         try:
@@ -724,6 +1188,21 @@ class App:
             return None
         return os.path.join(self.control_dir, '武器密函png', f"{name}.png")
 
+    def _mihan_targets(self, folder, wish, selected):
+        """Existing template paths in priority order: the wish list, or the selection if it is empty."""
+        names = wish or ([selected] if selected else [])
+        out = []
+        for name in names:
+            p = os.path.join(self.control_dir, folder, f"{name}.png")
+            if p not in out and os.path.isfile(p):
+                out.append(p)
+            elif not os.path.isfile(p):
+                self._log(f"候补密函模板不存在，已忽略: {name}")
+        return out
+
+    def get_wuqi_mihan_targets(self):
+        return self._mihan_targets('武器密函png', self.wuqi_mihan_wish, (self.wuqi_mihan_var.get() or '').strip())
+
     def _refresh_juese_mihan(self):
         try:
             folder = os.path.join(self.control_dir, '角色密函png')
@@ -750,17 +1229,46 @@ class App:
             return None
         return os.path.join(self.control_dir, '角色密函png', f"{name}.png")
 
+    def get_juese_mihan_targets(self):
+        return self._mihan_targets('角色密函png', self.juese_mihan_wish, (self.juese_mihan_var.get() or '').strip())
+
+    def _sync_wishlists(self):
+        """Copy the wish-list entries into the settings; True if they changed."""
+        wuqi = _split_names(self.wuqi_wish_var.get())
+        juese = _split_names(self.juese_wish_var.get())
+        changed = (wuqi, juese) != (self.wuqi_mihan_wish, self.juese_mihan_wish)
+        self.wuqi_mihan_wish, self.juese_mihan_wish = wuqi, juese
+        return changed
+
+    @property
+    def loops_done(self):
+        return self.telemetry.loops_done
+
+    @property
+    def started_at(self):
+        return self.telemetry.started_at
+
+    def _counted(self, matcher):
+        """Wrap a template matcher so every call is counted in the round telemetry."""
+        def _match(*args, **kwargs):
+            self.telemetry.count('matches')
+            return matcher(*args, **kwargs)
+        return _match
+
     # Helpers for logic modules
     def detect_template_abs(self, template_abs_path, threshold=None):
         thr = self.threshold if threshold is None else float(threshold)
-        img = self.capturer.capture_background()
+        img = self._grab()
         if img is None:
             return None
         if not os.path.isfile(template_abs_path):
             self._log(f"模板不存在: {template_abs_path}")
             return None
         try:
+            self.telemetry.count('matches')
             res = match_template(img, template_abs_path, thr)
+            if res is not None:
+                res['frame_id'] = self.capturer.frame_id
             if res is None:
                 # simple max-score probe for diagnostics
                 tpl = cv2.imread(template_abs_path, cv2.IMREAD_COLOR)
@@ -775,28 +1283,15 @@ class App:
 
     def detect_template_abs_scales(self, template_abs_path, scales=None, threshold=None):
         thr = self.threshold if threshold is None else float(threshold)
-        img = self.capturer.capture_background()
+        img = self._grab()
         if img is None:
             return None
         if not os.path.isfile(template_abs_path):
             self._log(f"模板不存在: {template_abs_path}")
             return None
         try:
-            tpl = cv2.imread(template_abs_path, cv2.IMREAD_COLOR)
-            if tpl is None:
-                return None
-            (ih, iw) = img.shape[:2]
-            best = None
-            for s in (scales or [1.0, 0.95, 0.9, 1.05, 1.1]):
-                th = max(1, int(tpl.shape[0] * s))
-                tw = max(1, int(tpl.shape[1] * s))
-                if th >= ih or tw >= iw:
-                    continue
-                rs = cv2.resize(tpl, (tw, th), interpolation=cv2.INTER_LINEAR)
-                r = cv2.matchTemplate(img, rs, cv2.TM_CCOEFF_NORMED)
-                _min, _max, _minl, _maxl = cv2.minMaxLoc(r)
-                if best is None or _max > best[0]:
-                    best = (_max, _maxl, rs.shape[1], rs.shape[0])
+            self.telemetry.count('matches')
+            best = _best_scale_match(img, template_abs_path, scales)
             if best is None:
                 return None
             max_val, max_loc, w, h = best
@@ -805,7 +1300,8 @@ class App:
                 return None
             x, y = max_loc
             center = (x + w // 2, y + h // 2)
-            return {'score': float(max_val), 'rect': (x, y, w, h), 'center': center}
+            return {'score': float(max_val), 'rect': (x, y, w, h), 'center': center,
+                    'frame_id': self.capturer.frame_id}
         except Exception as e:
             self._log(f"多尺度检测异常({os.path.basename(template_abs_path)}): {e}")
             return None
@@ -821,28 +1317,48 @@ class App:
         except Exception:
             return self.selected_hwnd, *get_client_center(self.selected_hwnd)
 
-    def click_match_abs(self, template_abs_path, name_alias='', threshold=None, scales=None): 
+    def click_match_abs(self, template_abs_path, name_alias='', threshold=None, scales=None):
         if scales:
             m = self.detect_template_abs_scales(template_abs_path, scales=scales, threshold=threshold)
         else:
             m = self.detect_template_abs(template_abs_path, threshold=threshold)
         if not m:
             return False
-        cx, cy = m['center']
-        target, tx, ty = self.center_to_client_and_target((cx, cy))
-        self._log(f"点击 {name_alias or os.path.basename(template_abs_path)} @ ({tx},{ty})")
-        lp = _pack_lparam(tx, ty)
+        return self.click_match(m, name_alias or os.path.basename(template_abs_path))
+
+    # Act-on-match: operate directly on a handle returned by detect_template_abs*,
+    # so a successful detection never needs a second capture + match to be clicked.
+    def hover_match(self, m):
+        """Move the cursor onto a match handle. Returns (target, tx, ty) in client coords."""
+        target, tx, ty = self.center_to_client_and_target(m['center'])
         send_mouse_move(target, tx, ty)
+        return target, tx, ty
+
+    def click_match(self, m, name_alias='', expect=None):
+        """Click the center of a match handle without re-capturing.
+
+        expect: optional control template filename expected after the click;
+        the post-click settle wait ends as soon as it is visible.
+        """
+        if not m:
+            return False
+        target, tx, ty = self.hover_match(m)
+        self._log(f"点击 {name_alias or 'match'} @ ({tx},{ty}) [帧#{m.get('frame_id', '-')}]")
+        lp = _pack_lparam(tx, ty)
         win32gui.SendMessage(target, win32con.WM_LBUTTONDOWN, win32con.MK_LBUTTON, lp)
         win32gui.SendMessage(target, win32con.WM_LBUTTONUP, 0, lp)
-        waited = 0.0
-        step = 0.05
-        while waited < self.post_click_wait and self.running and not self.stop_event.is_set():
-            time.sleep(step)
-            waited += step
+        self.wait_settle(self.post_click_wait, expect=os.path.join(self.control_dir, expect) if expect else None)
         return True
 
-    def send_mouse_wheel(self, delta=120, count=1, client_pos=None):
+    def scroll_at_match(self, m, delta=120, count=1):
+        """Send wheel notches at the center of a match handle."""
+        if not m:
+            return False
+        _target, tx, ty = self.center_to_client_and_target(m['center'])
+        return self.send_mouse_wheel(delta=delta, count=count, client_pos=(tx, ty))
+
+    def send_mouse_wheel(self, delta=120, count=1, client_pos=None, gap=0.06, quiet=False):
+        """Send `count` wheel notches, `gap` seconds apart (no wait after the last one)."""
         try:
             # Per MSDN: lParam holds screen coordinates; message is sent to focus window.
             # For background usage, send to the top-level hwnd with screen coords of client center.
@@ -854,14 +1370,85 @@ class App:
             lparam = _pack_lparam(sx, sy)
             wparam = (int(delta) & 0xFFFF) << 16
             target = child_from_client_point(self.selected_hwnd, cx, cy)
-            for _ in range(max(1, int(count))):
+            n = max(1, int(count))
+            for i in range(n):
                 win32gui.SendMessage(target, win32con.WM_MOUSEWHEEL, wparam, lparam)
-                self._log(f"发送滚轮: delta={delta} -> target=0x{target:08X} screen({sx},{sy}) client({cx},{cy})")
-                time.sleep(0.06)
+                if not quiet:
+                    self._log(f"发送滚轮: delta={delta} -> target=0x{target:08X} screen({sx},{sy}) client({cx},{cy})")
+                if i + 1 < n and gap > 0 and not self.wait(gap):
+                    break
             return True
         except Exception:
             return False
 
+    def wait(self, seconds):
+        """Cancellation-aware sleep for the worker and logic modules.
+
+        Returns False as soon as a stop is requested (F12 / auto stop), True if
+        the full duration elapsed.
+        """
+        if not self.running:
+            return False
+        return wait_for(seconds, self.stop_event)
+
+    def wait_settle(self, ceiling, floor=None, expect=None):
+        """Wait until the screen has settled instead of sleeping a fixed time.
+
+        Samples low-resolution frames every settle_interval and returns once
+        settle_stable_frames successive frames stop changing, or as soon as the
+        optional `expect` template (absolute path) is visible. Never returns
+        before `floor` nor later than `ceiling`. The time saved against the
+        fixed `ceiling` sleep is accumulated for the per-round report.
+        Returns False if a stop was requested.
+        """
+        ceiling = max(0.0, float(ceiling))
+        if not self.settle_detect:
+            return self.wait(ceiling)
+        floor = min(ceiling, self.settle_floor if floor is None else max(0.0, float(floor)))
+        t0 = time.perf_counter()
+        deadline = t0 + ceiling
+        prev = None
+        stable = 0
+        while self.running:
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            img = self._grab()
+            if img is None:
+                # no frames to compare: behave like the fixed sleep
+                return wait_until(deadline, self.stop_event)
+            settled = False
+            if expect:
+                self.telemetry.count('matches')
+                settled = match_template(img, expect, self.threshold) is not None
+            if not settled:
+                thumb = _settle_thumb(img)
+                if prev is not None and float(np.mean(np.abs(thumb - prev))) < self.settle_diff_thr:
+                    stable += 1
+                else:
+                    stable = 0
+                prev = thumb
+                settled = stable >= self.settle_stable_frames
+            if settled:
+                if not wait_until(t0 + floor, self.stop_event):
+                    return False
+                break
+            if not wait_until(min(deadline, time.perf_counter() + self.settle_interval), self.stop_event):
+                return False
+        else:
+            return False
+        saved = max(0.0, deadline - time.perf_counter())
+        self._settle_saved += saved
+        self._settle_count += 1
+        return not self.stop_event.is_set()
+
+    def report_settle_round(self):
+        """Log and reset the time saved by wait_settle since the last report."""
+        if self._settle_count:
+            self._log(f"⏩ 本轮画面稳定检测节省 {self._settle_saved:.1f}s（{self._settle_count} 次等待）")
+        self._settle_saved = 0.0
+        self._settle_count = 0
+
     def _append_log_line_ui(self, line):
         try:
             self.log.configure(state='normal')
@@ -907,9 +1494,13 @@ class App:
                     cfg = json.load(f)
                 self.fail_fallback_random = bool(cfg.get('fail_fallback_random', self.fail_fallback_random))
                 self.post_likai_delay = float(cfg.get('post_likai_delay', self.post_likai_delay))
+                self.settle_detect = bool(cfg.get('settle_detect', self.settle_detect))
+                self.playback_speed = float(cfg.get('playback_speed', self.playback_speed))
                 self.max_loops = int(cfg.get('max_loops', self.max_loops))
                 self.auto_stop_seconds = int(cfg.get('auto_stop_seconds', self.auto_stop_seconds))
                 self.theme_name = str(cfg.get('theme', self.theme_name))
+                self.wuqi_mihan_wish = [str(n) for n in cfg.get('wuqi_mihan_wish', self.wuqi_mihan_wish)]
+                self.juese_mihan_wish = [str(n) for n in cfg.get('juese_mihan_wish', self.juese_mihan_wish)]
                 # Clamp after load
                 self._clamp_settings()
                 self._log('已加载本地配置文件。')
@@ -921,9 +1512,13 @@ class App:
             cfg = {
                 'fail_fallback_random': self.fail_fallback_random,
                 'post_likai_delay': self.post_likai_delay,
+                'settle_detect': self.settle_detect,
+                'playback_speed': self.playback_speed,
                 'max_loops': self.max_loops,
                 'auto_stop_seconds': self.auto_stop_seconds,
                 'theme': self.theme_name,
+                'wuqi_mihan_wish': self.wuqi_mihan_wish,
+                'juese_mihan_wish': self.juese_mihan_wish,
             }
             with open(self.config_path, 'w', encoding='utf-8') as f:
                 json.dump(cfg, f, ensure_ascii=False, indent=2)
@@ -934,8 +1529,9 @@ class App:
     # Validation and clamping
     def _clamp_settings(self):
         try:
-            # Bounds: delay [0..10], loops [0..10000], auto_stop [0..86400]
+            # Bounds: delay [0..10], speed [0.5..3], loops [0..10000], auto_stop [0..86400]
             self.post_likai_delay = max(0.0, min(10.0, float(self.post_likai_delay)))
+            self.playback_speed = max(0.5, min(3.0, float(self.playback_speed)))
             self.max_loops = max(0, min(10000, int(self.max_loops)))
             self.auto_stop_seconds = max(0, min(86400, int(self.auto_stop_seconds)))
         except Exception:
@@ -971,13 +1567,15 @@ class App:
         win = tk.Toplevel(self.root)
         self.settings_window = win
         win.title('设置')
-        win.geometry('380x260')
+        win.geometry('380x325')
         frm = ttk.Frame(win, padding=10)
         frm.pack(fill='both', expand=True)
 
         # Vars bound to settings
         self.var_fail_random = tk.BooleanVar(value=self.fail_fallback_random)
         self.var_post_delay = tk.DoubleVar(value=self.post_likai_delay)
+        self.var_settle = tk.BooleanVar(value=self.settle_detect)
+        self.var_speed = tk.DoubleVar(value=self.playback_speed)
         self.var_max_loops = tk.IntVar(value=self.max_loops)
         self.var_auto_stop = tk.IntVar(value=self.auto_stop_seconds)
         self.var_theme = tk.StringVar(value=self.theme_name)
@@ -985,6 +1583,7 @@ class App:
         # Row: checkbox fail random
         chk = ttk.Checkbutton(frm, text='识图失败时随机选择脚本继续', variable=self.var_fail_random)
         chk.pack(anchor='w', pady=(0,6))
+        ttk.Checkbutton(frm, text='画面稳定后提前结束等待（延迟作为上限）', variable=self.var_settle).pack(anchor='w', pady=(0,6))
 
         # Row: post likai delay
         row1 = ttk.Frame(frm)
@@ -994,6 +1593,13 @@ class App:
         ent_delay.pack(side='left', padx=6)
         ttk.Label(row1, text='秒再识别地图').pack(side='left')
 
+        # Row: playback speed
+        row_speed = ttk.Frame(frm)
+        row_speed.pack(fill='x', pady=4)
+        ttk.Label(row_speed, text='回放速度').pack(side='left')
+        ttk.Entry(row_speed, textvariable=self.var_speed, width=8).pack(side='left', padx=6)
+        ttk.Label(row_speed, text='倍 (0.5~3，仅压缩步骤间延迟)').pack(side='left')
+
         # Row: loop count
         row2 = ttk.Frame(frm)
         row2.pack(fill='x', pady=4)
@@ -1026,12 +1632,14 @@ class App:
                 self.fail_fallback_random = bool(self.var_fail_random.get())
                 # Parse and clamp with bounds
                 self.post_likai_delay = float(self.var_post_delay.get())
+                self.settle_detect = bool(self.var_settle.get())
+                self.playback_speed = float(self.var_speed.get())
                 self.max_loops = int(self.var_max_loops.get())
                 self.auto_stop_seconds = int(self.var_auto_stop.get())
                 # theme
                 self.theme_name = str(self.var_theme.get() or self.theme_name)
                 self._clamp_settings()
-                self._log(f"已应用设置: 随机脚本={self.fail_fallback_random}, 延迟={self.post_likai_delay}s, 循环次数={self.max_loops}, 定时关闭={self.auto_stop_seconds}s")
+                self._log(f"已应用设置: 随机脚本={self.fail_fallback_random}, 延迟={self.post_likai_delay}s, 稳定检测={self.settle_detect}, 回放速度={self.playback_speed}x, 循环次数={self.max_loops}, 定时关闭={self.auto_stop_seconds}s")
                 # apply theme now
                 self._apply_theme(self.theme_name)
                 self._save_config()
@@ -1054,6 +1662,10 @@ class App:
                 st = Style()
                 st.theme_use(theme_name)
             # Rebuild UI so custom canvas-based cards use the new palette
+            try:
+                self._sync_wishlists()
+            except Exception:
+                pass
             try:
                 for ch in self.root.winfo_children():
                     ch.destroy()
@@ -1107,6 +1719,8 @@ class App:
             return
         self.map_dir = os.path.join(self.map_root, mode)
         self.json_dir = os.path.join(self.json_root, mode)
+        if self._sync_wishlists():
+            self._save_config()
         # ensure paths
         os.makedirs(self.map_dir, exist_ok=True)
         os.makedirs(self.json_dir, exist_ok=True)
@@ -1114,7 +1728,7 @@ class App:
             map_exists = os.path.isdir(self.map_dir)
             json_exists = os.path.isdir(self.json_dir)
             map_cnt = len([f for f in os.listdir(self.map_dir) if f.lower().endswith('.png')]) if map_exists else 0
-            json_cnt = len([f for f in os.listdir(self.json_dir) if f.lower().endswith('.json')]) if json_exists else 0
+            json_cnt = len([f for f in os.listdir(self.json_dir) if f.lower().endswith(('.json', scripttool.BIN_EXT))]) if json_exists else 0
             self._log(f"📊 [自检] 模式={mode} map_dir={self.map_dir} 存在={map_exists} png数={map_cnt}")
             self._log(f"📊 [自检] 模式={mode} json_dir={self.json_dir} 存在={json_exists} json数={json_cnt}")
             if map_cnt == 0:
@@ -1124,6 +1738,11 @@ class App:
         except Exception:
             pass
         self.running = True
+        self._stop_requested_at = None
+        self._poll_mark = None
+        self.current_map = None
+        self.round_eta = None
+        self.round_actual_end = None
         self.stop_event.clear()
         # pass selected mode to runner
         self.worker = threading.Thread(target=self._run_mode_loop, args=(mode,), daemon=True)
@@ -1157,6 +1776,7 @@ class App:
         if not self.running:
             return
         self.running = False
+        self._stop_requested_at = time.perf_counter()
         self.stop_event.set()
         self._log('⏹️ 请求停止，等待当前步骤结束...')
         try:
@@ -1179,6 +1799,7 @@ class App:
             return
         ensure_restored(self.selected_hwnd)
         self._log(f'▶️ 已启动模式: {mode_name}')
+        self.telemetry.start_run(mode_name)
         try:
             if hasattr(mod, 'run'):
                 mod.run(self)
@@ -1187,20 +1808,148 @@ class App:
         except Exception as e:
             self._log(f'⚠️ 模式运行异常: {e}')
         finally:
+            if self._stop_requested_at is not None:
+                latency_ms = (time.perf_counter() - self._stop_requested_at) * 1000.0
+                self._log(f'⏱️ 停止响应耗时 {latency_ms:.0f} ms')
+            self.poll.save()
+            self.classifier.save(self.screen_cache_path)
+            self._export_telemetry()
             self._log('🛑 脚本已停止。')
 
-    def _wait_and_click(self, template_filename, name_alias, timeout=None):
+    def _export_telemetry(self):
+        """Close the run's telemetry: append its rounds to telemetry.csv, write telemetry.json, log a summary."""
+        tel = self.telemetry
+        tel.stop_run()
+        if not tel.loops_done:
+            return
+        try:
+            tel.export_csv(os.path.join(self.base_dir, 'telemetry.csv'))
+            tel.export_json(os.path.join(self.base_dir, 'telemetry.json'))
+        except Exception as e:
+            self._log(f'⚠️ 统计导出失败: {e}')
+            return
+        summ = tel.summary()
+        parts = ' · '.join(f"{k} p50 {summ[k]['wall_p50']:.1f}s/p90 {summ[k]['wall_p90']:.1f}s" for k in PHASES)
+        self._log(f'📊 本次运行 {tel.loops_done} 轮，{tel.runs_per_hour():.1f} 轮/小时；{parts}')
+        self._log('📊 已导出 telemetry.csv / telemetry.json')
+
+    # Capture + transition bookkeeping shared by the polling helpers
+    def _grab(self):
+        """Capture one frame under the global captures-per-second budget."""
+        if not self.poll.throttle(self.stop_event):
+            return None
+        self.telemetry.count('captures')
+        return self.capturer.capture_background()
+
+    def _poll_key(self, name_alias):
+        prev = self._poll_mark[0] if self._poll_mark else 'start'
+        key = f"{prev}->{name_alias}"
+        return f"{key}@{self.current_map}" if self.current_map else key
+
+    def _poll_elapsed(self):
+        if self._poll_mark is None:
+            self._poll_mark = ('start', time.perf_counter())
+        return time.perf_counter() - self._poll_mark[1]
+
+    def _poll_sleep(self, key):
+        defer = key.startswith('route->')
+        return self.wait(self.poll.next_interval(key, self._poll_elapsed(), defer=defer))
+
+    def _poll_hit(self, key, name_alias):
+        """Record the arrival of name_alias and make it the start of the next transition."""
+        latency = self._poll_elapsed()
+        self.poll.observe(key, latency)
+        self._log(f"⏱️ 转场 {key} 用时 {latency:.1f}s")
+        if key.startswith('route->') and self.round_eta:
+            self.round_actual_end = time.time()
+            self._log(f"🧭 本轮预计结束 {datetime.fromtimestamp(self.round_eta).strftime('%H:%M:%S')}，"
+                      f"实际 {datetime.fromtimestamp(self.round_actual_end).strftime('%H:%M:%S')}"
+                      f"（偏差 {self.round_actual_end - self.round_eta:+.1f}s）")
+        self._poll_mark = (name_alias, time.perf_counter())
+        # map context only applies to the transition it was recognized in
+        self.current_map = None
+
+    def play_route(self, steps, script_name, next_alias):
+        """Play a route and prime polling for the screen expected after it.
+
+        The predicted round end is the script duration plus the learned time
+        from route end to `next_alias` for this script. The wait that follows
+        uses the transition 'route-><next_alias>@<script>', so polling is
+        deferred until that learned window opens.
+        """
+        route = scripttool.script_duration(steps, self.playback_speed)
+        combat = self.poll.expected(f"route->{next_alias}@{script_name}")
+        self.round_eta = time.time() + route + (combat or 0.0)
+        self.round_actual_end = None
+        eta_txt = datetime.fromtimestamp(self.round_eta).strftime('%H:%M:%S')
+        if combat is None:
+            self._log(f"🧭 路线预计 {route:.1f}s，战斗时长未知（学习中），预计最早结束 {eta_txt}")
+        else:
+            self._log(f"🧭 路线预计 {route:.1f}s + 战斗 {combat:.1f}s，预计本轮结束 {eta_txt}")
+        if isinstance(steps, scripttool.BinarySteps):
+            has_checkpoint = steps.has_checkpoints
+        else:
+            has_checkpoint = any(st.get('type') == 'checkpoint' for st in steps) \
+                if isinstance(steps, list) else False
+        if has_checkpoint:
+            self.frame_source.start()
+        try:
+            self.play_actions(self.selected_hwnd, steps, self._log, self.stop_event,
+                              vision=self._checkpoint_vision if has_checkpoint else None,
+                              speed=self.playback_speed)
+        finally:
+            if has_checkpoint:
+                self.frame_source.stop()
+        self._poll_mark = ('route', time.perf_counter())
+        self.current_map = script_name
+
+    def _checkpoint_vision(self, st, stop_event):
+        """Resolve a checkpoint step against frames from the shared frame source."""
+        tpl = st.get('template', '')
+        path = tpl if os.path.isabs(tpl) else os.path.join(self.control_dir, tpl)
+        if not os.path.isfile(path):
+            path = os.path.join(self.base_dir, tpl)
+        thr = float(st.get('threshold', self.threshold))
+        region = st.get('region')
+        deadline = time.perf_counter() + float(st.get('timeout', 3.0))
+        latest = self.frame_source.latest()
+        seq = latest[0] - 1 if latest else 0   # the current frame is fresh enough to try first
+        while not stop_event.is_set():
+            remain = deadline - time.perf_counter()
+            if remain <= 0:
+                return None
+            frame = self.frame_source.wait_newer(seq, remain)
+            if frame is None:
+                return None
+            seq, _t, img = frame
+            if region:
+                x, y, w, h = region
+                img = img[max(0, y):y + h, max(0, x):x + w]
+            self.telemetry.count('matches')
+            m = match_template(img, path, thr)
+            if m:
+                return m
+        return None
+
+    def _wait_and_click(self, template_filename, name_alias, timeout=None, expect_next=None):
+        """Wait for a control template and click it.
+
+        expect_next: optional control template filename expected after the
+        click; the post-click settle wait ends as soon as it is visible.
+        """
         if timeout is None:
             timeout = self.timeout_seconds
         deadline = time.time() + timeout
         tpl_path = os.path.join(self.control_dir, template_filename)
         self._log(f"⏳ 等待 {name_alias}_button，超时{timeout:.0f}s …")
+        key = self._poll_key(name_alias)
         while self.running and not self.stop_event.is_set() and time.time() < deadline:
-            img = self.capturer.capture_background()
+            img = self._grab()
             m = match_template(img, tpl_path, self.threshold)
             if m:
                 cx, cy = m['center']
                 self._log(f"🔍 识别到 {name_alias}_button (score={m['score']:.2f})，点击中心: ({cx},{cy})")
+                self._poll_hit(key, name_alias)
                 # Convert to client coordinates for SendMessage
                 win_left, win_top, _, _ = win32gui.GetWindowRect(self.selected_hwnd)
                 client_pt = win32gui.ScreenToClient(self.selected_hwnd, (win_left + cx, win_top + cy))
@@ -1212,25 +1961,14 @@ class App:
                 win32gui.SendMessage(target, win32con.WM_LBUTTONDOWN, win32con.MK_LBUTTON, lp)
                 # short, interruptible hold (~80ms)
                 hold_ms = 0.08
-                waited = 0.0
-                step = 0.01
-                while waited < hold_ms and self.running and not self.stop_event.is_set():
-                    time.sleep(step)
-                    waited += step
+                self.wait(hold_ms)
                 win32gui.SendMessage(target, win32con.WM_LBUTTONUP, 0, lp)
-                # interruptible wait
-                waited = 0.0
-                step = 0.05
-                while waited < self.post_click_wait and self.running and not self.stop_event.is_set():
-                    time.sleep(step)
-                    waited += step
+                # wait for the screen to settle (bounded by post_click_wait)
+                expect = os.path.join(self.control_dir, expect_next) if expect_next else None
+                self.wait_settle(self.post_click_wait, expect=expect)
                 return True
-            # interruptible retry sleep
-            waited = 0.0
-            step = 0.05
-            while waited < self.retry_interval and self.running and not self.stop_event.is_set():
-                time.sleep(step)
-                waited += step
+            # adaptive, interruptible retry sleep
+            self._poll_sleep(key)
         self._log(f"⏰ 等待 {name_alias}_button 超时，已停止。")
         self.running = False
         return False
@@ -1240,17 +1978,15 @@ class App:
             timeout = self.timeout_seconds
         deadline = time.time() + timeout
         tpl_path = os.path.join(self.control_dir, template_filename)
+        key = self._poll_key(name_alias)
         while self.running and not self.stop_event.is_set() and time.time() < deadline:
-            img = self.capturer.capture_background()
+            img = self._grab()
             m = match_template(img, tpl_path, self.threshold)
             if m:
                 self._log(f"🔍 检测到 {name_alias} (score={m['score']:.2f})")
+                self._poll_hit(key, name_alias)
                 return True
-            waited = 0.0
-            step = 0.05
-            while waited < self.retry_interval and self.running and not self.stop_event.is_set():
-                time.sleep(step)
-                waited += step
+            self._poll_sleep(key)
         self._log(f"⏰ 等待 {name_alias} 超时，已停止。")
         self.running = False
         return False
@@ -1262,36 +1998,26 @@ class App:
         deadline = time.time() + (timeout or 0)
         tpl_path = os.path.join(self.control_dir, template_filename)
         self._log(f"🖱️ 尝试点击 {name_alias}_button（可选），超时{timeout:.1f}s …")
+        key = self._poll_key(name_alias)
         while self.running and not self.stop_event.is_set() and time.time() < deadline:
-            img = self.capturer.capture_background()
+            img = self._grab()
             m = match_template(img, tpl_path, self.threshold)
             if m:
                 cx, cy = m['center']
                 self._log(f"🔍 识别到 {name_alias}_button (score={m['score']:.2f})，点击中心: ({cx},{cy})")
+                self._poll_hit(key, name_alias)
                 win_left, win_top, _, _ = win32gui.GetWindowRect(self.selected_hwnd)
                 tx, ty = win32gui.ScreenToClient(self.selected_hwnd, (win_left + cx, win_top + cy))
                 target = child_from_client_point(self.selected_hwnd, tx, ty)
                 lp = _pack_lparam(tx, ty)
                 send_mouse_move(target, tx, ty)
                 win32gui.SendMessage(target, win32con.WM_LBUTTONDOWN, win32con.MK_LBUTTON, lp)
-                waited = 0.0
-                step = 0.01
-                while waited < 0.08 and self.running and not self.stop_event.is_set():
-                    time.sleep(step)
-                    waited += step
+                self.wait(0.08)
                 win32gui.SendMessage(target, win32con.WM_LBUTTONUP, 0, lp)
-                waited = 0.0
-                step = 0.05
-                while waited < self.post_click_wait and self.running and not self.stop_event.is_set():
-                    time.sleep(step)
-                    waited += step
+                self.wait_settle(self.post_click_wait)
                 return True
             # retry interval
-            waited = 0.0
-            step = 0.05
-            while waited < self.retry_interval and self.running and not self.stop_event.is_set():
-                time.sleep(step)
-                waited += step
+            self._poll_sleep(key)
         return False
 
     def _wait_and_click_either(self, choices, timeout=None):
@@ -1303,8 +2029,9 @@ class App:
         deadline = time.time() + timeout
         # prebuild paths
         files = [(os.path.join(self.control_dir, fn), alias) for fn, alias in choices]
+        key = self._poll_key('|'.join(alias for _fn, alias in choices))
         while self.running and not self.stop_event.is_set() and time.time() < deadline:
-            img = self.capturer.capture_background()
+            img = self._grab()
             best = None
             for path, alias in files:
                 m = match_template(img, path, self.threshold)
@@ -1317,6 +2044,7 @@ class App:
                 score, m, alias, path = best
                 cx, cy = m['center']
                 self._log(f"🔍 识别到 {alias}_button (score={score:.2f})，点击中心: ({cx},{cy})")
+                self._poll_hit(key, alias)
                 win_left, win_top, _, _ = win32gui.GetWindowRect(self.selected_hwnd)
                 tx, ty = win32gui.ScreenToClient(self.selected_hwnd, (win_left + cx, win_top + cy))
                 target = child_from_client_point(self.selected_hwnd, tx, ty)
@@ -1325,36 +2053,25 @@ class App:
                 win32gui.SendMessage(target, win32con.WM_LBUTTONDOWN, win32con.MK_LBUTTON, lp)
                 # short, interruptible hold (~80ms)
                 hold_ms = 0.08
-                waited = 0.0
-                step = 0.01
-                while waited < hold_ms and self.running and not self.stop_event.is_set():
-                    time.sleep(step)
-                    waited += step
+                self.wait(hold_ms)
                 win32gui.SendMessage(target, win32con.WM_LBUTTONUP, 0, lp)
                 # post click wait
-                waited = 0.0
-                step = 0.05
-                while waited < self.post_click_wait and self.running and not self.stop_event.is_set():
-                    time.sleep(step)
-                    waited += step
+                self.wait_settle(self.post_click_wait)
                 return alias
             # retry interval
-            waited = 0.0
-            step = 0.05
-            while waited < self.retry_interval and self.running and not self.stop_event.is_set():
-                time.sleep(step)
-                waited += step
+            self._poll_sleep(key)
         self._log("等待按钮(确认选择/开始挑战)超时，已停止。")
         self.running = False
         return False
 
     def _recognize_map_name(self):
-        img = self.capturer.capture_background()
+        img = self._grab()
         if img is None:
             return None
         edge_img = _edges1ch(img)
         # Three-scale best score for a single template path
         def _score_for(path):
+            self.telemetry.count('matches')
             if path not in self._tpl_edge_cache:
                 e, mask = _load_template_edge_and_mask(path)
                 self._tpl_edge_cache[path] = (e, mask)
@@ -1429,41 +2146,75 @@ class App:
         self._log(f"地图匹配Top3: {top3}")
         top1_name, top1_total, *_ = candidates[0]
         self._log(f"地图识别为 {top1_name} (sum={top1_total:.2f})")
+        self.current_map = top1_name
         return top1_name
 
     def _load_actions(self, map_name):
+        """Return the normalized steps for a script, re-reading it only when it changed.
+
+        Parsed scripts are cached by path and keyed on mtime/size, so after the
+        first round a loop iteration costs one os.stat and no JSON I/O.
+        """
         def _resolve_json_path(name):
             safe_name = (name or '').strip()
+            cache_key = (self.json_dir, safe_name)
+            cached = self._script_path_cache.get(cache_key)
+            if cached and os.path.isfile(cached):
+                return cached
             cand = os.path.join(self.json_dir, f"{safe_name}.json")
-            if os.path.isfile(cand):
-                return cand
+            # JSON first, then the compact binary format
+            for ext in ('.json', scripttool.BIN_EXT):
+                p = os.path.join(self.json_dir, f"{safe_name}{ext}")
+                if os.path.isfile(p):
+                    self._script_path_cache[cache_key] = p
+                    return p
             # case-insensitive fallback
             try:
-                target = f"{safe_name}.json".lower()
+                targets = [f"{safe_name}{ext}".lower() for ext in ('.json', scripttool.BIN_EXT)]
                 for f in os.listdir(self.json_dir):
-                    if f.lower() == target:
-                        return os.path.join(self.json_dir, f)
+                    if f.lower() in targets:
+                        found = os.path.join(self.json_dir, f)
+                        self._script_path_cache[cache_key] = found
+                        return found
             except Exception:
                 pass
             return cand
 
         json_path = _resolve_json_path(map_name)
-        if not os.path.isfile(json_path):
+        try:
+            st = os.stat(json_path)
+        except OSError:
             self._log(f"未找到动作文件: {json_path}")
             try:
-                files = [f for f in os.listdir(self.json_dir) if f.lower().endswith('.json')]
+                files = [f for f in os.listdir(self.json_dir) if f.lower().endswith(('.json', scripttool.BIN_EXT))]
                 self._log(f"可用脚本: {', '.join(files) if files else '无'}")
             except Exception:
                 pass
             return None
+        cached = self._script_cache.get(json_path)
+        if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+            self._log(f"加载脚本(缓存): {json_path}")
+            return cached[2]
         try:
             self._log(f"加载脚本: {json_path}")
-            with open(json_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            return data.get('steps', [])
+            if json_path.lower().endswith(scripttool.BIN_EXT):
+                # read into memory, not mapped: a mapping held by the cache would make
+                # os.replace fail on Windows when the script is rewritten while the app runs;
+                # only the key and checkpoint tables need validating
+                steps = scripttool.load_binary_steps(json_path, mmap=False)
+                for k in steps.keys[1:]:
+                    vk_from_key_name(k)
+                normalize_steps([dict(cp, type='checkpoint') for cp in steps.checkpoints[1:]])
+            else:
+                with open(json_path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                steps = normalize_steps(data.get('steps', []))
         except Exception as e:
+            self._script_cache.pop(json_path, None)
             self._log(f"读取 {json_path} 失败: {e}")
             return None
+        self._script_cache[json_path] = (st.st_mtime_ns, st.st_size, steps)
+        return steps
 
 
     # Periodic status updater
@@ -1487,8 +2238,18 @@ class App:
                 elapsed = time.time() - (self.started_at or time.time())
                 remain_time = (self.auto_stop_seconds - elapsed) if self.auto_stop_seconds else 0
                 loops_part = f"剩余循环: {remain_loops}" if self.max_loops else "循环: 不限"
+                if self.loops_done:
+                    loops_part += f"（已完成 {self.loops_done}，{self.telemetry.runs_per_hour():.1f} 轮/小时）"
                 time_part = f"剩余时间: {_fmt_time(remain_time)}" if self.auto_stop_seconds else "定时关闭: 关闭"
-                self.status_var.set(f"状态: 运行中 | {loops_part} | {time_part}")
+                round_part = ""
+                if self.round_eta:
+                    eta = datetime.fromtimestamp(self.round_eta).strftime('%H:%M:%S')
+                    if self.round_actual_end:
+                        act = datetime.fromtimestamp(self.round_actual_end).strftime('%H:%M:%S')
+                        round_part = f" | 本轮结束: 预计 {eta} / 实际 {act}"
+                    else:
+                        round_part = f" | 本轮预计结束: {eta}（还剩 {_fmt_time(self.round_eta - time.time())}）"
+                self.status_var.set(f"状态: 运行中 | {loops_part} | {time_part}{round_part}")
             else:
                 self.status_var.set("状态: 已停止")
         except Exception:
@@ -0,0 +1,151 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+import scripttool
+from scripttool import expected_timeline
+from main import play_actions, normalize_steps, Win32InputBackend
+
+
+class RecordingBackend:
+    """Fake input backend for play_actions that records (perf_counter, event, arg)."""
+
+    def __init__(self):
+        self.events = []
+
+    def _rec(self, event, arg):
+        self.events.append((time.perf_counter(), event, arg))
+
+    def activate(self):
+        self._rec('activate', None)
+
+    def key_down(self, key):
+        self._rec('key_down', key)
+
+    def key_up(self, key):
+        self._rec('key_up', key)
+
+    def mouse_down(self, button):
+        self._rec('mouse_down', button)
+
+    def mouse_up(self, button):
+        self._rec('mouse_up', button)
+
+    def mouse_move(self, dx, dy):
+        self._rec('mouse_move', (dx, dy))
+
+
+class MoveProbe(Win32InputBackend):
+    """Win32InputBackend that records the cursor positions mouse_move would send instead of sending them."""
+
+    def __init__(self, x=400, y=300):
+        self.target = None
+        self.tx, self.ty = x, y
+        self.mx, self.my = x, y
+        self.buttons = 0
+        self.sent = []
+
+    def _send_move(self, x, y):
+        self.sent.append((x, y))
+
+
+def check_moves():
+    """Consecutive relative moves must arrive as the running sum of the recorded deltas."""
+    moves = [(30, -5), (45, 0), (-20, 12), (900, 0), (0, -700), (-1200, 350)]
+    steps = normalize_steps([{'type': 'mouse_move', 'dx': dx, 'dy': dy, 't': 0.01 * i, 'delay': 0.0}
+                             for i, (dx, dy) in enumerate(moves)])
+    probe = MoveProbe()
+    play_actions(None, steps, lambda _msg: None, backend=probe)
+    expected, x, y = [], probe.tx, probe.ty
+    for dx, dy in moves:
+        x, y = x + dx, y + dy
+        expected.append((x, y))
+    ok = probe.sent == expected
+    print(f"[mouse_move] {len(moves)} 次连续移动 | 发送位置 {'OK' if ok else '错误'}")
+    if not ok:
+        print(f"      - 预期 {expected}")
+        print(f"      - 实际 {probe.sent}")
+    return ok
+
+
+def check_overlaps(events):
+    """Same key/button pressed again while still held, or released while not held."""
+    held = set()
+    problems = []
+    for t, ev, arg in events:
+        if ev in ('key_down', 'mouse_down'):
+            if (ev[:3], arg) in held:
+                problems.append(f"{arg} 在按住状态下再次按下 @ {t:.3f}s")
+            held.add((ev[:3], arg))
+        elif ev in ('key_up', 'mouse_up'):
+            if (ev[:3], arg) not in held:
+                problems.append(f"{arg} 未按下即释放 @ {t:.3f}s")
+            held.discard((ev[:3], arg))
+    if held:
+        problems.append(f"结束时仍按住: {', '.join(sorted(a for _k, a in held))}")
+    return problems
+
+
+def validate(steps, speed, scale_holds):
+    backend = RecordingBackend()
+    t0 = time.perf_counter()
+    play_actions(None, steps, lambda _msg: None, backend=backend, speed=speed, scale_holds=scale_holds)
+    actual = [(t - t0, ev, arg) for t, ev, arg in backend.events]
+    expected = expected_timeline(steps, speed, scale_holds)
+    order_ok = [(e, a) for _t, e, a in actual] == [(e, a) for _t, e, a in expected]
+    errors = sorted(abs(a[0] - e[0]) * 1000.0 for a, e in zip(actual, expected))
+    overlaps = check_overlaps(actual)
+    dur_exp = expected[-1][0] if expected else 0.0
+    dur_act = actual[-1][0] if actual else 0.0
+    if errors:
+        mean = sum(errors) / len(errors)
+        p95 = errors[min(len(errors) - 1, int(0.95 * len(errors)))]
+        err_txt = f"误差 平均 {mean:.2f} ms / p95 {p95:.2f} ms / 最大 {errors[-1]:.2f} ms"
+    else:
+        err_txt = "无事件"
+    print(f"  x{speed:<4} 时长 预期 {dur_exp:.2f}s 实际 {dur_act:.2f}s | 顺序 {'OK' if order_ok else '错误'} | "
+          f"重叠 {len(overlaps)} | {err_txt}")
+    for p in overlaps[:5]:
+        print(f"      - {p}")
+    return order_ok and not overlaps
+
+
+def _synthetic():
+    return [
+        {'type': 'key', 'key': 'w', 'hold': 0.6, 'delay': 0.2},
+        {'type': 'key', 'key': 'space', 'hold': 0.05, 'delay': 0.1},
+        {'type': 'speed', 'factor': 1.5},
+        {'type': 'key', 'key': 'a', 'hold': 0.3, 'delay': 0.3},
+        {'type': 'mouse', 'button': 'right', 'hold': 0.2, 'delay': 0.1},
+        {'type': 'speed', 'factor': 1.0},
+        {'type': 'key', 'key': 'd', 'hold': 0.3, 'delay': 0.0},
+    ]
+
+
+def _load(path):
+    if path.lower().endswith(scripttool.BIN_EXT):
+        return list(scripttool.load_binary_steps(path))
+    with open(path, 'r', encoding='utf-8') as f:
+        return normalize_steps(json.load(f).get('steps', []))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="用记录型假输入后端回放脚本，验证各速度倍率下的事件顺序、按键重叠与计时误差")
+    parser.add_argument("scripts", nargs='*', help="JSON/.actb 脚本；省略时使用内置短脚本")
+    parser.add_argument("--speeds", default="1.0,1.25,1.5,2.0", help="逗号分隔的速度倍率")
+    parser.add_argument("--scale-holds", action="store_true", help="按住时长也按倍率压缩")
+    args = parser.parse_args()
+    speeds = [float(x) for x in args.speeds.split(',') if x.strip()]
+    targets = [(os.path.basename(p), _load(p)) for p in args.scripts] or [('synthetic', normalize_steps(_synthetic()))]
+    ok = check_moves()
+    for name, steps in targets:
+        print(f"[{name}] {len(steps)} 步")
+        for sp in speeds:
+            ok = validate(steps, sp, args.scale_holds) and ok
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
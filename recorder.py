@@ -2,6 +2,7 @@ import os
 import sys
 import json
 import time
+import queue
 import threading
 from datetime import datetime
 
@@ -69,6 +70,273 @@ def normalize_key(name: str, scan_code: int = None):
     return None
 
 
+def simplify_path(points, eps=2.0, time_scale=100.0, max_dt=0.05):
+    """Indices of the (t, x, y) points kept by Douglas-Peucker.
+
+    Time counts as a third axis (time_scale pixels per second), so a change
+    of speed is kept as well as a change of direction; afterwards no two kept
+    points are more than max_dt apart, so a long steady turn is still sent
+    as a stream of small moves instead of one jump.
+    """
+    n = len(points)
+    if n <= 2:
+        return list(range(n))
+    pts = [(t * time_scale, x, y) for t, x, y in points]
+    keep = [False] * n
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        a, b = stack.pop()
+        if b - a < 2:
+            continue
+        pa, pb = pts[a], pts[b]
+        seg = [pb[k] - pa[k] for k in range(3)]
+        seg_len2 = sum(c * c for c in seg)
+        worst, worst_i = -1.0, -1
+        for i in range(a + 1, b):
+            p = pts[i]
+            rel = [p[k] - pa[k] for k in range(3)]
+            if seg_len2 > 0:
+                u = max(0.0, min(1.0, sum(rel[k] * seg[k] for k in range(3)) / seg_len2))
+                rel = [rel[k] - u * seg[k] for k in range(3)]
+            d2 = sum(c * c for c in rel)
+            if d2 > worst:
+                worst, worst_i = d2, i
+        if worst > eps * eps:
+            keep[worst_i] = True
+            stack.append((a, worst_i))
+            stack.append((worst_i, b))
+    out = []
+    last = None
+    for i in range(n):
+        if not keep[i]:
+            continue
+        if last is not None:
+            # time budget: fill long gaps with raw points
+            t_next = points[last][0] + max_dt
+            for j in range(last + 1, i):
+                if points[j][0] >= t_next:
+                    out.append(j)
+                    t_next = points[j][0] + max_dt
+        out.append(i)
+        last = i
+    return out
+
+
+def _is_move(e):
+    """True for a mouse-library move event (has a position, no button)."""
+    return hasattr(e, 'x') and hasattr(e, 'y') and not hasattr(e, 'button')
+
+
+class StepBuilder:
+    """Turns timestamped key/mouse down/up events into recorded steps.
+
+    Timestamps are time.perf_counter() values taken in the hook callback, so
+    holds and delays do not depend on when the consumer gets to the event.
+
+    With chords=True every press and release becomes its own
+    key_down/key_up (mouse_down/mouse_up) step stamped with 't' seconds from
+    the first event (or t0), so overlapping holds survive; otherwise one key/mouse
+    step is emitted per release, as before. Auto-repeat downs are dropped in
+    both modes.
+
+    Mouse moves (chord mode only) are buffered per burst and written as
+    relative mouse_move steps after simplify_path; a burst ends after
+    move_gap seconds without movement or when another step is recorded.
+    Each dx/dy is the difference between two successive hook positions (the
+    cursor is not locked); main.Win32InputBackend adds them up again into a
+    virtual cursor on playback.
+    """
+
+    def __init__(self, chords=False, move_eps=2.0, move_gap=0.15, t0=None):
+        self.chords = chords
+        self.key_down_at = {}
+        self.mouse_down_at = {}
+        self.last_event_time = None
+        # origin of 't'; defaults to the first event (recording start when keyframes are captured)
+        self.t0 = t0
+        self.move_eps = move_eps
+        self.move_gap = move_gap
+        self._moves = []        # raw (t, x, y) of the current burst
+        self._move_pos = None   # cursor position after the last emitted move
+        self.raw_moves = 0
+
+    def _event(self, t, kind, **arg):
+        if self.t0 is None:
+            self.t0 = t
+        step = {'type': kind, 't': round(max(0.0, t - self.t0), 3)}
+        step.update(arg)
+        return step
+
+    def _emit(self, t, step):
+        delay = 0.0 if self.last_event_time is None else max(0.0, t - self.last_event_time)
+        self.last_event_time = t
+        step['delay'] = round(delay, 3)
+        return step
+
+    def key(self, t, name, etype):
+        if self.chords:
+            if etype == 'down' and name not in self.key_down_at:
+                self.key_down_at[name] = t
+                return self._event(t, 'key_down', key=name)
+            if etype == 'up' and self.key_down_at.pop(name, None) is not None:
+                return self._event(t, 'key_up', key=name)
+            return None
+        if etype == 'down':
+            # auto-repeat sends more downs; keep the first one
+            if name not in self.key_down_at:
+                self.key_down_at[name] = t
+        elif etype == 'up':
+            start = self.key_down_at.pop(name, None)
+            hold = 0.0 if start is None else max(0.0, t - start)
+            return self._emit(t, {'type': 'key', 'key': name, 'hold': round(hold, 3)})
+        return None
+
+    def mouse(self, t, btn, etype):
+        if self.chords:
+            if etype == 'down' and btn not in self.mouse_down_at:
+                self.mouse_down_at[btn] = t
+                return self._event(t, 'mouse_down', button=btn)
+            if etype == 'up' and self.mouse_down_at.pop(btn, None) is not None:
+                return self._event(t, 'mouse_up', button=btn)
+            return None
+        if etype == 'down':
+            self.mouse_down_at[btn] = t
+        elif etype == 'up':
+            start = self.mouse_down_at.pop(btn, None)
+            hold = 0.0 if start is None else max(0.0, t - start)
+            return self._emit(t, {'type': 'mouse', 'button': btn, 'hold': round(hold, 3)})
+        return None
+
+    def move(self, t, x, y):
+        """Buffer a cursor position; returns the steps of the previous burst if it ended."""
+        if not self.chords:
+            return []
+        out = []
+        if self._moves and t - self._moves[-1][0] > self.move_gap:
+            out = self.flush_moves()
+        self._moves.append((t, int(x), int(y)))
+        self.raw_moves += 1
+        return out
+
+    def flush_moves(self, now=None):
+        """mouse_move steps for the buffered burst (only if it is idle when `now` is given)."""
+        pts = self._moves
+        if not pts or (now is not None and now - pts[-1][0] <= self.move_gap):
+            return []
+        self._moves = []
+        out = []
+        if self._move_pos is None:
+            # the first position only sets the origin
+            self._move_pos = pts[0][1:]
+        px, py = self._move_pos
+        for i in simplify_path(pts, eps=self.move_eps):
+            t, x, y = pts[i]
+            if x == px and y == py:
+                continue
+            out.append(self._event(t, 'mouse_move', dx=x - px, dy=y - py))
+            px, py = x, y
+        self._move_pos = (px, py)
+        return out
+
+    def finish(self, t):
+        """Release events for whatever is still held when recording stops (chord mode)."""
+        out = self.flush_moves()
+        if self.chords:
+            for name in sorted(self.key_down_at):
+                out.append(self._event(t, 'key_up', key=name))
+            for btn in sorted(self.mouse_down_at):
+                out.append(self._event(t, 'mouse_up', button=btn))
+        self.key_down_at.clear()
+        self.mouse_down_at.clear()
+        return out
+
+
+# ------------------------------
+# Journal: steps are appended while recording so a crash loses at most one batch
+# ------------------------------
+JOURNAL_EXT = '.journal'
+
+
+class Journal:
+    """Append-only JSON-lines file: a header line, then one line per step.
+
+    Only the consumer thread writes; lines are flushed to disk every
+    `batch` steps or `interval` seconds, whichever comes first.
+    """
+
+    def __init__(self, path, name, batch=20, interval=0.5):
+        self.path = path
+        self.batch = batch
+        self.interval = interval
+        self._pending = 0
+        self._last_flush = time.perf_counter()
+        self._f = open(path, 'a', encoding='utf-8')
+        self._f.write(json.dumps({'journal': 1, 'name': name, 'started': datetime.now().isoformat(timespec='seconds')},
+                                 ensure_ascii=False) + '\n')
+        self.flush()
+
+    def append(self, step):
+        self._f.write(json.dumps(step, ensure_ascii=False) + '\n')
+        self._pending += 1
+        if self._pending >= self.batch:
+            self.flush()
+
+    def tick(self):
+        if self._pending and time.perf_counter() - self._last_flush >= self.interval:
+            self.flush()
+
+    def flush(self):
+        self._f.flush()
+        try:
+            os.fsync(self._f.fileno())
+        except Exception:
+            pass
+        self._pending = 0
+        self._last_flush = time.perf_counter()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self._f.close()
+
+
+def read_journal(path):
+    """(name, steps) from a journal; a torn last line from a crash is skipped."""
+    name = None
+    steps = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                obj = json.loads(line)
+            except Exception:
+                continue
+            if isinstance(obj, dict) and 'journal' in obj:
+                name = obj.get('name')
+            elif isinstance(obj, dict):
+                steps.append(obj)
+    return name, steps
+
+
+def write_script(path, name, steps):
+    """Write a .json or .actb script atomically (temp file + os.replace)."""
+    if path.lower().endswith('.actb'):
+        import scripttool
+        scripttool.write_binary(path, name, steps)
+        return
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({'name': name, 'steps': steps}, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+FRAME_FPS = 2.0
+FRAME_SCALE = 0.25
+
+
 class RecorderApp:
     def __init__(self, root):
         self.root = root
@@ -76,6 +344,11 @@ class RecorderApp:
         self.base_dir = self._compute_base_dir()
         self.map_dir = self._resolve_map_dir()
         self.json_dir = os.path.join(self.base_dir, 'json')
+        self.journal_dir = os.path.join(self.base_dir, 'journal')
+        self.journal = None
+        self.frames = None
+        self._frame_req = queue.SimpleQueue()
+        self._capture_thread = None
 
         self.selected_hwnd = None
         self.selected_map = tk.StringVar(value='mapA')
@@ -85,14 +358,21 @@ class RecorderApp:
         self.selected_save_disp = tk.StringVar(value='')
 
         self.is_recording = False
+        self._rec_moves = False
+        self._debug_keys = False    # plain copy of debug_keys for the consumer thread
         self.is_cancelling = False
         self.records = []
-        self.last_event_time = None
+        self.builder = StepBuilder()
+        # hook callbacks only enqueue (perf_counter, source, event); the consumer thread builds steps
+        self._events = queue.SimpleQueue()
+        self._consumer = None
+        self._pending_logs = queue.SimpleQueue()
 
         self._build_ui()
         self.refresh_windows()
         self.refresh_maps()
         self._bind_hotkeys()
+        self.root.after(200, self.recover_journals)
 
     def _compute_base_dir(self):
         try:
@@ -158,13 +438,33 @@ class RecorderApp:
         self.include_mouse = tk.BooleanVar(value=False)
         ttk.Checkbutton(frame, text='是否包含鼠标操作录制', variable=self.include_mouse).pack(anchor='w', pady=(0,6))
 
+        # Option: mouse movement (camera turns) as coalesced relative moves
+        self.record_moves = tk.BooleanVar(value=False)
+        ttk.Checkbutton(frame, text='记录鼠标移动(视角转动)', variable=self.record_moves).pack(anchor='w', pady=(0,6))
+
+        # Option: keyframes (periodic + one per step) into a .jfs store next to the script
+        self.capture_frames = tk.BooleanVar(value=False)
+        ttk.Checkbutton(frame, text=f'保存画面关键帧(每秒 {FRAME_FPS:g} 帧 + 每步 1 帧)',
+                        variable=self.capture_frames).pack(anchor='w', pady=(0,6))
+
+        # Option: timed down/up events so keys held together stay overlapped on playback
+        self.record_chords = tk.BooleanVar(value=True)
+        ttk.Checkbutton(frame, text='按下/松开分别记录(保留同时按键)', variable=self.record_chords).pack(anchor='w', pady=(0,6))
+
+        # Option: post-process before saving (idle trim, merges, outlier delays)
+        self.clean_on_save = tk.BooleanVar(value=False)
+        ttk.Checkbutton(frame, text='保存前整理录制(去首尾空闲/合并重复按键/截断异常延迟)',
+                        variable=self.clean_on_save).pack(anchor='w', pady=(0,6))
+
         # Option: debug key capture (log raw names)
         self.debug_keys = tk.BooleanVar(value=False)
-        ttk.Checkbutton(frame, text='调试键盘捕获(输出原始键名)', variable=self.debug_keys).pack(anchor='w')
+        ttk.Checkbutton(frame, text='调试键盘捕获(输出原始键名)', variable=self.debug_keys,
+                        command=self._sync_debug_keys).pack(anchor='w')
 
         self.log = tk.Text(frame, height=16)
         self.log.pack(fill='both', expand=True)
         self.log.configure(state='disabled')
+        self.root.after(100, self._flush_logs)
 
     def _log(self, msg):
         ts = datetime.now().strftime('%H:%M:%S')
@@ -175,6 +475,26 @@ class RecorderApp:
         finally:
             self.log.configure(state='disabled')
 
+    def _log_async(self, msg):
+        # safe from any thread; written to the Text widget by _flush_logs
+        self._pending_logs.put(f"[{datetime.now().strftime('%H:%M:%S')}] {msg}\n")
+
+    def _flush_logs(self):
+        lines = []
+        try:
+            while len(lines) < 500:
+                lines.append(self._pending_logs.get_nowait())
+        except queue.Empty:
+            pass
+        if lines:
+            try:
+                self.log.configure(state='normal')
+                self.log.insert('end', ''.join(lines))
+                self.log.see('end')
+            finally:
+                self.log.configure(state='disabled')
+        self.root.after(100, self._flush_logs)
+
     def _bind_hotkeys(self):
         try:
             import keyboard  # type: ignore
@@ -260,7 +580,7 @@ class RecorderApp:
                 initialdir=initialdir,
                 initialfile=initialfile,
                 defaultextension='.json',
-                filetypes=[('JSON 文件', '*.json'), ('所有文件', '*.*')]
+                filetypes=[('JSON 文件', '*.json'), ('紧凑二进制', '*.actb'), ('所有文件', '*.*')]
             )
         except Exception:
             path = ''
@@ -281,20 +601,175 @@ class RecorderApp:
             messagebox.showwarning('提示', '请选择目标窗口')
             return
         self.records = []
-        self.last_event_time = None
+        self._rec_stem = datetime.now().strftime('rec_%Y%m%d_%H%M%S')
+        self._rec_t0 = time.perf_counter()
+        self.builder = StepBuilder(chords=self.record_chords.get(), t0=self._rec_t0)
+        # read once here: the hook thread must not touch Tk variables
+        self._rec_moves = self.record_moves.get() and self.include_mouse.get() and self.record_chords.get()
+        if self.record_moves.get() and not self._rec_moves:
+            self._log('记录鼠标移动需要同时勾选鼠标录制和按下/松开分别记录，本次不记录移动')
+        self._events = queue.SimpleQueue()
+        self.journal = self._open_journal()
         self.is_cancelling = False
         self.is_recording = True
+        self._consumer = threading.Thread(target=self._consume_events, daemon=True)
+        self._consumer.start()
+        if self.capture_frames.get():
+            self._start_frames()
         self._log('开始录制 (F10 结束保存，F12 放弃)')
         self._start_hooks()
 
+    def _open_journal(self):
+        try:
+            os.makedirs(self.journal_dir, exist_ok=True)
+            path = os.path.join(self.journal_dir, self._rec_stem + JOURNAL_EXT)
+            return Journal(path, self.selected_map.get().strip())
+        except Exception as e:
+            self._log(f'无法创建录制日志，崩溃时将无法恢复: {e}')
+            return None
+
+    def _close_journal(self, delete):
+        jr, self.journal = self.journal, None
+        if jr is None:
+            return None
+        try:
+            jr.close()
+        except Exception:
+            pass
+        if delete:
+            try:
+                os.remove(jr.path)
+            except Exception:
+                pass
+            return None
+        return jr.path
+
+    # Keyframes
+    def _start_frames(self):
+        try:
+            import framestore
+            from main import BackgroundScreenshot
+            os.makedirs(self.journal_dir, exist_ok=True)
+            path = os.path.join(self.journal_dir, self._rec_stem + framestore.FRAME_EXT)
+            self.frames = framestore.FrameStoreWriter(path, scale=FRAME_SCALE)
+            shot = BackgroundScreenshot(self.selected_hwnd)
+        except Exception as e:
+            self.frames = None
+            self._log(f'无法启动关键帧录制: {e}')
+            return
+        self._frame_req = queue.SimpleQueue()
+        self._capture_thread = threading.Thread(target=self._capture_loop, args=(shot, self.frames), daemon=True)
+        self._capture_thread.start()
+
+    def _capture_loop(self, shot, writer):
+        # periodic frames on a fixed grid; step requests are served in between
+        period = 1.0 / FRAME_FPS
+        next_tick = time.perf_counter()
+        while True:
+            step = -1
+            try:
+                req = self._frame_req.get(timeout=max(0.0, next_tick - time.perf_counter()))
+                if req is None:
+                    return
+                step = req
+            except queue.Empty:
+                next_tick += period
+            try:
+                img = shot.capture_background()
+                writer.put(time.perf_counter() - self._rec_t0, img, step)
+            except Exception:
+                pass
+
+    def _stop_frames(self):
+        """Stop capturing and finish the store; returns its path or None."""
+        writer, self.frames = self.frames, None
+        if writer is None:
+            return None
+        th, self._capture_thread = self._capture_thread, None
+        if th is not None:
+            self._frame_req.put(None)
+            th.join(timeout=2.0)
+        try:
+            writer.close()
+        except Exception as e:
+            self._log(f'关键帧写入失败: {e}')
+        self._log(f'关键帧: 已写入 {writer.written} 帧' + (f'，丢弃 {writer.dropped} 帧' if writer.dropped else ''))
+        return writer.path
+
+    def _keep_frames(self, frames_path, script_path):
+        if not frames_path:
+            return
+        try:
+            import framestore
+            dst = os.path.splitext(script_path)[0] + framestore.FRAME_EXT
+            framestore.move_store(frames_path, dst)
+            self._log(f'关键帧已保存到 {dst}')
+        except Exception as e:
+            self._log(f'移动关键帧文件失败: {e}')
+
+    def _drop_frames(self, frames_path):
+        if frames_path:
+            try:
+                import framestore
+                framestore.remove_store(frames_path)
+            except Exception:
+                pass
+
+    def recover_journals(self):
+        try:
+            paths = sorted(os.path.join(self.journal_dir, fn) for fn in os.listdir(self.journal_dir)
+                           if fn.endswith(JOURNAL_EXT))
+        except Exception:
+            return
+        found = []
+        for p in paths:
+            try:
+                name, steps = read_journal(p)
+            except Exception:
+                continue
+            if steps:
+                found.append((p, name or 'recovered', steps))
+            else:
+                try:
+                    os.remove(p)
+                except Exception:
+                    pass
+        if not found:
+            return
+        desc = '\n'.join(f"{os.path.basename(p)}: {name}, {len(steps)} 步" for p, name, steps in found)
+        if not messagebox.askyesno('恢复录制', f'发现上次未保存的录制:\n{desc}\n\n是否恢复到 json 目录？'):
+            self._log('已跳过未保存录制的恢复（下次启动会再次提示）')
+            return
+        try:
+            os.makedirs(self.json_dir, exist_ok=True)
+        except Exception:
+            pass
+        for p, name, steps in found:
+            stamp = os.path.splitext(os.path.basename(p))[0].replace('rec_', '')
+            out = os.path.join(self.json_dir, f'{name}_recovered_{stamp}.json')
+            try:
+                write_script(out, name, steps)
+                os.remove(p)
+                self._log(f'已恢复 {len(steps)} 步到 {out}')
+                frames = os.path.splitext(p)[0] + '.jfs'
+                if os.path.exists(frames):
+                    self._keep_frames(frames, out)
+            except Exception as e:
+                self._log(f'恢复 {p} 失败: {e}')
+
     def stop_and_save(self):
         if not self.is_recording:
             return
         self.is_recording = False
         self._stop_hooks()
+        self._stop_consumer()
+        frames_path = self._stop_frames()
         if self.is_cancelling:
+            self._close_journal(delete=True)
+            self._drop_frames(frames_path)
             self._log('已放弃本次录制')
             return
+        journal_path = self._close_journal(delete=False)
         map_name = self.selected_map.get().strip()
         if not map_name:
             messagebox.showwarning('提示', '请选择地图模板')
@@ -311,25 +786,44 @@ class RecorderApp:
                     initialdir=self.json_dir if os.path.isdir(self.json_dir) else self.base_dir,
                     initialfile=f'{map_name}.json',
                     defaultextension='.json',
-                    filetypes=[('JSON 文件', '*.json'), ('所有文件', '*.*')]
+                    filetypes=[('JSON 文件', '*.json'), ('紧凑二进制', '*.actb'), ('所有文件', '*.*')]
                 )
             except Exception:
                 out_path = ''
             if not out_path:
-                self._log('已取消保存')
+                self._log('已取消保存' + (f'，录制日志保留在 {journal_path}' if journal_path else ''))
                 return
             self.selected_save_path = out_path
             self.selected_save_disp.set(out_path)
-        data = {
-            'name': map_name,
-            'steps': self.records,
-        }
+        steps = self.records
+        if journal_path:
+            try:
+                _name, steps = read_journal(journal_path)
+            except Exception as e:
+                self._log(f'读取录制日志失败，改用内存记录: {e}')
+                steps = self.records
+        if self.clean_on_save.get():
+            try:
+                import scripttool
+                cleaned, stats = scripttool.clean_steps(steps)
+                self._log(scripttool.clean_report(map_name, steps, cleaned, stats))
+                if frames_path and len(cleaned) != len(steps):
+                    self._log('注意: 关键帧的步骤编号对应整理前的原始录制')
+                steps = cleaned
+            except Exception as e:
+                self._log(f'整理录制失败，按原样保存: {e}')
         try:
-            with open(out_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-            self._log(f'已保存到 {out_path} (共 {len(self.records)} 步)')
+            write_script(out_path, map_name, steps)
+            self._log(f'已保存到 {out_path} (共 {len(steps)} 步)')
         except Exception as e:
-            self._log(f'保存失败: {e}')
+            self._log(f'保存失败: {e}' + (f'，录制日志保留在 {journal_path}' if journal_path else ''))
+            return
+        if journal_path:
+            try:
+                os.remove(journal_path)
+            except Exception:
+                pass
+        self._keep_frames(frames_path, out_path)
 
     def cancel_record(self):
         if not self.is_recording:
@@ -337,6 +831,9 @@ class RecorderApp:
         self.is_cancelling = True
         self.is_recording = False
         self._stop_hooks()
+        self._stop_consumer()
+        self._drop_frames(self._stop_frames())
+        self._close_journal(delete=True)
         self.records = []
         self._log('已取消本次录制')
 
@@ -376,69 +873,161 @@ class RecorderApp:
         except Exception as e:
             self._log(f'解除钩子时出错: {e}')
 
-    def _append_step(self, step):
-        now = time.time()
-        if self.last_event_time is None:
-            delay = 0.0
-        else:
-            delay = max(0.0, now - self.last_event_time)
-        self.last_event_time = now
-        step['delay'] = round(delay, 3)
-        self.records.append(step)
-        self._log(f"记录: {step}")
+    def _sync_debug_keys(self):
+        self._debug_keys = bool(self.debug_keys.get())
 
     def _on_kb_event(self, e):
-        if not self.is_recording:
-            return
-        try:
-            raw = (e.name or '')
-            etype = getattr(e, 'event_type', '')
-            rawl = raw.lower()
-            if self.debug_keys.get():
-                self._log(f"[DBG] key {etype}: '{raw}' sc={getattr(e, 'scan_code', None)}")
-            # ignore our hotkeys & win keys
-            if rawl in ('left windows', 'right windows', 'f9', 'f10', 'f12'):
-                return
-            name = normalize_key(raw, getattr(e, 'scan_code', None))
-            if name is None or name not in ALLOWED_KEYS:
-                return
-            if etype == 'down':
-                if not hasattr(self, '_key_down_at'):
-                    self._key_down_at = {}
-                if name not in getattr(self, '_key_down_at', {}):
-                    self._key_down_at[name] = time.time()
-            elif etype == 'up':
-                start = None
-                if hasattr(self, '_key_down_at'):
-                    start = self._key_down_at.pop(name, None)
-                hold = 0.0 if start is None else max(0.0, time.time() - start)
-                self._append_step({'type': 'key', 'key': name, 'hold': round(hold, 3)})
-        except Exception:
-            pass
+        # runs on the hook thread: timestamp and enqueue only
+        if self.is_recording:
+            self._events.put((time.perf_counter(), 'kb', e))
 
     def _on_mouse_event(self, e):
-        if not self.is_recording:
-            return
-        try:
-            # mouse library provides attributes: event_type in ('down','up') and button in ('left','right','middle')
-            if hasattr(e, 'button') and hasattr(e, 'event_type'):
-                btn = 'left' if str(getattr(e, 'button')).lower() == 'left' else 'right'
-                etype = str(getattr(e, 'event_type')).lower()
-                if etype == 'down':
-                    if not hasattr(self, '_mouse_down_at'):
-                        self._mouse_down_at = {}
-                    self._mouse_down_at[btn] = time.time()
-                elif etype == 'up':
-                    start = None
-                    if hasattr(self, '_mouse_down_at'):
-                        start = self._mouse_down_at.pop(btn, None)
-                    hold = 0.0 if start is None else max(0.0, time.time() - start)
-                    self._append_step({'type': 'mouse', 'button': btn, 'hold': round(hold, 3)})
-        except Exception:
-            pass
+        # moves are by far the most frequent events: drop them here unless they are recorded
+        if self.is_recording and (self._rec_moves or not _is_move(e)):
+            self._events.put((time.perf_counter(), 'mouse', e))
+
+    def _stop_consumer(self):
+        # drain whatever the hooks queued before they were removed
+        th = self._consumer
+        self._consumer = None
+        if th is not None:
+            self._events.put(None)
+            th.join(timeout=2.0)
+            for step in self.builder.finish(time.perf_counter()):
+                self._record_step(step)
+            if self.builder.raw_moves:
+                moves = sum(1 for st in self.records if st.get('type') == 'mouse_move')
+                self._log_async(f'鼠标移动: 原始 {self.builder.raw_moves} 个事件，合并后 {moves} 个')
+
+    def _record_step(self, step):
+        self.records.append(step)
+        if self.frames is not None and step.get('type') != 'mouse_move':
+            self._frame_req.put(len(self.records) - 1)
+        if self.journal is not None:
+            self.journal.append(step)
+            self.journal.tick()
+        self._log_async(f"记录: {step}")
+
+    def _consume_events(self):
+        while True:
+            try:
+                item = self._events.get(timeout=0.25)
+            except queue.Empty:
+                for step in self.builder.flush_moves(time.perf_counter()):
+                    self._record_step(step)
+                if self.journal is not None:
+                    self.journal.tick()
+                continue
+            if item is None:
+                return
+            t, source, e = item
+            try:
+                if source == 'mouse' and _is_move(e):
+                    for step in self.builder.move(t, e.x, e.y):
+                        self._record_step(step)
+                    continue
+                if source == 'kb':
+                    step = self._handle_kb(t, e)
+                else:
+                    step = self._handle_mouse(t, e)
+                if step is not None:
+                    # moves before this step must be written first to keep 't' ordered;
+                    # dropped events (auto-repeat, hotkeys) do not cut a burst
+                    for mv in self.builder.flush_moves():
+                        self._record_step(mv)
+                    self._record_step(step)
+            except Exception:
+                pass
+
+    def _handle_kb(self, t, e):
+        raw = (e.name or '')
+        etype = getattr(e, 'event_type', '')
+        rawl = raw.lower()
+        if self._debug_keys:
+            self._log_async(f"[DBG] key {etype}: '{raw}' sc={getattr(e, 'scan_code', None)}")
+        # ignore our hotkeys & win keys
+        if rawl in ('left windows', 'right windows', 'f9', 'f10', 'f12'):
+            return None
+        name = normalize_key(raw, getattr(e, 'scan_code', None))
+        if name is None or name not in ALLOWED_KEYS:
+            return None
+        return self.builder.key(t, name, etype)
+
+    def _handle_mouse(self, t, e):
+        # mouse library provides attributes: event_type in ('down','up') and button in ('left','right','middle')
+        if not (hasattr(e, 'button') and hasattr(e, 'event_type')):
+            return None
+        btn = 'left' if str(getattr(e, 'button')).lower() == 'left' else 'right'
+        return self.builder.mouse(t, btn, str(getattr(e, 'event_type')).lower())
+
+
+def selftest(n_keys=60, ui_cost=0.002):
+    """Replay a synthetic key schedule through the hook->queue->consumer path.
+
+    Compares recorded holds/delays with the generated ones, once with the
+    timestamp taken in the hook (current path) and once taken by the consumer
+    after a simulated per-event UI cost (what the old in-hook _log did).
+    """
+    import random
+    rng = random.Random(7)
+    schedule = []  # (offset, name, etype)
+    truth = []
+    t = 0.0
+    prev_up = None
+    for _ in range(n_keys):
+        name = rng.choice('wasd')
+        gap = rng.uniform(0.005, 0.06)
+        hold = rng.uniform(0.01, 0.12)
+        down, up = t + gap, t + gap + hold
+        schedule.append((down, name, 'down'))
+        schedule.append((up, name, 'up'))
+        truth.append((hold, 0.0 if prev_up is None else up - prev_up))
+        prev_up = up
+        t = up
+
+    def run(stamp_in_hook):
+        events = queue.SimpleQueue()
+        builder = StepBuilder()
+        steps = []
+
+        def consume():
+            while True:
+                item = events.get()
+                if item is None:
+                    return
+                ts, name, etype = item
+                if not stamp_in_hook:
+                    time.sleep(ui_cost)
+                    ts = time.perf_counter()
+                st = builder.key(ts, name, etype)
+                if st is not None:
+                    steps.append(st)
+
+        th = threading.Thread(target=consume, daemon=True)
+        th.start()
+        t0 = time.perf_counter()
+        for off, name, etype in schedule:
+            while time.perf_counter() - t0 < off:
+                pass
+            events.put((time.perf_counter(), name, etype))
+        events.put(None)
+        th.join()
+        errs = []
+        for st, (hold, delay) in zip(steps, truth):
+            errs.append(abs(st['hold'] - hold) * 1000.0)
+            errs.append(abs(st['delay'] - delay) * 1000.0)
+        errs.sort()
+        return len(steps), sum(errs) / len(errs), errs[int(0.95 * (len(errs) - 1))], errs[-1]
+
+    for label, in_hook in (('消费线程取时间', False), ('钩子内取时间', True)):
+        cnt, mean, p95, worst = run(in_hook)
+        print(f"[{label}] {cnt}/{n_keys} 步, 误差 平均 {mean:.2f} ms / p95 {p95:.2f} ms / 最大 {worst:.2f} ms")
+    return 0
 
 
 def main():
+    if '--selftest' in sys.argv[1:]:
+        sys.exit(selftest())
     root = tk.Tk()
     app = RecorderApp(root)
     root.geometry('780x460')
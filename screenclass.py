@@ -0,0 +1,249 @@
+import os
+import json
+import time
+
+import numpy as np
+import cv2
+
+
+# ------------------------------
+# One-pass screen classifier
+# ------------------------------
+# Known UI screens and the control/ templates that identify them.
+KNOWN_SCREENS = {
+    'lobby': ['kaishitiaozhan.png'],
+    'mihan_entry': ['xuanzemihan.png'],
+    'mihan_list': ['bushiyong.png'],
+    'confirm': ['querenxuanze.png'],
+    'in_map': ['likai.png'],
+    'result': ['zaicijinixng.png'],
+}
+
+
+def _fingerprint(gray, rect, size):
+    """Zero-mean, unit-norm thumbnail of a region, or None if it is (nearly) flat."""
+    x, y, w, h = rect
+    roi = gray[max(0, y):y + h, max(0, x):x + w]
+    if roi.shape[0] < h or roi.shape[1] < w or roi.size == 0:
+        return None
+    v = cv2.resize(roi, size, interpolation=cv2.INTER_AREA).astype(np.float32).ravel()
+    v -= v.mean()
+    if float(v.std()) < 2.0:
+        return None
+    return v / float(np.linalg.norm(v))
+
+
+class FrameContext:
+    """Per-frame preprocessing shared by every template checked against it."""
+
+    def __init__(self, img, scale):
+        self.img = img
+        self.scale = scale
+        self.gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        self.small = cv2.resize(self.gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) \
+            if scale != 1.0 else self.gray
+
+
+class ScreenClassifier:
+    """Decide which known screens are showing in one frame.
+
+    Per template, the cheap path compares a learned fingerprint of the region
+    where it was last found (a small normalized thumbnail) with the same
+    region of the frame, and returns the stored click point on a hit. Only if
+    that fails does it run template matching, coarse on a downscaled
+    grayscale copy of the frame (computed once per frame for all templates)
+    and refined at full resolution in a small window around the coarse hit.
+    Each confirmed match (re)learns the fingerprint, so static screens are
+    recognized without a full-frame search from the second visit on.
+
+    Learned entries are re-verified with a full-resolution match in their own
+    window every verify_every fingerprint hits or after max_age seconds, and
+    dropped when that fails. save()/load() keep them across runs.
+    """
+
+    def __init__(self, control_dir, scale=0.5, fp_size=(24, 12), fp_thr=0.97, verify_every=15, max_age=900.0):
+        self.control_dir = control_dir
+        self.scale = scale
+        self.fp_size = fp_size
+        self.fp_thr = fp_thr
+        self.verify_every = int(verify_every)
+        self.max_age = float(max_age)
+        self._tpl = {}          # path -> (mtime, color, small gray)
+        # (path, scale) -> {'rect', 'fp', 'frame': (h, w), 'hits': fast-path hits since verified, 't': verified at}
+        self._fp = {}
+        self.stats = {'fingerprint': 0, 'verified': 0, 'expired': 0, 'template': 0, 'miss': 0}
+
+    def _path(self, fn):
+        return fn if os.path.isabs(fn) else os.path.join(self.control_dir, fn)
+
+    def _template(self, path):
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        ent = self._tpl.get(path)
+        if ent is None or ent[0] != mtime:
+            tpl = cv2.imread(path, cv2.IMREAD_COLOR)
+            if tpl is None:
+                return None
+            g = cv2.cvtColor(tpl, cv2.COLOR_BGR2GRAY)
+            small = cv2.resize(g, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA) \
+                if self.scale != 1.0 else g
+            ent = (mtime, tpl, small)
+            self._tpl[path] = ent
+            # the template changed: fingerprints learned from the old one are stale
+            for k in [k for k in self._fp if k[0] == path]:
+                del self._fp[k]
+        return ent
+
+    def context(self, img):
+        return FrameContext(img, self.scale)
+
+    def forget(self, fn=None):
+        """Drop learned fingerprints (all, or those of one template)."""
+        if fn is None:
+            self._fp.clear()
+            return
+        path = self._path(fn)
+        for k in [k for k in self._fp if k[0] == path]:
+            del self._fp[k]
+
+    def _refine(self, ctx, path, tpl, s, x, y, threshold, pad):
+        """Full-resolution match of the template (at scale s) in a window around (x, y); learns on success."""
+        full = tpl if s == 1.0 else cv2.resize(tpl, None, fx=s, fy=s, interpolation=cv2.INTER_LINEAR)
+        th, tw = full.shape[:2]
+        ih, iw = ctx.img.shape[:2]
+        x0 = max(0, x - pad)
+        y0 = max(0, y - pad)
+        x1 = min(iw, x0 + tw + 2 * pad)
+        y1 = min(ih, y0 + th + 2 * pad)
+        win = ctx.img[y0:y1, x0:x1]
+        if win.shape[0] < th or win.shape[1] < tw:
+            return None
+        r = cv2.matchTemplate(win, full, cv2.TM_CCOEFF_NORMED)
+        _min, score, _minl, (mx, my) = cv2.minMaxLoc(r)
+        if score < threshold:
+            return None
+        rect = (x0 + mx, y0 + my, tw, th)
+        ref = _fingerprint(ctx.gray, rect, self.fp_size)
+        if ref is not None:
+            self._fp[(path, s)] = {'rect': rect, 'fp': ref, 'frame': ctx.gray.shape[:2], 'hits': 0, 't': time.time()}
+        return {'score': float(score), 'rect': rect, 'center': (rect[0] + tw // 2, rect[1] + th // 2)}
+
+    def _fast(self, ctx, path, tpl, scales, threshold):
+        """Match from a learned fingerprint (verified when due), or None to fall back to searching."""
+        for s in scales:
+            ent = self._fp.get((path, s))
+            if ent is None or tuple(ent['frame']) != ctx.gray.shape[:2]:
+                continue
+            cur = _fingerprint(ctx.gray, ent['rect'], self.fp_size)
+            sim = float(np.dot(cur, ent['fp'])) if cur is not None else -1.0
+            if sim < self.fp_thr:
+                continue
+            x, y, w, h = ent['rect']
+            ent['hits'] += 1
+            if ent['hits'] < self.verify_every and time.time() - ent['t'] < self.max_age:
+                self.stats['fingerprint'] += 1
+                return {'score': sim, 'rect': ent['rect'], 'center': (x + w // 2, y + h // 2), 'via': 'fingerprint'}
+            m = self._refine(ctx, path, tpl, s, x, y, threshold, 2)
+            if m is None:
+                # looks the same but no longer matches at full resolution: expire it
+                self._fp.pop((path, s), None)
+                self.stats['expired'] += 1
+                continue
+            self.stats['verified'] += 1
+            m['via'] = 'verified'
+            return m
+        return None
+
+    def match(self, ctx, fn, threshold, scales=None):
+        """Match dict ({'score','rect','center','via'}) for one template, or None."""
+        path = self._path(fn)
+        ent = self._template(path)
+        if ent is None:
+            return None
+        _mtime, tpl, small_tpl = ent
+        scales = scales or [1.0]
+        m = self._fast(ctx, path, tpl, scales, threshold)
+        if m is not None:
+            return m
+        best = None
+        sh, sw = ctx.small.shape[:2]
+        for s in scales:
+            st = small_tpl if s == 1.0 else cv2.resize(small_tpl, None, fx=s, fy=s, interpolation=cv2.INTER_AREA)
+            if st.shape[0] >= sh or st.shape[1] >= sw or min(st.shape[:2]) < 4:
+                continue
+            r = cv2.matchTemplate(ctx.small, st, cv2.TM_CCOEFF_NORMED)
+            _min, coarse, _minl, loc = cv2.minMaxLoc(r)
+            # the coarse pass is blurrier than the real match; only clear misses are skipped
+            if coarse < threshold - 0.25:
+                continue
+            if best is None or coarse > best[0]:
+                best = (coarse, loc, s)
+        if best is None:
+            self.stats['miss'] += 1
+            return None
+        _coarse, (lx, ly), s = best
+        m = self._refine(ctx, path, tpl, s, int(lx / self.scale), int(ly / self.scale), threshold,
+                         int(round(2 / self.scale)) + 2)
+        if m is None:
+            self.stats['miss'] += 1
+            return None
+        self.stats['template'] += 1
+        m['via'] = 'template'
+        return m
+
+    # Persistence: entries are keyed by the template's name relative to control_dir and
+    # its mtime, so a replaced template never reuses fingerprints learned from the old one.
+    def save(self, path):
+        data = []
+        for (tpath, s), ent in self._fp.items():
+            t = self._tpl.get(tpath)
+            if t is None:
+                continue
+            data.append({'template': os.path.relpath(tpath, self.control_dir), 'mtime': t[0], 'scale': s,
+                         'rect': list(ent['rect']), 'frame': list(ent['frame']),
+                         'fp': [round(float(v), 5) for v in ent['fp']]})
+        try:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+        except Exception:
+            pass
+
+    def load(self, path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception:
+            return 0
+        n = 0
+        for d in data:
+            try:
+                tpath = self._path(d['template'])
+                t = self._template(tpath)
+                fp = np.asarray(d['fp'], dtype=np.float32)
+                if t is None or t[0] != d['mtime'] or fp.size != self.fp_size[0] * self.fp_size[1]:
+                    continue
+                # unverified this run: the first fast-path hit is checked at full resolution
+                self._fp[(tpath, float(d['scale']))] = {'rect': tuple(d['rect']), 'fp': fp,
+                                                       'frame': tuple(d['frame']), 'hits': self.verify_every,
+                                                       't': 0.0}
+                n += 1
+            except Exception:
+                continue
+        return n
+
+    def classify(self, img, screens=None, threshold=0.85):
+        """All screens visible in img, best first: [(name, confidence, match)]."""
+        ctx = self.context(img)
+        found = []
+        for name, files in (screens or KNOWN_SCREENS).items():
+            best = None
+            for fn in files:
+                m = self.match(ctx, fn, threshold)
+                if m and (best is None or m['score'] > best['score']):
+                    best = m
+            if best:
+                found.append((name, best['score'], best))
+        found.sort(key=lambda t: -t[1])
+        return found
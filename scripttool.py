@@ -0,0 +1,859 @@
+import os
+import sys
+import json
+import time
+import struct
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+
+from keymap import vk_from_key_name
+
+
+# ------------------------------
+# Compact binary action scripts (.actb)
+# ------------------------------
+# Layout: MAGIC | u16 version | u16 reserved | u32 header_len | header JSON (utf-8)
+#         | padding to 8 bytes | N fixed-size little-endian records
+# The header carries the script name, the key-name table, the checkpoint table
+# and the record dtype, so the records can be memory-mapped straight into numpy columns.
+MAGIC = b'JJAS'
+BIN_VERSION = 4  # 2: mouse_move records (dx/dy columns); 3: checkpoint records; 4: speed records
+BIN_EXT = '.actb'
+
+KIND_KEY = 1
+KIND_MOUSE = 2
+# timed down/up events (chord recordings); 't' holds their recording time
+KIND_KEY_DOWN = 3
+KIND_KEY_UP = 4
+KIND_MOUSE_DOWN = 5
+KIND_MOUSE_UP = 6
+KIND_MOUSE_MOVE = 7
+# 'key' indexes header['checkpoints'] (1-based), 'hold' holds the timeout
+KIND_CHECKPOINT = 8
+# 'hold' holds the factor; 'button' the optional holds flag (0 = not given, 1 = False, 2 = True)
+KIND_SPEED = 9
+KIND_NAMES = {KIND_KEY: 'key', KIND_MOUSE: 'mouse', KIND_KEY_DOWN: 'key_down', KIND_KEY_UP: 'key_up',
+              KIND_MOUSE_DOWN: 'mouse_down', KIND_MOUSE_UP: 'mouse_up', KIND_MOUSE_MOVE: 'mouse_move',
+              KIND_CHECKPOINT: 'checkpoint', KIND_SPEED: 'speed'}
+KIND_CODES = {v: k for k, v in KIND_NAMES.items()}
+BUTTONS = ['', 'left', 'right']
+
+EVENT_TYPES = ('key_down', 'key_up', 'mouse_down', 'mouse_up', 'mouse_move')
+INPUT_TYPES = ('key', 'mouse') + EVENT_TYPES
+
+RECORD_DTYPE = np.dtype([
+    ('t', '<f8'),       # start time of the step from route start; recording time for events
+    ('kind', 'u1'),     # KIND_*
+    ('key', 'u1'),      # index into header['keys'] (0 = none); into header['checkpoints'] for checkpoints
+    ('button', 'u1'),   # index into BUTTONS (0 = none)
+    ('hold', '<f4'),    # duration the key/button is held; checkpoint timeout; speed factor
+    ('delay', '<f4'),   # idle time after the step
+    ('dx', '<i2'),      # relative cursor movement (mouse_move only)
+    ('dy', '<i2'),
+])
+
+
+def _header_prefix_size():
+    return len(MAGIC) + struct.calcsize('<HHI')
+
+
+def steps_to_records(steps):
+    """Pack JSON-style step dicts into a record array. Returns (records, key_table, checkpoint_table)."""
+    keys = ['']
+    key_index = {}
+    checkpoints = ['']
+    rec = np.zeros(len(steps), dtype=RECORD_DTYPE)
+    t = 0.0
+    for i, st in enumerate(steps):
+        kind = st.get('type')
+        hold = max(0.0, float(st.get('hold', 0) or 0))
+        delay = max(0.0, float(st.get('delay', 0) or 0))
+        rec['t'][i] = float(st.get('t', 0)) if kind in EVENT_TYPES else t
+        rec['hold'][i] = hold
+        rec['delay'][i] = delay
+        if kind in ('key', 'key_down', 'key_up'):
+            name = str(st.get('key', '')).strip().lower()
+            if name not in key_index:
+                if len(keys) >= 256:
+                    raise ValueError('按键种类超过 255 个')
+                key_index[name] = len(keys)
+                keys.append(name)
+            rec['kind'][i] = KIND_CODES[kind]
+            rec['key'][i] = key_index[name]
+        elif kind in ('mouse', 'mouse_down', 'mouse_up'):
+            btn = str(st.get('button', 'left')).strip().lower()
+            if btn not in BUTTONS[1:]:
+                raise ValueError(f"第{i+1}步: 不支持的鼠标按键 {btn}")
+            rec['kind'][i] = KIND_CODES[kind]
+            rec['button'][i] = BUTTONS.index(btn)
+        elif kind == 'mouse_move':
+            rec['kind'][i] = KIND_MOUSE_MOVE
+            rec['dx'][i] = int(st.get('dx', 0))
+            rec['dy'][i] = int(st.get('dy', 0))
+        elif kind == 'checkpoint':
+            tpl = str(st.get('template', '')).strip()
+            if not tpl:
+                raise ValueError(f"第{i+1}步: checkpoint 缺少 template")
+            if len(checkpoints) >= 256:
+                raise ValueError('检查点超过 255 个')
+            # template, on_fail, threshold, region: everything but the timing fields
+            cp = {k: v for k, v in st.items() if k not in ('type', 'timeout', 'delay', 'hold', 't')}
+            cp['template'] = tpl
+            rec['kind'][i] = KIND_CHECKPOINT
+            rec['key'][i] = len(checkpoints)
+            rec['hold'][i] = hold = max(0.0, float(st.get('timeout', 3.0)))
+            checkpoints.append(cp)
+            t += delay
+            continue
+        elif kind == 'speed':
+            factor = float(st.get('factor', 1.0))
+            if factor <= 0:
+                raise ValueError(f"第{i+1}步: speed factor 必须大于 0")
+            rec['kind'][i] = KIND_SPEED
+            rec['hold'][i] = factor
+            if 'holds' in st:
+                rec['button'][i] = 2 if st['holds'] else 1
+            t += delay
+            continue
+        else:
+            raise ValueError(f"第{i+1}步: 未知动作类型 {kind}")
+        t += hold + delay
+    return rec, keys, checkpoints
+
+
+def write_binary(path, name, steps):
+    rec, keys, checkpoints = steps_to_records(steps)
+    header = json.dumps({
+        'name': name,
+        'count': int(len(rec)),
+        'keys': keys,
+        'checkpoints': checkpoints,
+        'dtype': RECORD_DTYPE.descr,
+    }, ensure_ascii=False).encode('utf-8')
+    pre = _header_prefix_size()
+    pad = (-(pre + len(header))) % 8
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<HHI', BIN_VERSION, 0, len(header) + pad))
+        f.write(header)
+        f.write(b' ' * pad)
+        f.write(rec.tobytes())
+    os.replace(tmp, path)
+
+
+def read_binary(path, mmap=True):
+    """Return (header dict, record array). Records are memory-mapped by default."""
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"不是动作二进制文件: {path}")
+        version, _reserved, hlen = struct.unpack('<HHI', f.read(struct.calcsize('<HHI')))
+        if version > BIN_VERSION:
+            raise ValueError(f"不支持的二进制版本 {version}")
+        header = json.loads(f.read(hlen).decode('utf-8').rstrip())
+    dtype = np.dtype([tuple(d) for d in header['dtype']])
+    offset = _header_prefix_size() + hlen
+    count = int(header['count'])
+    if count == 0:
+        return header, np.zeros(0, dtype=dtype)
+    if mmap:
+        rec = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(count,))
+    else:
+        rec = np.fromfile(path, dtype=dtype, count=count, offset=offset)
+    return header, rec
+
+
+class BinarySteps:
+    """Read-only sequence view over .actb records that play_actions can iterate.
+
+    Each step dict is built only when that step is reached, so loading a long
+    recording allocates no per-step Python objects.
+    """
+
+    def __init__(self, header, records):
+        self.header = header
+        self.records = records
+        self.keys = header.get('keys', [''])
+        self.checkpoints = header.get('checkpoints', [''])
+        kinds = records['kind']
+        self.has_events = bool(len(records)) and bool(np.any((kinds >= KIND_KEY_DOWN) & (kinds <= KIND_MOUSE_MOVE)))
+        self.has_checkpoints = bool(np.any(kinds == KIND_CHECKPOINT))
+        self.has_speed = bool(np.any(kinds == KIND_SPEED))
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, i):
+        r = self.records[i]
+        kind = int(r['kind'])
+        # float32 columns: round back to the recorder's millisecond precision
+        step = {'type': KIND_NAMES.get(kind, str(kind)),
+                'hold': round(float(r['hold']), 4), 'delay': round(float(r['delay']), 4)}
+        if kind == KIND_CHECKPOINT:
+            step.update(self.checkpoints[int(r['key'])])
+            step['timeout'] = step.pop('hold')
+            return step
+        if kind == KIND_SPEED:
+            step['factor'] = step.pop('hold')
+            if int(r['button']):
+                step['holds'] = int(r['button']) == 2
+            return step
+        if kind in (KIND_KEY, KIND_KEY_DOWN, KIND_KEY_UP):
+            step['key'] = self.keys[int(r['key'])]
+        elif kind == KIND_MOUSE_MOVE:
+            step['dx'] = int(r['dx'])
+            step['dy'] = int(r['dy'])
+        else:
+            step['button'] = BUTTONS[int(r['button'])]
+        if kind >= KIND_KEY_DOWN:
+            step['t'] = round(float(r['t']), 4)
+            del step['hold']
+        return step
+
+    def __iter__(self):
+        for i in range(len(self.records)):
+            yield self[i]
+
+    def total_duration(self):
+        if not len(self.records):
+            return 0.0
+        if self.has_events:
+            return script_duration(self)
+        return self.untimed_duration()
+
+    def untimed_duration(self, speed=1.0, scale_holds=False):
+        """script_duration for scripts without timed events, on the columns.
+
+        Only key/mouse holds count (the hold column of checkpoints is their
+        timeout, of speed records their factor). A speed record sets the
+        factor for itself and every later step, as in play_actions.
+        """
+        rec = self.records
+        kinds = rec['kind']
+        hold = np.where(np.isin(kinds, (KIND_KEY, KIND_MOUSE)), rec['hold'], 0.0).astype(np.float64)
+        delay = rec['delay'].astype(np.float64)
+        if not self.has_speed:
+            factor = max(0.05, float(speed))
+            return float(hold.sum() / factor if scale_holds else hold.sum()) + float(delay.sum()) / factor
+        is_speed = kinds == KIND_SPEED
+        seg = np.cumsum(is_speed)               # index of the speed segment each step is in
+        seg_factor = np.concatenate(([float(speed)], float(speed) * rec['hold'][is_speed].astype(np.float64)))
+        flags = rec['button'][is_speed]
+        seg_holds = np.concatenate(([bool(scale_holds)], np.where(flags == 0, bool(scale_holds), flags == 2)))
+        factor = np.maximum(0.05, seg_factor[seg])
+        hold = np.where(seg_holds[seg], hold / factor, hold)
+        return float(hold.sum() + (delay / factor).sum())
+
+
+def load_binary_steps(path, mmap=True):
+    """BinarySteps over the records; mmap=False reads them into memory and leaves no mapping open."""
+    header, rec = read_binary(path, mmap=mmap)
+    return BinarySteps(header, rec)
+
+
+def json_to_binary(json_path, out_path=None):
+    with open(json_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    out_path = out_path or os.path.splitext(json_path)[0] + BIN_EXT
+    name = data.get('name') or os.path.splitext(os.path.basename(json_path))[0]
+    write_binary(out_path, name, data.get('steps', []))
+    return out_path
+
+
+def binary_to_json(bin_path, out_path=None):
+    steps = load_binary_steps(bin_path)
+    out_path = out_path or os.path.splitext(bin_path)[0] + '.json'
+    data = {'name': steps.header.get('name', ''), 'steps': list(steps)}
+    with open(out_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    return out_path
+
+
+# ------------------------------
+# Timeline (shared with main.play_actions)
+# ------------------------------
+def scaled_step(st, factor, holds_too):
+    """(hold, delay) of a step after applying the playback speed factor."""
+    hold = max(0.0, float(st.get('hold', 0)))
+    delay = max(0.0, float(st.get('delay', 0)))
+    if holds_too:
+        hold /= factor
+    return hold, delay / factor
+
+
+def event_due(anchor, cursor, st, factor):
+    """Due time of a timed down/up event and the (cursor, t) anchor of its run.
+
+    The first event of a run is due at `cursor`; later ones keep their
+    recorded spacing, divided by the speed factor.
+    """
+    t = float(st.get('t', 0))
+    if anchor is None:
+        anchor = (cursor, t)
+    return anchor[0] + max(0.0, t - anchor[1]) / factor, anchor
+
+
+def event_arg(st):
+    """Argument of a timed event: key name, button, or (dx, dy) for mouse_move."""
+    kind = st.get('type')
+    if kind == 'mouse_move':
+        return (int(st.get('dx', 0)), int(st.get('dy', 0)))
+    if kind.startswith('key'):
+        return st['key']
+    return st.get('button', 'left')
+
+
+def expected_timeline(steps, speed=1.0, scale_holds=False):
+    """Input events play_actions should emit: list of (seconds from start, event, arg).
+
+    Mirrors play_actions' scheduling (activation click, speed segments, holds,
+    delays and timed events) without sending anything; checkpoints count as
+    zero-time.
+    """
+    events = []
+    t = 0.0
+    first = next((s for s in steps if s.get('type') in INPUT_TYPES), None)
+    if first and first.get('type') in ('key', 'key_down', 'key_up'):
+        events.append((0.0, 'activate', None))
+        t = 0.05
+    factor, holds_too = max(0.05, float(speed)), scale_holds
+    anchor = None
+    held = set()
+    for st in steps:
+        kind = st.get('type')
+        if kind in EVENT_TYPES:
+            due, anchor = event_due(anchor, t, st, factor)
+            arg = event_arg(st)
+            events.append((due, kind, arg))
+            if kind.endswith('_down'):
+                held.add((kind, arg))
+            elif kind.endswith('_up'):
+                held.discard((kind[:-3] + '_down', arg))
+            _hold, delay = scaled_step(st, factor, holds_too)
+            t = due + delay
+            if delay:
+                anchor = None
+            continue
+        anchor = None
+        if kind == 'speed':
+            factor = max(0.05, float(speed) * float(st.get('factor', 1.0)))
+            holds_too = bool(st.get('holds', scale_holds))
+        hold, delay = scaled_step(st, factor, holds_too)
+        if kind == 'key':
+            events.append((t, 'key_down', st['key']))
+            events.append((t + hold, 'key_up', st['key']))
+        elif kind == 'mouse':
+            btn = st.get('button', 'left')
+            events.append((t, 'mouse_down', btn))
+            events.append((t + hold, 'mouse_up', btn))
+        elif kind != 'speed':
+            hold = 0.0
+        t += hold + delay
+    for ev, arg in sorted(held):
+        events.append((t, ev[:-5] + '_up', arg))
+    return events
+
+
+def script_duration(steps, speed=1.0, scale_holds=False):
+    """Seconds play_actions will take for these steps (holds + delays) at `speed`."""
+    if isinstance(steps, BinarySteps) and not steps.has_events:
+        return steps.untimed_duration(speed, scale_holds)
+    t = 0.0
+    factor, holds_too = max(0.05, float(speed)), scale_holds
+    anchor = None
+    for st in steps or []:
+        try:
+            kind = st.get('type')
+            if kind in EVENT_TYPES:
+                due, anchor = event_due(anchor, t, st, factor)
+                _hold, delay = scaled_step(st, factor, holds_too)
+                t = due + delay
+                if delay:
+                    anchor = None
+                continue
+            anchor = None
+            if kind == 'speed':
+                factor = max(0.05, float(speed) * float(st.get('factor', 1.0)))
+                holds_too = bool(st.get('holds', scale_holds))
+            hold, delay = scaled_step(st, factor, holds_too)
+            if kind not in ('key', 'mouse', 'speed'):
+                hold = 0.0
+            t += hold + delay
+        except Exception:
+            pass
+    return t
+
+
+# ------------------------------
+# Static analysis
+# ------------------------------
+def key_dispatch_problem(name):
+    """None if playback can dispatch `name`, else the resolver's error."""
+    try:
+        vk_from_key_name(str(name or ''))
+    except Exception as e:
+        return f'{e}'
+    return None
+
+
+def analyze_steps(steps):
+    """Statistics for one script: duration, per-key hold time and problems."""
+    report = {
+        'steps': len(steps),
+        'duration': script_duration(steps),
+        'key_hold': {},
+        'mouse_hold': {},
+        'bad_keys': [],        # (step no, key, reason)
+        'zero_delay': [],      # step numbers with delay == 0 (except the last step)
+        'zero_hold': [],       # key/mouse step numbers with hold == 0
+        'checkpoints': 0,
+        'unknown_types': [],   # (step no, type)
+        'unpaired': [],        # (step no, event, key/button) for ups without a down, downs never released
+        'max_chord': 0,        # most keys/buttons held at once by timed events
+        'moves': 0,            # mouse_move events
+        'move_path': 0.0,      # total cursor travel of mouse_move events (pixels)
+    }
+    last = len(steps) - 1
+    down_at = {}
+    for i, st in enumerate(steps):
+        kind = st.get('type')
+        hold = max(0.0, float(st.get('hold', 0) or 0))
+        delay = max(0.0, float(st.get('delay', 0) or 0))
+        if kind == 'mouse_move':
+            report['moves'] += 1
+            report['move_path'] += float(np.hypot(float(st.get('dx', 0)), float(st.get('dy', 0))))
+            continue
+        if kind in EVENT_TYPES:
+            is_key = kind.startswith('key')
+            arg = str(st.get('key' if is_key else 'button', '' if is_key else 'left')).strip().lower()
+            slot = (is_key, arg)
+            if is_key and kind == 'key_down':
+                problem = key_dispatch_problem(arg)
+                if problem:
+                    report['bad_keys'].append((i + 1, arg, problem))
+            if kind.endswith('_down'):
+                if slot not in down_at:
+                    down_at[slot] = (i + 1, float(st.get('t', 0)))
+                report['max_chord'] = max(report['max_chord'], len(down_at))
+            elif slot in down_at:
+                _no, t0 = down_at.pop(slot)
+                table = report['key_hold' if is_key else 'mouse_hold']
+                table[arg] = table.get(arg, 0.0) + max(0.0, float(st.get('t', 0)) - t0)
+            else:
+                report['unpaired'].append((i + 1, kind, arg))
+            continue
+        if kind == 'key':
+            key = str(st.get('key', '')).strip().lower()
+            report['key_hold'][key] = report['key_hold'].get(key, 0.0) + hold
+            problem = key_dispatch_problem(key)
+            if problem:
+                report['bad_keys'].append((i + 1, key, problem))
+        elif kind == 'mouse':
+            btn = str(st.get('button', 'left')).lower()
+            report['mouse_hold'][btn] = report['mouse_hold'].get(btn, 0.0) + hold
+        elif kind == 'checkpoint':
+            report['checkpoints'] += 1
+        elif kind != 'speed':
+            report['unknown_types'].append((i + 1, kind))
+        if kind in ('key', 'mouse') and hold == 0:
+            report['zero_hold'].append(i + 1)
+        if delay == 0 and i != last:
+            report['zero_delay'].append(i + 1)
+    for (is_key, arg), (no, _t0) in down_at.items():
+        report['unpaired'].append((no, 'key_down' if is_key else 'mouse_down', arg))
+    return report
+
+
+def load_any(path):
+    """Steps of a JSON or .actb script (raw JSON dicts, not validated)."""
+    if path.lower().endswith(BIN_EXT):
+        return list(load_binary_steps(path))
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f).get('steps', [])
+
+
+def _fmt_nums(nums, limit=8):
+    txt = ', '.join(str(n) for n in nums[:limit])
+    return txt + (f' …(共{len(nums)})' if len(nums) > limit else '')
+
+
+def analyze_mode(mode_dir, export_path=None):
+    """Print a report for every script in mode_dir. Returns the number of scripts with bad keys."""
+    files = sorted(f for f in os.listdir(mode_dir) if f.lower().endswith(('.json', BIN_EXT)))
+    if not files:
+        print(f"{mode_dir} 下没有脚本")
+        return 0
+    bad = 0
+    timelines = {}
+    for fn in files:
+        path = os.path.join(mode_dir, fn)
+        try:
+            steps = load_any(path)
+        except Exception as e:
+            print(f"[{fn}] 读取失败: {e}")
+            bad += 1
+            continue
+        r = analyze_steps(steps)
+        print(f"[{fn}] {r['steps']} 步, 预计时长 {r['duration']:.2f}s, 检查点 {r['checkpoints']}")
+        holds = ', '.join(f"{k}={v:.2f}s" for k, v in sorted(r['key_hold'].items(), key=lambda kv: -kv[1]))
+        print(f"    按键按住: {holds or '无'}")
+        if r['mouse_hold']:
+            print(f"    鼠标按住: {', '.join(f'{k}={v:.2f}s' for k, v in r['mouse_hold'].items())}")
+        for no, key, why in r['bad_keys']:
+            print(f"    ✗ 第{no}步 按键 '{key}': {why}")
+        for no, kind in r['unknown_types']:
+            print(f"    ✗ 第{no}步 未知动作类型 {kind}")
+        if r['zero_delay']:
+            print(f"    ! 延迟为 0 的步骤: {_fmt_nums(r['zero_delay'])}")
+        if r['zero_hold']:
+            print(f"    ! 按住为 0 的步骤: {_fmt_nums(r['zero_hold'])}")
+        if r['moves']:
+            print(f"    鼠标移动: {r['moves']} 个事件, 累计 {r['move_path']:.0f} px")
+        if r['max_chord'] > 1:
+            print(f"    同时按住最多 {r['max_chord']} 个键")
+        for no, ev, arg in r['unpaired'][:8]:
+            print(f"    ! 第{no}步 {ev} {arg} 没有配对（回放结束时会自动松开）")
+        if r['bad_keys'] or r['unknown_types']:
+            bad += 1
+        name = os.path.splitext(fn)[0]
+        timelines[name] = {
+            'duration': round(r['duration'], 3),
+            'events': [[round(t, 3), ev, arg] for t, ev, arg in expected_timeline(steps)
+                       if ev != 'activate'] if not (r['bad_keys'] or r['unknown_types']) else [],
+        }
+    if export_path:
+        with open(export_path, 'w', encoding='utf-8') as f:
+            json.dump(timelines, f, ensure_ascii=False, indent=2)
+        print(f"已导出时间轴: {export_path}")
+    return bad
+
+
+# ------------------------------
+# Post-processing (idle trim, merges, outlier delays)
+# ------------------------------
+def _num(st, name):
+    return max(0.0, float(st.get(name, 0) or 0))
+
+
+def _cap_limits(values, cap_factor, cap_min, window):
+    """Per-value upper bound: cap_factor x the median of its neighbours (at least cap_min)."""
+    limits = []
+    for i in range(len(values)):
+        near = values[max(0, i - window):i] + values[i + 1:i + 1 + window]
+        med = float(np.median(near)) if near else 0.0
+        limits.append(max(cap_min, cap_factor * med))
+    return limits
+
+
+def _clean_sequential(steps, stats, merge_gap, cap_factor, cap_min, window):
+    # key/mouse steps: the player holds, then waits 'delay' with nothing pressed
+    out = []
+    for st in steps:
+        if st.get('type') == 'key' and _num(st, 'hold') == 0:
+            # keep the timeline: the dropped step's delay goes to its predecessor
+            if out:
+                out[-1]['delay'] = round(_num(out[-1], 'delay') + _num(st, 'delay'), 3)
+            stats['zero_hold'] += 1
+            continue
+        prev = out[-1] if out else None
+        if (prev is not None and st.get('type') == 'key' and prev.get('type') == 'key'
+                and prev.get('key') == st.get('key') and _num(prev, 'delay') <= merge_gap):
+            prev['hold'] = round(_num(prev, 'hold') + _num(prev, 'delay') + _num(st, 'hold'), 3)
+            prev['delay'] = _num(st, 'delay')
+            stats['merged'] += 1
+            continue
+        out.append(st)
+    idx = [i for i, st in enumerate(out) if st.get('type') in ('key', 'mouse')]
+    delays = [_num(out[i], 'delay') for i in idx]
+    for i, d, lim in zip(idx, delays, _cap_limits(delays, cap_factor, cap_min, window)):
+        if d > lim:
+            out[i]['delay'] = round(lim, 3)
+            stats['capped'] += 1
+            stats['capped_s'] += d - lim
+    return out
+
+
+def _clean_events(run, stats, merge_gap, cap_factor, cap_min, window):
+    # one run of timed events; gaps are only shortened while nothing is held
+    drop = set()
+    for i, st in enumerate(run):
+        kind = st.get('type')
+        if kind not in ('key_down', 'key_up') or i in drop:
+            continue
+        j = next((j for j in range(i + 1, len(run))
+                  if run[j].get('type') in ('key_down', 'key_up') and run[j].get('key') == st.get('key')), None)
+        if j is None or j in drop:
+            continue
+        gap = float(run[j].get('t', 0)) - float(st.get('t', 0))
+        if kind == 'key_down' and run[j]['type'] == 'key_up' and gap <= 0:
+            drop.update((i, j))
+            stats['zero_hold'] += 1
+        elif kind == 'key_up' and run[j]['type'] == 'key_down' and gap <= merge_gap:
+            # release + re-press of the same key: one continuous hold
+            drop.update((i, j))
+            stats['merged'] += 1
+    run = [st for i, st in enumerate(run) if i not in drop]
+    if not run:
+        return run
+    times = [float(st.get('t', 0)) for st in run]
+    held = set()
+    idle = []   # (index of the event after the gap, gap) for gaps with nothing held
+    for i, st in enumerate(run):
+        if i and not held:
+            idle.append((i, times[i] - times[i - 1]))
+        kind = st.get('type')
+        arg = st.get('key') if kind.startswith('key') else st.get('button')
+        if kind.endswith('_down'):
+            held.add((kind[:-5], arg))
+        elif kind.endswith('_up'):
+            held.discard((kind[:-3], arg))
+    cut = [0.0] * len(run)
+    gaps = [g for _i, g in idle]
+    for (i, g), lim in zip(idle, _cap_limits(gaps, cap_factor, cap_min, window)):
+        if g > lim:
+            cut[i] = g - lim
+            stats['capped'] += 1
+            stats['capped_s'] += g - lim
+    # re-anchor the run at t=0; playback starts a run at its first event anyway,
+    # so the lead-in was never played and is not counted as saved time
+    shift = times[0]
+    out = []
+    for i, st in enumerate(run):
+        shift += cut[i]
+        st = dict(st)
+        st['t'] = round(times[i] - shift, 3)
+        out.append(st)
+    return out
+
+
+def clean_steps(steps, merge_gap=0.03, cap_factor=4.0, cap_min=1.5, window=5):
+    """Tidy a raw recording. Returns (steps, stats).
+
+    - zero-length key holds are dropped (their delay is kept),
+    - back-to-back presses of the same key within merge_gap become one hold,
+    - idle delays longer than cap_factor x the median of their neighbours
+      (and above cap_min) are capped,
+    - timed event runs are re-anchored at t=0 and the trailing delay after
+      the last step is trimmed (stats['trimmed_s'] counts only the latter:
+      playback never waited for the lead-in of a run).
+    Checkpoint and speed steps split the script into independent segments.
+    """
+    stats = {'zero_hold': 0, 'merged': 0, 'capped': 0, 'capped_s': 0.0, 'trimmed_s': 0.0}
+    out = []
+    seg = []
+
+    def flush():
+        if not seg:
+            return
+        if seg[0].get('type') in EVENT_TYPES:
+            out.extend(_clean_events(seg, stats, merge_gap, cap_factor, cap_min, window))
+        else:
+            out.extend(_clean_sequential(seg, stats, merge_gap, cap_factor, cap_min, window))
+        seg.clear()
+
+    for st in steps:
+        st = dict(st)
+        kind = st.get('type')
+        if kind not in ('key', 'mouse') + EVENT_TYPES:
+            flush()
+            out.append(st)
+            continue
+        if seg and (kind in EVENT_TYPES) != (seg[0].get('type') in EVENT_TYPES):
+            flush()
+        seg.append(st)
+    flush()
+    if out and out[-1].get('type') in ('key', 'mouse') and _num(out[-1], 'delay') > 0:
+        stats['trimmed_s'] += _num(out[-1], 'delay')
+        out[-1]['delay'] = 0.0
+    return out, stats
+
+
+def clean_report(name, before, after, stats):
+    d0, d1 = script_duration(before), script_duration(after)
+    saved = d0 - d1
+    return (f"[{name}] {len(before)} -> {len(after)} 步, 时长 {d0:.2f}s -> {d1:.2f}s "
+            f"(-{saved:.2f}s, {100.0 * saved / d0 if d0 else 0.0:.1f}%) | "
+            f"零按住 {stats['zero_hold']}, 合并 {stats['merged']}, "
+            f"截断延迟 {stats['capped']} 处 {stats['capped_s']:.2f}s, 尾部空闲 {stats['trimmed_s']:.2f}s")
+
+
+def clean_mode(mode_dir, write=False, **kw):
+    """Clean every script in mode_dir; with write=True rewrite them, keeping a .bak copy."""
+    files = sorted(f for f in os.listdir(mode_dir) if f.lower().endswith(('.json', BIN_EXT)))
+    for fn in files:
+        path = os.path.join(mode_dir, fn)
+        try:
+            steps = load_any(path)
+            cleaned, stats = clean_steps(steps, **kw)
+        except Exception as e:
+            print(f"[{fn}] 处理失败: {e}")
+            continue
+        print(clean_report(fn, steps, cleaned, stats))
+        if not write or cleaned == steps:
+            continue
+        shutil.copy2(path, path + '.bak')
+        if path.lower().endswith(BIN_EXT):
+            name = load_binary_steps(path).header.get('name', os.path.splitext(fn)[0])
+            write_binary(path, name, cleaned)
+        else:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            data['steps'] = cleaned
+            tmp = path + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, path)
+    if not write:
+        print("（预览，未修改文件；加 --write 写回，原文件保存为 .bak）")
+
+
+# ------------------------------
+# Benchmark
+# ------------------------------
+def _synthetic_steps(n):
+    rng = np.random.default_rng(0)
+    keys = ['w', 'a', 's', 'd', 'space', 'shift', '1', '2']
+    steps = []
+    for i in range(n):
+        if i % 500 == 250:
+            # time-scaled segments, so the round trip covers speed records too
+            steps.append({'type': 'speed', 'factor': 1.5 if i % 1000 == 250 else 1.0, 'holds': i % 1000 == 250})
+        elif i % 17 == 0:
+            steps.append({'type': 'mouse', 'button': 'left', 'hold': 0.05,
+                          'delay': round(float(rng.uniform(0, 0.3)), 3)})
+        else:
+            steps.append({'type': 'key', 'key': keys[i % len(keys)],
+                          'hold': round(float(rng.uniform(0, 1.5)), 3),
+                          'delay': round(float(rng.uniform(0, 0.5)), 3)})
+    return steps
+
+
+def bench_load(json_path, repeat=5):
+    # the binary goes to a temp dir: next to the source it would be picked up as a second script
+    tmp_dir = tempfile.mkdtemp(prefix='actb_bench_')
+    try:
+        _bench_load(json_path, os.path.join(tmp_dir, os.path.basename(os.path.splitext(json_path)[0]) + BIN_EXT),
+                    repeat)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def roundtrip_problems(steps, bin_steps, tol=1e-3):
+    """Differences between JSON steps and their .actb decoding: [(step no, field, json, binary)]."""
+    out = []
+    if len(steps) != len(bin_steps):
+        out.append((0, 'count', len(steps), len(bin_steps)))
+    for i, (a, b) in enumerate(zip(steps, bin_steps)):
+        for k in set(a) | set(b):
+            va, vb = a.get(k), b.get(k)
+            if k in ('hold', 'delay', 't') and k not in a and not vb:
+                continue    # zero-filled columns the JSON step left out
+            if isinstance(va, (int, float)) and not isinstance(va, bool) and isinstance(vb, (int, float)):
+                if abs(float(va) - float(vb)) <= tol:
+                    continue
+            elif va == vb:
+                continue
+            out.append((i + 1, k, va, vb))
+    return out
+
+
+def _bench_load(json_path, bin_path, repeat):
+    json_to_binary(json_path, bin_path)
+    with open(json_path, 'r', encoding='utf-8') as f:
+        src_steps = json.load(f).get('steps', [])
+    diff = roundtrip_problems(src_steps, load_binary_steps(bin_path))
+    if diff:
+        print(f"往返校验: {len(diff)} 处不一致")
+        for no, k, va, vb in diff[:10]:
+            print(f"    第{no}步 {k}: JSON={va!r} ACTB={vb!r}")
+    else:
+        print(f"往返校验: {len(src_steps)} 步一致")
+
+    def _best(fn):
+        best = None
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            fn()
+            dt = time.perf_counter() - t0
+            best = dt if best is None else min(best, dt)
+        return best
+
+    def _load_json():
+        with open(json_path, 'r', encoding='utf-8') as f:
+            steps = json.load(f).get('steps', [])
+        return sum(float(s.get('hold', 0)) + float(s.get('delay', 0)) for s in steps)
+
+    def _load_bin():
+        return load_binary_steps(bin_path).total_duration()
+
+    tj = _best(_load_json)
+    tb = _best(_load_bin)
+    sj = os.path.getsize(json_path)
+    sb = os.path.getsize(bin_path)
+    print(f"JSON : {sj / 1024:.0f} KiB, 加载+求时长 {tj * 1000:.2f} ms")
+    print(f"ACTB : {sb / 1024:.0f} KiB, 加载+求时长 {tb * 1000:.2f} ms")
+    print(f"加速 {tj / max(tb, 1e-9):.1f}x, 体积 {sb / max(sj, 1):.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="动作脚本工具")
+    sub = parser.add_subparsers(dest='cmd', required=True)
+
+    p = sub.add_parser('to-bin', help="JSON 转紧凑二进制 (.actb)")
+    p.add_argument('src')
+    p.add_argument('dst', nargs='?')
+
+    p = sub.add_parser('to-json', help="紧凑二进制 (.actb) 转 JSON")
+    p.add_argument('src')
+    p.add_argument('dst', nargs='?')
+
+    p = sub.add_parser('bench', help="对比 JSON 与 .actb 的加载耗时")
+    p.add_argument('src', nargs='?', help="JSON 脚本；省略时生成合成录制")
+    p.add_argument('--steps', type=int, default=200000, help="合成录制的步数")
+    p.add_argument('--repeat', type=int, default=5)
+
+    p = sub.add_parser('analyze', help="静态分析某模式下的全部脚本")
+    p.add_argument('mode', help="模式名（json/<mode>）或脚本目录")
+    p.add_argument('--export', nargs='?', const='', default=None,
+                   help="导出各脚本的预期时间轴 JSON（默认 timeline_<mode>.json）")
+
+    p = sub.add_parser('clean', help="整理录制：去除首尾空闲、合并重复按键、去掉零按住、截断异常延迟")
+    p.add_argument('mode', help="模式名（json/<mode>）或脚本目录")
+    p.add_argument('--write', action='store_true', help="写回文件（原文件另存为 .bak）")
+    p.add_argument('--merge-gap', type=float, default=0.03, help="同键松开到再按下不超过该秒数时合并")
+    p.add_argument('--cap-factor', type=float, default=4.0, help="延迟超过相邻中位数的倍数即截断")
+    p.add_argument('--cap-min', type=float, default=1.5, help="截断后的最小延迟（秒）")
+
+    args = parser.parse_args()
+    if args.cmd == 'clean':
+        base = os.path.dirname(os.path.abspath(__file__))
+        mode_dir = args.mode if os.path.isdir(args.mode) else os.path.join(base, 'json', args.mode)
+        clean_mode(mode_dir, args.write, merge_gap=args.merge_gap, cap_factor=args.cap_factor, cap_min=args.cap_min)
+        return 0
+    if args.cmd == 'analyze':
+        base = os.path.dirname(os.path.abspath(__file__))
+        mode_dir = args.mode if os.path.isdir(args.mode) else os.path.join(base, 'json', args.mode)
+        export = args.export
+        if export == '':
+            export = os.path.join(base, f"timeline_{os.path.basename(os.path.normpath(mode_dir))}.json")
+        return 1 if analyze_mode(mode_dir, export) else 0
+    if args.cmd == 'to-bin':
+        print(f"已写入 {json_to_binary(args.src, args.dst)}")
+    elif args.cmd == 'to-json':
+        print(f"已写入 {binary_to_json(args.src, args.dst)}")
+    elif args.cmd == 'bench':
+        src = args.src
+        if not src:
+            src = os.path.join(tempfile.mkdtemp(), 'synthetic.json')
+            with open(src, 'w', encoding='utf-8') as f:
+                json.dump({'name': 'synthetic', 'steps': _synthetic_steps(args.steps)}, f, ensure_ascii=False, indent=2)
+            print(f"合成录制: {args.steps} 步 -> {src}")
+        bench_load(src, args.repeat)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,229 @@
+import os
+import csv
+import json
+import time
+import bisect
+import threading
+from collections import deque
+
+
+# ------------------------------
+# Per-round phase telemetry
+# ------------------------------
+PHASES = ('wait_likai', 'settle', 'recognize', 'playback', 'result', 'restart')
+PHASE_NAMES = {
+    'wait_likai': '等待进图',
+    'settle': '稳定',
+    'recognize': '识图',
+    'playback': '回放',
+    'result': '等待结算',
+    'restart': '重开',
+}
+COUNTERS = ('captures', 'matches')
+# upper edges (seconds) of the wall-time histogram buckets; one more open bucket above the last
+BUCKETS = (0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 40.0, 80.0, 160.0, 320.0)
+CSV_FIELDS = ('round', 'mode', 'map', 'start', 'end', 'phase', 'wall', 'captures', 'matches')
+
+
+def _stamp(t):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(t)) if t else ''
+
+
+def _pct(values, q):
+    v = sorted(values)
+    return v[int(round(q * (len(v) - 1)))] if v else None
+
+
+class RoundTelemetry:
+    """Wall time, captures and template matches per phase of every round.
+
+    A round runs from one finish_round to the next (the first one from the
+    start of the run). Its phases follow each other: waiting for the in-map
+    marker (likai, including lobby clicks and mihan selection), settling,
+    map recognition, route playback, waiting for the result screen, and
+    restarting (result handling up to the click that starts the next round).
+    Time and counters always go to the open phase, so the phases of a round
+    add up to the whole round.
+
+    Completed rounds are kept for the run; histograms and percentiles cover
+    the last `window` of them. App.loops_done and App.started_at are read
+    from here.
+    """
+
+    def __init__(self, window=200):
+        self.window = int(window)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.mode = None
+        self.started_at = None
+        self.rounds = []
+        self.recent = deque(maxlen=self.window)
+        self._cur = None
+        self._phase = None
+        self._t = 0.0
+        self._exported = 0
+
+    @property
+    def loops_done(self):
+        return len(self.rounds)
+
+    @property
+    def phase(self):
+        return self._phase
+
+    # Recording
+    def _open_round(self, phase):
+        self._cur = {
+            'round': len(self.rounds) + 1,
+            'mode': self.mode,
+            'map': None,
+            'start': time.time(),
+            'end': None,
+            'phases': {p: {'wall': 0.0, 'captures': 0, 'matches': 0} for p in PHASES},
+        }
+        self._phase = phase
+        self._t = time.perf_counter()
+
+    def _charge(self):
+        now = time.perf_counter()
+        if self._cur is not None and self._phase:
+            self._cur['phases'][self._phase]['wall'] += now - self._t
+        self._t = now
+
+    def start_run(self, mode=None):
+        with self._lock:
+            self.reset()
+            self.mode = mode
+            self.started_at = time.time()
+            self._open_round('wait_likai')
+
+    def stop_run(self):
+        """Close the run; the unfinished round is dropped."""
+        with self._lock:
+            self._charge()
+            self._cur = None
+            self._phase = None
+
+    def enter(self, phase):
+        """Charge the time so far to the open phase and switch to `phase`."""
+        if phase not in PHASES:
+            raise ValueError(f'unknown phase: {phase}')
+        with self._lock:
+            if self._cur is None:
+                return
+            self._charge()
+            self._phase = phase
+
+    def count(self, what, n=1):
+        with self._lock:
+            if self._cur is not None and self._phase:
+                self._cur['phases'][self._phase][what] += n
+
+    def set_map(self, name):
+        with self._lock:
+            if self._cur is not None:
+                self._cur['map'] = name
+
+    def end_round(self):
+        """Complete the open round and start the next one (waiting for likai). Returns the finished round."""
+        with self._lock:
+            if self._cur is None:
+                return None
+            self._charge()
+            done = self._cur
+            done['end'] = time.time()
+            for p in done['phases'].values():
+                p['wall'] = round(p['wall'], 3)
+            self.rounds.append(done)
+            self.recent.append(done)
+            self._open_round('wait_likai')
+            return done
+
+    # Statistics
+    def values(self, phase, field='wall', map_name=None):
+        """Per-round values of one phase over the recent rounds (optionally of one map)."""
+        return [r['phases'][phase][field] for r in list(self.recent)
+                if map_name is None or r['map'] == map_name]
+
+    def histogram(self, phase, map_name=None):
+        """[(bucket upper edge or None for the open bucket, rounds)] of the phase's wall time."""
+        counts = [0] * (len(BUCKETS) + 1)
+        for v in self.values(phase, 'wall', map_name):
+            counts[bisect.bisect_left(BUCKETS, v)] += 1
+        return list(zip(BUCKETS + (None,), counts))
+
+    def summary(self, map_name=None):
+        """Per phase: rounds, wall-time mean/p50/p90, mean captures and matches, and the histogram."""
+        out = {}
+        for phase in PHASES:
+            wall = self.values(phase, 'wall', map_name)
+            n = len(wall)
+            out[phase] = {
+                'rounds': n,
+                'wall_mean': round(sum(wall) / n, 3) if n else None,
+                'wall_p50': _pct(wall, 0.5),
+                'wall_p90': _pct(wall, 0.9),
+                'captures_mean': round(sum(self.values(phase, 'captures', map_name)) / n, 2) if n else None,
+                'matches_mean': round(sum(self.values(phase, 'matches', map_name)) / n, 2) if n else None,
+                'histogram': self.histogram(phase, map_name),
+            }
+        return out
+
+    def runs_per_hour(self, hours=8.0, now=None):
+        """Completed rounds per hour over the last `hours` (or since the run started, if later)."""
+        now = time.time() if now is None else now
+        since = now - hours * 3600.0
+        if self.started_at:
+            since = max(since, self.started_at)
+        span = now - since
+        if span <= 0:
+            return 0.0
+        n = sum(1 for r in self.rounds if r['end'] >= since)
+        return n * 3600.0 / span
+
+    def maps(self):
+        return sorted({r['map'] for r in self.recent if r['map']})
+
+    # Export
+    def export_csv(self, path, append=True):
+        """One row per round and phase. With append, only rounds not exported yet are added."""
+        rounds = self.rounds[self._exported:] if append else self.rounds
+        new = not append or not os.path.isfile(path) or os.path.getsize(path) == 0
+        with open(path, 'a' if append else 'w', encoding='utf-8-sig', newline='') as f:
+            w = csv.writer(f)
+            if new:
+                w.writerow(CSV_FIELDS)
+            for r in rounds:
+                for phase in PHASES:
+                    p = r['phases'][phase]
+                    w.writerow((r['round'], r['mode'] or '', r['map'] or '', _stamp(r['start']), _stamp(r['end']),
+                                phase, f"{p['wall']:.3f}", p['captures'], p['matches']))
+        self._exported = len(self.rounds)
+        return len(rounds)
+
+    def export_json(self, path):
+        """Summary (overall and per map) plus every completed round of the run."""
+        data = {
+            'mode': self.mode,
+            'started_at': _stamp(self.started_at),
+            'loops_done': self.loops_done,
+            'runs_per_hour': round(self.runs_per_hour(), 2),
+            'buckets': list(BUCKETS),
+            'summary': self.summary(),
+            'maps': {m: self.summary(m) for m in self.maps()},
+            'rounds': self.rounds,
+        }
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def format_round(r):
+    """One log line for a finished round: total time, map and the time of each phase."""
+    total = sum(p['wall'] for p in r['phases'].values())
+    caps = sum(p['captures'] for p in r['phases'].values())
+    matches = sum(p['matches'] for p in r['phases'].values())
+    parts = ' · '.join(f"{PHASE_NAMES[k]} {r['phases'][k]['wall']:.1f}s" for k in PHASES)
+    where = f"（{r['map']}）" if r['map'] else ''
+    return f"📊 第{r['round']}轮{where} 用时 {total:.1f}s：{parts}｜截图 {caps} 次，匹配 {matches} 次"
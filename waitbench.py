@@ -0,0 +1,83 @@
+import time
+import random
+import argparse
+import threading
+
+from main import wait_for
+
+
+class CountingEvent(threading.Event):
+    """threading.Event that counts how often a waiter was woken up."""
+
+    def __init__(self):
+        super().__init__()
+        self.wakeups = 0
+
+    def wait(self, timeout=None):
+        r = super().wait(timeout)
+        self.wakeups += 1
+        return r
+
+
+def legacy_wait(seconds, stop_event, counter):
+    # the old pattern: while waited < x: time.sleep(0.05)
+    waited = 0.0
+    step = 0.05
+    while waited < seconds and not stop_event.is_set():
+        time.sleep(step)
+        waited += step
+        counter[0] += 1
+
+
+def measure_idle(seconds):
+    ev = threading.Event()
+    counter = [0]
+    t0 = time.perf_counter()
+    legacy_wait(seconds, ev, counter)
+    legacy_elapsed = time.perf_counter() - t0
+
+    cev = CountingEvent()
+    t0 = time.perf_counter()
+    wait_for(seconds, cev)
+    new_elapsed = time.perf_counter() - t0
+    print(f"[空闲唤醒] 旧循环: {counter[0] / legacy_elapsed:.1f} 次/秒, 计时误差 {1000 * (legacy_elapsed - seconds):+.1f} ms")
+    print(f"[空闲唤醒] wait_for: {cev.wakeups / new_elapsed:.2f} 次/秒, 计时误差 {1000 * (new_elapsed - seconds):+.1f} ms")
+
+
+def measure_stop_latency(trials, use_legacy):
+    lat = []
+    for _ in range(trials):
+        ev = threading.Event()
+        done_at = [None]
+
+        def worker():
+            if use_legacy:
+                legacy_wait(10.0, ev, [0])
+            else:
+                wait_for(10.0, ev)
+            done_at[0] = time.perf_counter()
+
+        th = threading.Thread(target=worker, daemon=True)
+        th.start()
+        time.sleep(random.uniform(0.05, 0.2))
+        stop_at = time.perf_counter()
+        ev.set()
+        th.join()
+        lat.append((done_at[0] - stop_at) * 1000.0)
+    lat.sort()
+    name = '旧循环' if use_legacy else 'wait_for'
+    print(f"[停止延迟] {name}: 平均 {sum(lat) / len(lat):.2f} ms, 中位 {lat[len(lat) // 2]:.2f} ms, 最大 {lat[-1]:.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比 50ms 轮询等待与 wait_for 的空闲唤醒次数和停止延迟")
+    parser.add_argument("--idle", type=float, default=3.0, help="空闲等待测量时长（秒）")
+    parser.add_argument("--trials", type=int, default=30, help="停止延迟测量次数")
+    args = parser.parse_args()
+    measure_idle(args.idle)
+    measure_stop_latency(args.trials, use_legacy=True)
+    measure_stop_latency(args.trials, use_legacy=False)
+
+
+if __name__ == "__main__":
+    main()